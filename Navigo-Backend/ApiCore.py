@@ -0,0 +1,193 @@
+import math
+from GoogleMapsApiHandler import normalize_place
+from StopRegistry import stop_registry
+from RouteCatalog import route_catalog, resolve_line
+from LegStops import score_leg, slice_pattern
+from Timetable import timetable, parse_departure_time
+from JourneyPlanner import journey_planner, parse_location
+
+# Request handling shared by FrontendApi.py (Flask) and AsyncFrontendApi.py (Quart). Importing this
+# module has no side effects: each app loads the registry, catalog, timetable and planner itself.
+PLANNERS = ('google', 'raptor')
+
+
+def index_stops(stops_list):
+    """Key fetched stop documents on StopPointRef"""
+    return {stop['StopPointRef']: stop for stop in stops_list}
+
+
+def collect_stop_refs(patterns):
+    """All stop refs of the given journey patterns"""
+    all_stop_refs = []
+    for pattern in patterns:
+        all_stop_refs.extend(pattern.get('stop_refs') or ())
+    return all_stop_refs
+
+
+def collect_line_stop_refs(found_routes):
+    """All stop refs of the route documents looked up for each leg"""
+    return [stop_ref for route_docs in found_routes for route_data in route_docs
+            for stop_ref in collect_stop_refs(route_data['journey_patterns'])]
+
+
+def pick_line(candidates, leg):
+    """
+    The candidate line entry LegStops.score_leg() matches the leg to most closely, with the
+    match_leg() result. If no candidate matches, the first one and None.
+    """
+    best = None
+    for entry in candidates:
+        score = score_leg(entry['stop_index'], leg)
+        if score is not None and (best is None or score[0] < best[1][0]):
+            best = (entry, score)
+    if best is None:
+        return candidates[0], None
+    return best[0], best[1][1:]
+
+
+def build_route_response(parsed_route, transit_details, legs, line_entries):
+    """
+    Attach to each transit leg only the stops it rides, from boarding to alighting, of the
+    journey pattern LegStops.score_leg() picks among the lines its names can refer to. Legs
+    that cannot be matched get their line's first inbound and outbound patterns in full.
+
+    Each transit leg on a known line also gets the line's operator_ref, the national operator
+    code BODS files vehicles under. operator_ref:line_short_name is the line key to follow it on
+    /api/vehicles/stream; the leg's operator is Google's agency name, which BODS does not use.
+    """
+    journey_patterns = []
+    inbound_stops = {}
+    outbound_stops = {}
+    leg_stops = []
+    unmatched_lines = set()
+
+    for leg, (operator, line_name), candidates in zip(transit_details, legs, line_entries):
+        inbound = inbound_stops.setdefault(line_name, [])
+        outbound = outbound_stops.setdefault(line_name, [])
+        entry, match = pick_line(candidates, leg) if candidates else (None, None)
+        if entry is not None:
+            leg['operator_ref'] = entry.get('operator_ref')
+        if match is None:
+            leg_stops.append(None)
+            if entry and line_name not in unmatched_lines:
+                unmatched_lines.add(line_name)
+                journey_patterns.extend(entry['journey_patterns'])
+                inbound.extend(entry['inbound_stops'])
+                outbound.extend(entry['outbound_stops'])
+            continue
+
+        pattern_index, board, alight = match
+        leg_pattern, stops = slice_pattern(entry['patterns'][pattern_index], board, alight, entry['stops'])
+        journey_patterns.append(leg_pattern)
+        (inbound if leg_pattern.get('direction') == 'inbound' else outbound).extend(stops)
+        leg_stops.append({
+            'step_number': leg.get('step_number'),
+            'operator_ref': entry.get('operator_ref'),
+            'line_short_name': line_name,
+            'journey_pattern_ref': leg_pattern.get('journey_pattern_ref'),
+            'direction': leg_pattern.get('direction'),
+            'stop_refs': leg_pattern['stop_refs']
+        })
+
+    return {
+        'status': 'success',
+        'data': {
+            'parsed_route': parsed_route,
+            'transit_details': transit_details,
+            'journey_pattern': journey_patterns,
+            'inbound_bus_stops': inbound_stops,
+            'outbound_bus_stops': outbound_stops,
+            'leg_stops': leg_stops
+        }
+    }
+
+
+def catalog_legs(legs):
+    """Route catalog entries of the lines each leg can be on, None for lines the catalog does not have"""
+    if not route_catalog.loaded:
+        return [None] * len(legs)
+    return [route_catalog.get(operator, line_name) for operator, line_name in legs]
+
+
+def resolve_line_routes(found_routes, stops_dict):
+    """Turn each leg's line documents looked up in Mongo into the same entries the route catalog holds"""
+    return [[resolve_line(route_data, stops_dict) for route_data in route_docs] or None
+            for route_docs in found_routes]
+
+
+def plan_local_route(args):
+    """
+    Plan with the local journey planner instead of Google.
+
+    Returns:
+        tuple: (parsed_route, None), or (None, (message, status_code)) if the request cannot be planned
+    """
+    if not journey_planner.built:
+        return None, ('The local planner needs a timetable, run ingest.py', 503)
+    origin = parse_location(args.get('origin'))
+    destination = parse_location(args.get('destination'))
+    if origin is None or destination is None:
+        return None, ('planner=raptor takes origin and destination as "lat,lng"', 400)
+    try:
+        at = parse_departure_time(args.get('at'))
+    except ValueError:
+        return None, ('at must be an ISO 8601 date and time', 400)
+    return journey_planner.plan(origin, destination, at), None
+
+
+def route_info_key(args):
+    """
+    Key on which identical concurrent /api/getRouteInfo requests share one computation.
+
+    Google requests are keyed like the directions cache, so places it treats as the same share;
+    local planner requests only share when origin, destination and time are given identically.
+    """
+    planner = args.get('planner', 'google')
+    if planner == 'raptor':
+        return planner, (args.get('origin') or '').strip(), (args.get('destination') or '').strip(), args.get('at') or ''
+    return planner, normalize_place(args.get('origin') or ''), normalize_place(args.get('destination') or '')
+
+
+def stop_departures(stop_ref, args):
+    """Body and status code of a departure board request"""
+    if not timetable.loaded:
+        return {'status': 'error', 'message': 'No timetable has been built, run ingest.py'}, 503
+    try:
+        at = parse_departure_time(args.get('at'))
+        limit = max(1, min(int(args.get('limit', 10)), 50))
+    except ValueError:
+        return {
+            'status': 'error',
+            'message': 'at must be an ISO 8601 date and time; limit is an optional number'
+        }, 400
+
+    departures = timetable.departures(stop_ref, at, limit)
+    if departures is None:
+        return {'status': 'error', 'message': f'No timetabled departures from stop {stop_ref}'}, 404
+    return {'status': 'success', 'stop_ref': stop_ref, 'data': departures}, 200
+
+
+def nearby_stops(args):
+    """Body and status code of a nearby stops request"""
+    try:
+        lat = float(args['lat'])
+        lng = float(args['lng'])
+        radius = min(float(args.get('radius', 500)), 5000)
+        limit = min(int(args.get('limit', 20)), 200)
+        if not (math.isfinite(lat) and math.isfinite(lng) and math.isfinite(radius)):
+            raise ValueError('not a finite number')
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or radius <= 0 or limit < 1:
+            raise ValueError('out of range')
+    except (KeyError, ValueError):
+        return {
+            'status': 'error',
+            'message': 'lat and lng are required coordinates; radius (metres) and limit are optional positive numbers'
+        }, 400
+
+    # Served only from the stop registry, which is kept up to date; see STOP_REGISTRY in StopRegistry.py
+    if not stop_registry.loaded:
+        return {
+            'status': 'error',
+            'message': 'Nearby stops need the stop registry, set STOP_REGISTRY to snapshot or mongo'
+        }, 503
+    return {'status': 'success', 'data': stop_registry.nearby(lat, lng, radius, limit)}, 200
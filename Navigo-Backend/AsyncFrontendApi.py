@@ -0,0 +1,401 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+import aiohttp
+from quart import Quart, jsonify, request, websocket, g
+from pymongo import AsyncMongoClient
+from dotenv import load_dotenv
+from ApiCore import (index_stops, collect_line_stop_refs, build_route_response, catalog_legs, resolve_line_routes,
+                     stop_departures, nearby_stops, plan_local_route, route_info_key, PLANNERS)
+from GoogleMapsApiHandler import (GoogleMapsHandler, normalize_place, departure_bucket, directions_replay_key,
+                                  GMAPS_CACHE_SIZE, GMAPS_CACHE_TTL, GMAPS_CACHE_BACKEND)
+from BodsApiHandler import url as BODS_URL, parse_siri_xml, datafeed_key
+from MongoHandler import (MONGO_URI, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_CONNECT_TIMEOUT_MS,
+                          MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_READ_PREFERENCE, MONGO_BACKEND)
+from ResponseCache import TTLCache, make_backend, MISSING
+from RouteStore import ROUTES_DB, ROUTES_COLLECTION, ROUTE_PROJECTION, route_query, line_flight_key
+from StopRegistry import stop_registry, init_stop_registry
+from RouteCatalog import route_catalog, init_route_catalog
+from Timetable import timetable, init_timetable
+from JourneyPlanner import journey_planner, init_journey_planner
+from VehiclePoller import vehicle_poller, init_vehicle_poller
+from VehicleStream import vehicle_hub, parse_line_keys, VEHICLE_STREAM_MAX_LINES
+from Replay import fixtures, ReplayMiss
+from SingleFlight import AsyncSingleFlight
+from Telemetry import (configure_logging, metrics, span, observe_request, UPSTREAM_ERRORS, METRICS_ENABLED,
+                       METRICS_CONTENT_TYPE)
+
+load_dotenv()
+
+# Async server mode. Serves the same /api/getRouteInfo contract as FrontendApi.py, but every
+# outbound call (Google, BODS, Mongo) is awaited, so one worker can keep many requests in flight.
+#
+#   uvicorn AsyncFrontendApi:app --host 0.0.0.0 --port 5000 --workers 4
+
+DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+
+# Identical concurrent route requests, line lookups and BODS fetches each share one in-flight call
+route_info_flight = AsyncSingleFlight('route_info')
+route_flight = AsyncSingleFlight('route_patterns')
+datafeed_flight = AsyncSingleFlight('bods_datafeed')
+
+
+class AsyncGoogleMapsHandler:
+    """Directions over aiohttp, sharing cache keys and response shape with GoogleMapsHandler"""
+
+    def __init__(self, session, api_key=None, cache=None):
+        self.session = session
+        self.api_key = api_key if api_key is not None else os.getenv("GMAPS_KEY")
+        self.cache = cache if cache is not None else TTLCache(
+            max_size=GMAPS_CACHE_SIZE,
+            ttl=GMAPS_CACHE_TTL,
+            backend=make_backend(GMAPS_CACHE_BACKEND),
+            name='gmaps_async'
+        )
+
+    async def _cached(self, key):
+        # Only a shared backend does blocking I/O; the in-memory lookup is cheap enough to run inline
+        if self.cache.backend is None:
+            return self.cache.get(key)
+        return await asyncio.to_thread(self.cache.get, key)
+
+    async def _store(self, key, value):
+        if self.cache.backend is None:
+            self.cache.set(key, value)
+        else:
+            await asyncio.to_thread(self.cache.set, key, value)
+
+    async def get_directions(self, origin, destination, mode="transit", departure_time=None):
+        if departure_time is None:
+            departure_time = datetime.now()
+
+        key = (f"directions|{normalize_place(origin)}|{normalize_place(destination)}|{mode}|"
+               f"{departure_bucket(departure_time)}")
+        routes = await self._cached(key)
+        if routes is not MISSING:
+            return routes
+
+        try:
+            routes = await fixtures.call_async('google', directions_replay_key(origin, destination, mode),
+                                               self._fetch_directions, origin, destination, mode, departure_time)
+        except Exception:
+            UPSTREAM_ERRORS.inc(upstream='google')
+            raise
+
+        await self._store(key, routes)
+        return routes
+
+    async def _fetch_directions(self, origin, destination, mode, departure_time):
+        params = {
+            'origin': origin,
+            'destination': destination,
+            'mode': mode,
+            'departure_time': int(departure_time.timestamp()),
+            'key': self.api_key
+        }
+        async with self.session.get(DIRECTIONS_URL, params=params) as response:
+            response.raise_for_status()
+            body = await response.json()
+
+        # Same rules as the googlemaps client: ZERO_RESULTS is an empty answer, anything else not OK is an error
+        status = body.get('status')
+        if status == 'ZERO_RESULTS':
+            return []
+        if status != 'OK':
+            raise RuntimeError(f"Directions request failed: {status} {body.get('error_message', '')}".strip())
+        return body.get('routes', [])
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+
+@app.before_serving
+async def startup():
+    # The same optional in-memory data as FrontendApi.py, loaded per worker; see each module's settings
+    init_stop_registry()
+    init_route_catalog()
+    init_timetable()
+    init_journey_planner()
+    init_vehicle_poller()
+
+    app.http_session = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS),
+        connector=aiohttp.TCPConnector(limit=HTTP_MAX_CONNECTIONS)
+    )
+    if MONGO_BACKEND == 'memory':
+        from MemoryMongo import async_memory_client
+        app.mongo_client = async_memory_client()
+    else:
+        app.mongo_client = AsyncMongoClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            readPreference=MONGO_READ_PREFERENCE
+        )
+    app.maps_handler = AsyncGoogleMapsHandler(app.http_session)
+    metrics.register_cache('gmaps_async', app.maps_handler.cache_stats)
+    metrics.register_cache('route_catalog', route_catalog.stats)
+    metrics.register_cache('stop_registry', stop_registry.stats)
+    vehicle_hub.start(asyncio.get_running_loop())
+
+
+@app.after_serving
+async def shutdown():
+    vehicle_poller.stop()
+    stop_registry.stop_refresh()
+    await app.http_session.close()
+    await app.mongo_client.close()
+
+
+async def find_line_routes(operator, line_name):
+    """RouteStore.find_line_routes() on the async client"""
+    query = route_query(operator, line_name)
+    if query is None:
+        return []
+    try:
+        return await route_flight.do(line_flight_key(operator, line_name), _find_line_routes, query)
+    except Exception as e:
+        UPSTREAM_ERRORS.inc(upstream='mongo')
+        logger.error("Route lookup failed for %s %s: %s", operator, line_name, e)
+        return []
+
+
+async def _find_line_routes(query):
+    return await app.mongo_client[ROUTES_DB][ROUTES_COLLECTION].find(query, ROUTE_PROJECTION).to_list(None)
+
+
+async def extract_stop_info_bulk(stop_refs):
+    if not stop_refs:
+        return {}
+
+    found_stops, missing_refs = stop_registry.get_many(dict.fromkeys(stop_refs))
+    stops_list = list(found_stops.values())
+
+    if missing_refs:
+        try:
+            cursor = app.mongo_client['Stops']['AllStops'].find(
+                {'StopPointRef': {'$in': missing_refs}},
+                {'_id': 0}
+            )
+            stops_list.extend(await cursor.to_list(None))
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(upstream='mongo')
+            logger.error("Stop lookup failed: %s", e)
+
+    return index_stops(stops_list)
+
+
+async def compute_route_info(args):
+    """FrontendApi.compute_route_info() with every outbound call awaited"""
+    if args.get('planner', 'google') == 'raptor':
+        # Tens of milliseconds of CPU, so keep it off the event loop
+        with span('plan_raptor'):
+            parsed_route, error = await asyncio.to_thread(plan_local_route, args)
+        if error:
+            return None, error
+    else:
+        origin = args.get("origin")
+        destination = args.get("destination")
+        with span('google_directions'):
+            route = await app.maps_handler.get_directions(origin, destination, "transit")
+        parsed_route = GoogleMapsHandler.parse_route_steps(route)
+    transit_details = GoogleMapsHandler.extract_transit_details(parsed_route)
+
+    legs = [(each_bus.get('operator'), each_bus.get('line_short_name')) for each_bus in transit_details]
+    with span('route_lookup'):
+        line_entries = catalog_legs(legs)
+        missing = [i for i, entry in enumerate(line_entries) if entry is None]
+        found = await asyncio.gather(*(find_line_routes(*legs[i]) for i in missing))
+
+    all_stop_refs = collect_line_stop_refs(found)
+    with span('stop_fetch'):
+        stops_dict = await extract_stop_info_bulk(all_stop_refs) if all_stop_refs else {}
+    for i, entry in zip(missing, resolve_line_routes(found, stops_dict)):
+        line_entries[i] = entry
+
+    with span('leg_match'):
+        return build_route_response(parsed_route, transit_details, legs, line_entries), None
+
+
+@app.route('/api/getRouteInfo', methods=['GET'])
+async def get_route_info():
+    planner = request.args.get('planner', 'google')
+    if planner not in PLANNERS:
+        return jsonify({'status': 'error', 'message': f"planner must be one of {', '.join(PLANNERS)}"}), 400
+    try:
+        response_data, error = await route_info_flight.do(route_info_key(request.args), compute_route_info,
+                                                          request.args)
+        if error:
+            return jsonify({'status': 'error', 'message': error[0]}), error[1]
+        with span('serialize'):
+            return jsonify(response_data)
+
+    except Exception as e:
+        logger.exception("Route request failed")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@app.route('/api/getVehicleLocations', methods=['GET'])
+async def get_vehicle_locations():
+    line_ref = request.args.get('lineRef')
+    operator_ref = request.args.get('operatorRef')
+    if not line_ref or not operator_ref:
+        return jsonify({'status': 'error', 'message': 'lineRef and operatorRef are required'}), 400
+
+    # Served from the poller's snapshot when it is running, otherwise fetched on demand
+    if vehicle_poller.running:
+        return jsonify({'status': 'success', 'data': vehicle_poller.line_locations(operator_ref, line_ref)})
+
+    query = {'lineRef': line_ref, 'operatorRef': operator_ref}
+
+    async def fetch():
+        async with app.http_session.get(BODS_URL, params=dict(query, api_key=os.getenv("BODS_KEY"))) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    try:
+        key = datafeed_key(query)
+        xml_data = await datafeed_flight.do(key, fixtures.call_async, 'bods', key, fetch)
+        vehicles = parse_siri_xml(xml_data)
+        if vehicles is None:
+            return jsonify({'status': 'error', 'message': 'BODS returned invalid SIRI-VM'}), 502
+        return jsonify({'status': 'success', 'data': vehicles})
+    except (aiohttp.ClientError, asyncio.TimeoutError, ReplayMiss) as e:
+        UPSTREAM_ERRORS.inc(upstream='bods')
+        logger.error("BODS request for %s %s failed: %s", operator_ref, line_ref, e)
+        return jsonify({'status': 'error', 'message': str(e)}), 502
+
+
+@app.route('/api/stops/nearby', methods=['GET'])
+async def get_nearby_stops():
+    # A grid index lookup, so like the departure board it runs inline on the event loop
+    try:
+        body, status_code = nearby_stops(request.args)
+        return jsonify(body), status_code
+    except Exception as e:
+        logger.exception("Nearby stops request failed")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@app.route('/api/stops/<stop_ref>/departures', methods=['GET'])
+async def get_stop_departures(stop_ref):
+    # An in-memory lookup well under a millisecond, so it runs inline on the event loop
+    body, status_code = stop_departures(stop_ref, request.args)
+    return jsonify(body), status_code
+
+
+def stream_line_keys(args):
+    """Lines a streaming client asked for, e.g. ?lines=NDTR:U1,TBTN:Indigo, or an error message"""
+    keys = parse_line_keys(args.get('lines'))
+    if not keys:
+        return None, 'lines is required, as comma separated operator_ref:line_short_name pairs of route legs'
+    if len(keys) > VEHICLE_STREAM_MAX_LINES:
+        return None, f'At most {VEHICLE_STREAM_MAX_LINES} lines can be followed at once'
+    return keys, None
+
+
+@app.route('/api/vehicles/stream', methods=['GET'])
+async def stream_vehicles():
+    """Server-Sent Events: a 'snapshot' event for the requested lines, then a 'delta' event per changed line"""
+    keys, error = stream_line_keys(request.args)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+
+    async def events():
+        async for message in vehicle_hub.messages(keys):
+            yield b': keep-alive\n\n' if message is None else f"data: {message}\n\n".encode('utf-8')
+
+    response = await app.make_response((events(), {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    }))
+    response.timeout = None
+    return response
+
+
+@app.websocket('/api/vehicles/ws')
+async def vehicles_websocket():
+    """The same messages as /api/vehicles/stream over a WebSocket"""
+    keys, error = stream_line_keys(websocket.args)
+    if error:
+        await websocket.close(1008, error)
+        return
+    async for message in vehicle_hub.messages(keys):
+        await websocket.send('{"type": "heartbeat"}' if message is None else message)
+
+
+@app.route('/api/health', methods=['GET'])
+async def health():
+    mongo = {'status': 'ok', 'backend': MONGO_BACKEND, 'max_pool_size': MONGO_MAX_POOL_SIZE, 'read_preference': MONGO_READ_PREFERENCE}
+    try:
+        await app.mongo_client.admin.command('ping')
+    except Exception as e:
+        mongo['status'] = 'error'
+        mongo['message'] = str(e)
+    status_code = 200 if mongo['status'] == 'ok' else 503
+    return jsonify({
+        'status': mongo['status'],
+        'mongo': mongo,
+        'stop_registry': stop_registry.stats(),
+        'google_maps_cache': app.maps_handler.cache_stats(),
+        'vehicle_poller': vehicle_poller.stats(),
+        'vehicle_stream': vehicle_hub.stats(),
+        'route_catalog': route_catalog.stats(),
+        'timetable': timetable.stats(),
+        'journey_planner': journey_planner.stats(),
+        'upstream_fixtures': fixtures.stats(),
+        'single_flight': {
+            'route_info': route_info_flight.stats(),
+            'route_patterns': route_flight.stats(),
+            'bods_datafeed': datafeed_flight.stats()
+        }
+    }), status_code
+
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    if not METRICS_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Metrics are disabled, see METRICS_ENABLED'}), 404
+    return metrics.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def record_request(response):
+    started = g.get('request_started')
+    if started is not None:
+        observe_request(request.url_rule.rule if request.url_rule else None, request.method,
+                        response.status_code, time.perf_counter() - started)
+    return response
+
+
+@app.route('/')
+async def home():
+    return "Quart server is running. Use /api/getRouteInfo endpoint for directions."
+
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
@@ -1,129 +1,112 @@
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 import os
+import logging
 import json
 
-import xml.etree.ElementTree as ET
+from SiriVmParser import parse_vehicle_activities, activity_to_dict
+from Telemetry import UPSTREAM_ERRORS
+from Replay import fixtures, ReplayMiss
+from SingleFlight import SingleFlight
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Set the URL and parameters
 url = "https://data.bus-data.dft.gov.uk/api/v1/datafeed"  # Bods URL
 params = {
     "api_key": os.getenv("BODS_KEY"),  # My key
     
 }
+BODS_TIMEOUT_SECONDS = float(os.getenv("BODS_TIMEOUT_SECONDS", "15"))
+
+def make_session(pool_size=4):
+    """A requests session that keeps its connections to the BODS host open between calls"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+session = make_session()
+
+# Concurrent requests for the same filters share one download
+datafeed_flight = SingleFlight('bods_datafeed')
+
+def datafeed_key(query):
+    """Fixture key of a datafeed request: its filters, without the API key"""
+    return 'datafeed|' + '&'.join(f"{name}={value}" for name, value in sorted(query.items()))
+
+def _get_datafeed(request_params, http_session):
+    response = http_session.get(url, params=request_params, timeout=BODS_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.content
 
-def getLocationData(lineRef,operatorRef,params):
+def fetch_datafeed(query, http_session=None):
+    """
+    GET the SIRI-VM datafeed with the given filters added to the API key.
+
+    Args:
+        query (dict): BODS filters, e.g. lineRef, operatorRef (comma separated) or boundingBox
+        http_session (requests.Session): Session to use, defaults to the shared module session
+
+    Returns:
+        bytes: The raw SIRI-VM XML, or None if the request failed
+    """
+    request_params = dict(params, **query)  # Copy, so concurrent callers never see each other's filters
+    try:
+        key = datafeed_key(query)
+        return datafeed_flight.do(key, fixtures.call, 'bods', key, _get_datafeed, request_params, http_session or session)
+    except (requests.exceptions.RequestException, ReplayMiss) as e:
+        UPSTREAM_ERRORS.inc(upstream='bods')
+        logger.error("BODS request failed: %s", e)
+    return None
+
+def getLocationData(lineRef,operatorRef,params=params):
     try:
-        params['lineRef'] = lineRef #Desired bus route identifier
-        params['operatorRef'] = operatorRef #operator identifier
+        request_params = dict(params)
+        request_params['lineRef'] = lineRef #Desired bus route identifier
+        request_params['operatorRef'] = operatorRef #operator identifier
         #get request
         
-        response = requests.get(url, params=params)
+        response = session.get(url, params=request_params, timeout=BODS_TIMEOUT_SECONDS)
 
         # Check for successful response
         if response.status_code == 200:
-            print("Request OK")
-            # print siri  XML as a string
+            logger.debug("BODS request OK for %s %s", operatorRef, lineRef)
             xml_string = response.text
-            # print(f"XML Response :\n{xml_string}")
             return xml_string
             
         else:
-            print(f"Request failed, status code: {response.status_code}")
-            print("Response:", response.text)
+            UPSTREAM_ERRORS.inc(upstream='bods')
+            logger.error("BODS request failed with status code %s: %s", response.status_code, response.text[:500])
 
     except requests.exceptions.RequestException as e:
-        print(f"An error occurred: {e}")
+        UPSTREAM_ERRORS.inc(upstream='bods')
+        logger.error("BODS request failed: %s", e)
 
 
 
 
 def parse_siri_xml(xml_string):
-
-    try:
-        root = ET.fromstring(xml_string)
-        # Define the namespace to handle the xmlns attributes
-        namespaces = {'siri': 'http://www.siri.org.uk/siri'}
-        vehicle_activities = []
-        for vehicle_activity_element in root.findall('.//siri:VehicleActivity', namespaces):
-            activity_data = {}
-            activity_data['RecordedAtTime'] = vehicle_activity_element.find('./siri:RecordedAtTime', namespaces).text
-            activity_data['ItemIdentifier'] = vehicle_activity_element.find('./siri:ItemIdentifier', namespaces).text
-            activity_data['ValidUntilTime'] = vehicle_activity_element.find('./siri:ValidUntilTime', namespaces).text
-
-            monitored_vehicle_journey = vehicle_activity_element.find('./siri:MonitoredVehicleJourney', namespaces)
-            if monitored_vehicle_journey is not None:
-                mvj_data = {}
-                mvj_data['LineRef'] = monitored_vehicle_journey.find('./siri:LineRef', namespaces).text
-                mvj_data['DirectionRef'] = monitored_vehicle_journey.find('./siri:DirectionRef', namespaces).text
-
-                framed_vehicle_journey_ref = monitored_vehicle_journey.find('./siri:FramedVehicleJourneyRef', namespaces)
-                if framed_vehicle_journey_ref is not None:
-                    fvjr_data = {}
-                    fvjr_data['DataFrameRef'] = framed_vehicle_journey_ref.find('./siri:DataFrameRef', namespaces).text
-                    fvjr_data['DatedVehicleJourneyRef'] = framed_vehicle_journey_ref.find('./siri:DatedVehicleJourneyRef', namespaces).text
-                    mvj_data['FramedVehicleJourneyRef'] = fvjr_data
-
-                mvj_data['PublishedLineName'] = monitored_vehicle_journey.find('./siri:PublishedLineName', namespaces).text
-                mvj_data['OperatorRef'] = monitored_vehicle_journey.find('./siri:OperatorRef', namespaces).text
-                mvj_data['OriginRef'] = monitored_vehicle_journey.find('./siri:OriginRef', namespaces).text
-                mvj_data['OriginName'] = monitored_vehicle_journey.find('./siri:OriginName', namespaces).text
-                mvj_data['DestinationRef'] = monitored_vehicle_journey.find('./siri:DestinationRef', namespaces).text
-                mvj_data['DestinationName'] = monitored_vehicle_journey.find('./siri:DestinationName', namespaces).text
-                mvj_data['OriginAimedDepartureTime'] = monitored_vehicle_journey.find('./siri:OriginAimedDepartureTime', namespaces).text
-                mvj_data['DestinationAimedArrivalTime'] = monitored_vehicle_journey.find('./siri:DestinationAimedArrivalTime', namespaces).text
-
-                vehicle_location = monitored_vehicle_journey.find('./siri:VehicleLocation', namespaces)
-                if vehicle_location is not None:
-                    location_data = {}
-                    location_data['Longitude'] = vehicle_location.find('./siri:Longitude', namespaces).text
-                    location_data['Latitude'] = vehicle_location.find('./siri:Latitude', namespaces).text
-                    mvj_data['VehicleLocation'] = location_data
-
-                block_ref = monitored_vehicle_journey.find('./siri:BlockRef', namespaces)
-                if block_ref is not None:
-                    mvj_data['BlockRef'] = block_ref.text
-
-                vehicle_ref = monitored_vehicle_journey.find('./siri:VehicleRef', namespaces)
-                if vehicle_ref is not None:
-                    mvj_data['VehicleRef'] = vehicle_ref.text
-
-                bearing = monitored_vehicle_journey.find('./siri:Bearing', namespaces)
-                if bearing is not None:
-                    mvj_data['Bearing'] = bearing.text
-
-                activity_data['MonitoredVehicleJourney'] = mvj_data
-
-            extensions = vehicle_activity_element.find('./siri:Extensions/siri:VehicleJourney', namespaces)
-            if extensions is not None:
-                extensions_data = {}
-                operational = extensions.find('./siri:Operational/siri:TicketMachine', namespaces)
-                if operational is not None:
-                    ticket_machine_data = {}
-                    ticket_machine_data['TicketMachineServiceCode'] = operational.find('./siri:TicketMachineServiceCode', namespaces).text
-                    ticket_machine_data['JourneyCode'] = operational.find('./siri:JourneyCode', namespaces).text
-                    extensions_data['Operational'] = {'TicketMachine': ticket_machine_data}
-
-                vehicle_unique_id = extensions.find('./siri:VehicleUniqueId', namespaces)
-                if vehicle_unique_id is not None:
-                    extensions_data['VehicleUniqueId'] = vehicle_unique_id.text
-
-                activity_data['Extensions'] = {'VehicleJourney': extensions_data}
-
-            vehicle_activities.append(activity_data)
-        return vehicle_activities
-    except ET.ParseError as e:
-        print(f"Error parsing XML: {e}")
+    """
+    Parse a SIRI-VM response into one nested dict per VehicleActivity.
+
+    Accepts str or bytes. Missing optional elements are left out or set to None instead of
+    failing the whole response; see SiriVmParser for the typed records underneath.
+    """
+    activities = parse_vehicle_activities(xml_string)
+    if activities is None:
         return None
+    return [activity_to_dict(activity) for activity in activities]
 
 # The XML string you provided
 #Testing
-print(json.dumps(parse_siri_xml(getLocationData('swi','NDTR',params)),indent=4))
-print(getLocationData('U1','NDTR',params))
-testing = parse_siri_xml(getLocationData('U1','NDTR',params))[1
-                                                              ]["MonitoredVehicleJourney"]["VehicleLocation"]
-print(f"{testing['Latitude']},{testing['Longitude']}")
-
+if __name__ == '__main__':
+    print(json.dumps(parse_siri_xml(getLocationData('swi','NDTR',params)),indent=4))
+    print(getLocationData('U1','NDTR',params))
+    testing = parse_siri_xml(getLocationData('U1','NDTR',params))[1
+                                                                  ]["MonitoredVehicleJourney"]["VehicleLocation"]
+    print(f"{testing['Latitude']},{testing['Longitude']}")
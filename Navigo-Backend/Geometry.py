@@ -0,0 +1,191 @@
+import bisect
+import math
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EARTH_RADIUS_M = 6371008.8
+METRES_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+# Points closer than this to the simplified line are dropped
+SHAPE_TOLERANCE_M = float(os.getenv('SHAPE_TOLERANCE_M', '5'))
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres between two points in degrees"""
+    lat1_r = math.radians(lat1)
+    lat2_r = math.radians(lat2)
+    a = (math.sin((lat2_r - lat1_r) / 2) ** 2
+         + math.cos(lat1_r) * math.cos(lat2_r) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def haversine_many(lat, lng, lats, lngs):
+    """Great-circle distance in metres from one point to arrays of points (all in degrees)"""
+    lat_r = math.radians(lat)
+    lats_r = np.radians(lats)
+    dlat = lats_r - lat_r
+    dlng = np.radians(lngs - lng)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat_r) * np.cos(lats_r) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def cumulative_distances(points):
+    """Distance in metres from the first point to each point along a (lat, lng) path"""
+    coords = np.radians(np.asarray(points, dtype=np.float64))
+    lats = coords[:, 0]
+    dlat = np.diff(lats)
+    dlng = np.diff(coords[:, 1])
+    a = np.sin(dlat / 2) ** 2 + np.cos(lats[:-1]) * np.cos(lats[1:]) * np.sin(dlng / 2) ** 2
+    steps = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    return np.concatenate(([0.0], np.cumsum(steps)))
+
+
+def simplify(points, tolerance_m=SHAPE_TOLERANCE_M):
+    """
+    Douglas-Peucker simplification of a (lat, lng) path.
+
+    Returns:
+        list: Indexes of the points to keep, always including the first and last
+    """
+    if len(points) < 3:
+        return list(range(len(points)))
+
+    # Project onto a local flat plane in metres; accurate enough at the scale of a bus route
+    coords = np.asarray(points, dtype=np.float64)
+    scale_y = METRES_PER_DEGREE
+    scale_x = scale_y * math.cos(math.radians(coords[:, 0].mean()))
+    xs = coords[:, 1] * scale_x
+    ys = coords[:, 0] * scale_y
+
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        x1, y1 = xs[first], ys[first]
+        dx = xs[last] - x1
+        dy = ys[last] - y1
+        px = xs[first + 1:last] - x1
+        py = ys[first + 1:last] - y1
+        length_sq = dx * dx + dy * dy
+        # Distance to the segment (not the infinite line), so loops back past an end still count
+        t = np.clip((px * dx + py * dy) / length_sq, 0.0, 1.0) if length_sq > 0 else 0.0
+        distances = np.hypot(px - t * dx, py - t * dy)
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance_m:
+            index += first + 1
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return np.flatnonzero(keep).tolist()
+
+
+def _encode_value(value, chunks):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def encode_polyline(points, precision=5):
+    """Encode (lat, lng) points in Google's encoded polyline format"""
+    factor = 10 ** precision
+    chunks = []
+    previous_lat = previous_lng = 0
+    for lat, lng in points:
+        lat_e = int(round(lat * factor))
+        lng_e = int(round(lng * factor))
+        _encode_value(lat_e - previous_lat, chunks)
+        _encode_value(lng_e - previous_lng, chunks)
+        previous_lat, previous_lng = lat_e, lng_e
+    return ''.join(chunks)
+
+
+def decode_polyline(encoded, precision=5):
+    """Inverse of encode_polyline()"""
+    factor = 10 ** precision
+    points = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / factor, lng / factor))
+    return points
+
+
+def build_shape(points, tolerance_m=SHAPE_TOLERANCE_M, stop_indexes=None):
+    """
+    Compact shape of a path for the map.
+
+    Args:
+        points (list): (lat, lng) floats in travel order
+        stop_indexes (list): optional index in points of each stop of the pattern, or None for a
+            stop whose place on the path is unknown
+
+    Returns:
+        dict: 'polyline' (encoded, simplified path) and 'distances' (metres along the full
+              path to each polyline vertex), plus 'stop_distances' (metres along the path to
+              each stop) when stop_indexes is given, or None if there are fewer than two points
+    """
+    # Consecutive duplicates add nothing, and route links repeat the point where they join
+    unique = [i == 0 or point != points[i - 1] for i, point in enumerate(points)]
+    path = [point for point, keep in zip(points, unique) if keep]
+    if len(path) < 2:
+        return None
+    distances = cumulative_distances(path)
+    kept = simplify(path, tolerance_m)
+    shape = {
+        'polyline': encode_polyline([path[i] for i in kept]),
+        'distances': np.rint(distances[kept]).astype(int).tolist()
+    }
+    if stop_indexes is not None:
+        # Index in path of each of points, so a stop on a dropped duplicate takes the point it repeats
+        positions = np.cumsum(unique) - 1
+        shape['stop_distances'] = [None if i is None else int(round(distances[positions[i]]))
+                                   for i in stop_indexes]
+    return shape
+
+
+def _point_at(points, distances, distance_m):
+    """The point distance_m metres along a polyline with the given vertex distances"""
+    i = min(max(bisect.bisect_right(distances, distance_m) - 1, 0), len(points) - 2)
+    span = distances[i + 1] - distances[i]
+    t = min(max((distance_m - distances[i]) / span, 0.0), 1.0) if span else 0.0
+    (lat1, lng1), (lat2, lng2) = points[i], points[i + 1]
+    return lat1 + t * (lat2 - lat1), lng1 + t * (lng2 - lng1)
+
+
+def cut_shape(shape, start_m, end_m):
+    """
+    The part of a build_shape() shape between two distances along it.
+
+    Returns:
+        dict: 'polyline' and 'distances', measured from start_m, or None if the shape or either
+              distance is missing or end_m is not past start_m
+    """
+    if not shape or start_m is None or end_m is None or end_m <= start_m:
+        return None
+    points = decode_polyline(shape['polyline'])
+    distances = shape['distances']
+    inner = [i for i, distance in enumerate(distances) if start_m < distance < end_m]
+    return {
+        'polyline': encode_polyline([_point_at(points, distances, start_m)] + [points[i] for i in inner]
+                                    + [_point_at(points, distances, end_m)]),
+        'distances': [0] + [distances[i] - start_m for i in inner] + [end_m - start_m]
+    }
@@ -3,25 +3,69 @@ from datetime import datetime,timedelta
 from dotenv import load_dotenv
 import os
 import json
+import re
+import threading
+from ResponseCache import TTLCache, make_backend
+from Telemetry import UPSTREAM_ERRORS
+from Replay import fixtures
+
+load_dotenv()
+
+# Cache settings for Google responses, all overridable from the environment
+GMAPS_CACHE_TTL = int(os.getenv("GMAPS_CACHE_TTL", "300"))
+GMAPS_CACHE_SIZE = int(os.getenv("GMAPS_CACHE_SIZE", "2048"))
+GMAPS_CACHE_BACKEND = os.getenv("GMAPS_CACHE_BACKEND", "memory")
+# Departure times in the same window share a cached directions result
+GMAPS_DEPARTURE_BUCKET_SECONDS = int(os.getenv("GMAPS_DEPARTURE_BUCKET_SECONDS", "300"))
+# Decimal places kept from coordinates when building cache keys (4 is roughly 11 m)
+GMAPS_COORD_PRECISION = int(os.getenv("GMAPS_COORD_PRECISION", "4"))
+
+_LAT_LNG = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+def normalize_place(place, precision=GMAPS_COORD_PRECISION):
+    """Cache key form of an origin/destination: rounded coordinates, or a whitespace/case-folded address"""
+    if isinstance(place, dict):
+        place = (place.get('lat'), place.get('lng'))
+    if isinstance(place, (tuple, list)) and len(place) == 2:
+        return f"{round(float(place[0]), precision)},{round(float(place[1]), precision)}"
+    place = str(place)
+    match = _LAT_LNG.match(place)
+    if match:
+        return f"{round(float(match.group(1)), precision)},{round(float(match.group(2)), precision)}"
+    return ' '.join(place.lower().split())
+
+def directions_replay_key(origin, destination, mode):
+    """Fixture key of a directions call; leaves the departure time out so recordings replay on any day"""
+    return f"directions|{normalize_place(origin)}|{normalize_place(destination)}|{mode}"
+
+def departure_bucket(departure_time, bucket_seconds=GMAPS_DEPARTURE_BUCKET_SECONDS):
+    timestamp = int(departure_time.timestamp())
+    return timestamp - timestamp % bucket_seconds if bucket_seconds > 0 else timestamp
 
 class GoogleMapsHandler:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, cache=None):
        
         if api_key is None:
-            load_dotenv()
             api_key = os.getenv("GMAPS_KEY")
         
-       
-            
-        self.client = googlemaps.Client(key=api_key)
+        # Nothing is sent to Google when replaying recorded responses, so no key is needed
+        self.client = googlemaps.Client(key=api_key) if fixtures.mode != 'replay' else None
+        self.cache = cache if cache is not None else TTLCache(
+            max_size=GMAPS_CACHE_SIZE,
+            ttl=GMAPS_CACHE_TTL,
+            backend=make_backend(GMAPS_CACHE_BACKEND),
+            name='gmaps'
+        )
 
     def geocode_address(self, address: str):
       
-        return self.client.geocode(address)
+        key = f"geocode|{normalize_place(address)}"
+        return self._call(key, key, 'geocode', address)
 
     def reverse_geocode(self, lat: float, lng: float):
        
-        return self.client.reverse_geocode((lat, lng))
+        key = f"reverse_geocode|{normalize_place((lat, lng))}"
+        return self._call(key, key, 'reverse_geocode', (lat, lng))
 
     def get_directions(self, origin: str, destination: str, mode: str = "transit", 
                       departure_time: datetime = None):
@@ -29,13 +73,33 @@ class GoogleMapsHandler:
         if departure_time is None:
             departure_time = datetime.now() 
             
-        return self.client.directions(
+        key = (f"directions|{normalize_place(origin)}|{normalize_place(destination)}|{mode}|"
+               f"{departure_bucket(departure_time)}")
+        return self._call(
+            key,
+            directions_replay_key(origin, destination, mode),
+            'directions',
             origin, 
             destination, 
             mode=mode, 
             departure_time=departure_time 
         )
 
+    def _call(self, cache_key, replay_key, method, *args, **kwargs):
+        """A googlemaps client method, through the response cache and the fixture store"""
+        try:
+            return self.cache.get_or_call(cache_key, fixtures.call, 'google', replay_key,
+                                          self._client_call, method, *args, **kwargs)
+        except Exception:
+            UPSTREAM_ERRORS.inc(upstream='google')
+            raise
+
+    def _client_call(self, method, *args, **kwargs):
+        return getattr(self.client, method)(*args, **kwargs)
+
+    def cache_stats(self):
+        return self.cache.stats()
+
     def validate_address(self, address_lines: list, region_code: str = None, 
                          locality: str = None, enable_usps_cass: bool = False):
       
@@ -145,11 +209,32 @@ class GoogleMapsHandler:
                     'start_location': step.get('start_location', {}),
                     'end_location': step.get('end_location', {})
                 }
+                # The local planner knows the exact stops; Google only gives names and locations
+                for key in ('departure_stop_ref', 'arrival_stop_ref'):
+                    if key in step:
+                        transit_info[key] = step[key]
                 transit_details.append(transit_info)
         
         return transit_details
 
 
+_handler = None
+_handler_lock = threading.Lock()
+
+def get_maps_handler():
+    """Return the shared GoogleMapsHandler, so the client and its cache are reused across requests"""
+    global _handler
+    if _handler is None:
+        with _handler_lock:
+            if _handler is None:
+                _handler = GoogleMapsHandler()
+    return _handler
+
+def maps_cache_stats():
+    """Cache statistics of the shared handler, or None if it has not been created yet"""
+    return _handler.cache_stats() if _handler is not None else None
+
+
 # if __name__ == "__main__":
 #     # Example usage
 #     maps = GoogleMapsHandler()
@@ -0,0 +1,475 @@
+import math
+import logging
+import os
+import time
+from array import array
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import numpy as np
+from Geometry import haversine, encode_polyline
+from SpatialIndex import GridIndex
+from Timetable import timetable, runs_on, format_clock, TIMETABLE_TIMEZONE, DAY_SECONDS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Most changes of vehicle in a planned journey
+PLANNER_MAX_TRANSFERS = int(os.getenv('PLANNER_MAX_TRANSFERS', '3'))
+# Walking speed in metres per second over straight-line distance
+PLANNER_WALK_SPEED = float(os.getenv('PLANNER_WALK_SPEED', '1.2'))
+# Furthest walk from the origin to the first stop, and from the last stop to the destination
+PLANNER_ACCESS_RADIUS_M = float(os.getenv('PLANNER_ACCESS_RADIUS_M', '800'))
+# Furthest walk between two stops to change vehicle
+PLANNER_TRANSFER_RADIUS_M = float(os.getenv('PLANNER_TRANSFER_RADIUS_M', '300'))
+
+INFINITY = 1 << 31
+
+
+def parse_location(text):
+    """(lat, lng) of a 'lat,lng' string, or None if it is not one"""
+    try:
+        lat, lng = (float(part) for part in (text or '').split(','))
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def format_distance(metres):
+    """Distance text in the style of Google Directions"""
+    return f"{metres / 1000:.1f} km" if metres >= 1000 else f"{int(round(metres, -1))} m"
+
+
+def format_duration(seconds):
+    """Duration text in the style of Google Directions"""
+    minutes = max(1, int(round(seconds / 60)))
+    if minutes < 60:
+        return f"{minutes} min" if minutes == 1 else f"{minutes} mins"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} hour{'s' if hours > 1 else ''} {minutes} min{'s' if minutes != 1 else ''}"
+
+
+def _split_fifo(trips):
+    """
+    Split trips sharing a stop sequence into groups in which no trip overtakes another, so
+    within each group the trips are ordered by departure at every stop, not just the first.
+
+    Args:
+        trips (list): (departures, journey_id) sorted by first departure
+    """
+    groups = []
+    for trip in trips:
+        for group in groups:
+            previous = group[-1][0]
+            if all(a >= b for a, b in zip(trip[0], previous)):
+                group.append(trip)
+                break
+        else:
+            groups.append([trip])
+    return groups
+
+
+class JourneyPlanner:
+    """
+    Round-based (RAPTOR) public transport router over the compiled timetable.
+
+    The network is held in flat arrays: a route is a stop sequence with its trips, every trip's
+    times are stored trip-major in one block per route, and each stop lists the routes calling at
+    it. Round k finds the earliest arrival at every stop using at most k vehicles, scanning each
+    route once per service day from the earliest stop improved in the previous round. Walking
+    between nearby stops is added after each round.
+
+    Like Timetable.departures(), a search sees the previous day's journeys still running after
+    midnight and, when nothing arrives before midnight, the next day's: a route is scanned once
+    for each of those days with its times shifted by a day.
+    """
+
+    def __init__(self):
+        self.built = False
+        self.built_at = None
+        self.build_seconds = None
+        self.queries = 0
+
+    def build(self, source=timetable):
+        started = time.perf_counter()
+        journeys = source.journeys
+        offsets = journeys['offset']
+
+        stop_refs = sorted({stop_ref for pattern in source.patterns for stop_ref in pattern})
+        stop_ids = {stop_ref: i for i, stop_ref in enumerate(stop_refs)}
+        stop_names = []
+        lats = np.full(len(stop_refs), np.nan)
+        lngs = np.full(len(stop_refs), np.nan)
+        for i, stop_ref in enumerate(stop_refs):
+            name, lat, lng = source.stop_locations.get(stop_ref, (None, math.nan, math.nan))
+            stop_names.append(name or stop_ref)
+            lats[i] = lat
+            lngs[i] = lng
+
+        by_pattern = {}
+        for journey_id, pattern_id in enumerate(journeys['pattern']):
+            departures = tuple(journeys['departures'][offsets[journey_id]:offsets[journey_id + 1]])
+            by_pattern.setdefault(pattern_id, []).append((departures, journey_id))
+
+        route_stops = array('I')
+        route_stop_offset = array('I', [0])
+        route_trips = array('I')
+        route_trip_offset = array('I', [0])
+        route_time_offset = array('I', [0])
+        trip_calendar = array('I')
+        arrivals = array('I')
+        departures = array('I')
+        route_line = array('I')
+        route_latest = array('I')
+        route_calendars = []
+        stop_routes = [[] for _ in stop_refs]
+
+        for pattern_id, trips in sorted(by_pattern.items()):
+            pattern = [stop_ids[stop_ref] for stop_ref in source.patterns[pattern_id]]
+            trips.sort()
+            for group in _split_fifo(trips):
+                route = len(route_line)
+                route_line.append(journeys['line'][group[0][1]])
+                route_calendars.append(tuple(sorted({journeys['calendar'][journey_id] for _, journey_id in group})))
+                for position, stop in enumerate(pattern):
+                    # The last stop is only alighted at, so it never starts a scan
+                    if position < len(pattern) - 1:
+                        stop_routes[stop].append((route, position))
+                route_stops.extend(pattern)
+                route_stop_offset.append(len(route_stops))
+                for trip_departures, journey_id in group:
+                    route_trips.append(journey_id)
+                    trip_calendar.append(journeys['calendar'][journey_id])
+                    departures.extend(trip_departures)
+                    arrivals.extend(journeys['arrivals'][offsets[journey_id]:offsets[journey_id + 1]])
+                route_trip_offset.append(len(route_trips))
+                route_time_offset.append(len(departures))
+                # Trips never overtake, so the last one's arrival at the last stop is the route's latest time
+                route_latest.append(arrivals[-1])
+
+        grid = GridIndex(lats, lngs)
+        transfers = [[] for _ in stop_refs]
+        for stop in range(len(stop_refs)):
+            if math.isnan(lats[stop]):
+                continue
+            rows, distances = grid.query(lats[stop], lngs[stop], PLANNER_TRANSFER_RADIUS_M)
+            for other, distance in zip(rows.tolist(), distances.tolist()):
+                if other != stop:
+                    transfers[stop].append((other, int(distance / PLANNER_WALK_SPEED)))
+
+        self.stop_refs = stop_refs
+        self.stop_ids = stop_ids
+        self.stop_names = stop_names
+        self.lats = lats
+        self.lngs = lngs
+        self.grid = grid
+        self.route_stops = route_stops
+        self.route_stop_offset = route_stop_offset
+        self.route_trips = route_trips
+        self.route_trip_offset = route_trip_offset
+        self.route_time_offset = route_time_offset
+        self.route_line = route_line
+        self.route_latest = route_latest
+        self.latest = max(route_latest, default=0)
+        self.route_calendars = route_calendars
+        self.trip_calendar = trip_calendar
+        self.arrivals = arrivals
+        self.departures = departures
+        self.stop_routes = stop_routes
+        self.transfers = transfers
+        self.lines = source.lines
+        self.journey_line = journeys['line']
+        self.calendars = source.calendars
+        self._service_days = {}
+        self.built = True
+        self.built_at = time.time()
+        self.build_seconds = time.perf_counter() - started
+        logger.info("Journey planner built %d routes over %d stops in %.2fs",
+                    len(route_line), len(stop_refs), self.build_seconds)
+        return self
+
+    def service_day(self, day):
+        """(calendar is active, route has an active trip) flags for a date, cached for the next query"""
+        flags = self._service_days.get(day)
+        if flags is None:
+            active = [runs_on(calendar, day) for calendar in self.calendars]
+            routes = [any(active[calendar] for calendar in calendars) for calendars in self.route_calendars]
+            if len(self._service_days) >= 8:
+                self._service_days.clear()
+            flags = self._service_days[day] = (active, routes)
+        return flags
+
+    def _service_offset(self, day, offset):
+        """(seconds to add to the times of day + offset days, its calendar flags, its route flags)"""
+        return (offset * DAY_SECONDS, *self.service_day(day + timedelta(days=offset)))
+
+    def _nearby(self, location, radius_m):
+        rows, distances = self.grid.query(location[0], location[1], radius_m)
+        return [(stop, int(distance / PLANNER_WALK_SPEED)) for stop, distance in zip(rows.tolist(), distances.tolist())]
+
+    def _earliest_trip(self, route, position, ready, before, active):
+        """First trip of a route, earlier than trip index before, leaving position at or after ready"""
+        n_stops = self.route_stop_offset[route + 1] - self.route_stop_offset[route]
+        base = self.route_time_offset[route]
+        first_trip = self.route_trip_offset[route]
+        departures = self.departures
+        low, high = 0, before
+        while low < high:
+            middle = (low + high) // 2
+            if departures[base + middle * n_stops + position] < ready:
+                low = middle + 1
+            else:
+                high = middle
+        trip_calendar = self.trip_calendar
+        while low < before and not active[trip_calendar[first_trip + low]]:
+            low += 1
+        return low
+
+    def search(self, origin, destination, at, max_transfers=PLANNER_MAX_TRANSFERS):
+        """
+        Earliest-arrival journeys from origin to destination.
+
+        Args:
+            origin (tuple): (lat, lng)
+            destination (tuple): (lat, lng)
+            at (datetime): Departure time, naive local or aware
+            max_transfers (int): Most changes of vehicle
+
+        Returns:
+            list: Pareto-optimal journeys, fewest vehicles first, each a list of legs. A leg is
+                  ('walk', from, to, seconds) or ('ride', route, trip, board, alight, shift) where
+                  walk ends are stop ids or None for the origin and destination, and shift is
+                  what the trip's times are offset by on the day it is ridden: -DAY_SECONDS for
+                  the previous day's, 0 or DAY_SECONDS for the next day's.
+        """
+        self.queries += 1
+        if at.tzinfo is not None:
+            at = at.astimezone(TIMETABLE_TIMEZONE).replace(tzinfo=None)
+        day = at.date()
+        start = at.hour * 3600 + at.minute * 60 + at.second
+
+        # The previous day's journeys if any still run after midnight at this time, and today's
+        days = [self._service_offset(day, 0)]
+        if self.latest - DAY_SECONDS > start:
+            days.insert(0, self._service_offset(day, -1))
+        journeys, target = self._search(origin, destination, start, days, max_transfers)
+        # Tomorrow's journeys all leave after midnight, so they are only needed if nothing arrives before
+        if target >= DAY_SECONDS:
+            days.append(self._service_offset(day, 1))
+            journeys, _ = self._search(origin, destination, start, days, max_transfers)
+        return journeys
+
+    def _search(self, origin, destination, start, days, max_transfers):
+        """search() over the given _service_offset() days. Returns (journeys, arrival of the last one)."""
+        route_stops = self.route_stops
+        route_stop_offset = self.route_stop_offset
+        route_trip_offset = self.route_trip_offset
+        route_time_offset = self.route_time_offset
+        route_latest = self.route_latest
+        arrivals = self.arrivals
+        departures = self.departures
+        stop_routes = self.stop_routes
+        transfers = self.transfers
+
+        best = [INFINITY] * len(self.stop_refs)
+        previous = list(best)
+        labels = [{}]
+        marked = set()
+        for stop, seconds in self._nearby(origin, PLANNER_ACCESS_RADIUS_M):
+            best[stop] = previous[stop] = start + seconds
+            labels[0][stop] = ('walk', None, stop, seconds)
+            marked.add(stop)
+        egress = self._nearby(destination, PLANNER_ACCESS_RADIUS_M)
+
+        journeys = []
+        target = INFINITY
+        direct_seconds = int(haversine(*origin, *destination) / PLANNER_WALK_SPEED)
+        if haversine(*origin, *destination) <= PLANNER_ACCESS_RADIUS_M:
+            target = start + direct_seconds
+            journeys.append([('walk', None, None, direct_seconds)])
+
+        for round_number in range(1, max_transfers + 2):
+            queue = {}
+            for stop in marked:
+                ready = previous[stop]
+                for route, position in stop_routes[stop]:
+                    for day_index, (shift, _, route_active) in enumerate(days):
+                        # Skip days the route does not run, or has finished for by the time we get here
+                        if (route_active[route] and route_latest[route] + shift >= ready
+                                and position < queue.get((route, day_index), INFINITY)):
+                            queue[route, day_index] = position
+            if not queue:
+                break
+
+            # Boarding is only worth trying where last round arrived earlier than the round before
+            boardable = marked
+            current = list(previous)
+            round_labels = {}
+            marked = set()
+            for (route, day_index), first_position in queue.items():
+                shift, active, _ = days[day_index]
+                stop_base = route_stop_offset[route]
+                n_stops = route_stop_offset[route + 1] - stop_base
+                time_base = route_time_offset[route]
+                n_trips = route_trip_offset[route + 1] - route_trip_offset[route]
+                trip = n_trips
+                board = -1
+                for position in range(first_position, n_stops):
+                    stop = route_stops[stop_base + position]
+                    if trip < n_trips:
+                        arrival = arrivals[time_base + trip * n_stops + position] + shift
+                        if arrival < best[stop] and arrival < target:
+                            current[stop] = best[stop] = arrival
+                            round_labels[stop] = ('ride', route, trip, board, position, shift)
+                            marked.add(stop)
+                    # In the times of the day this scan is for
+                    ready = previous[stop] - shift
+                    # Trips never overtake within a route, so an earlier trip can only be caught
+                    # here if the one just before the current trip can
+                    if stop in boardable and trip > 0 and (
+                            trip == n_trips or ready <= departures[time_base + (trip - 1) * n_stops + position]):
+                        earlier = self._earliest_trip(route, position, ready, trip, active)
+                        if earlier < trip:
+                            trip = earlier
+                            board = position
+
+            for stop in list(marked):
+                for other, seconds in transfers[stop]:
+                    arrival = current[stop] + seconds
+                    if arrival < best[other] and arrival < target:
+                        current[other] = best[other] = arrival
+                        round_labels[other] = ('walk', stop, other, seconds)
+                        marked.add(other)
+
+            labels.append(round_labels)
+            improved = None
+            for stop, seconds in egress:
+                if current[stop] + seconds < target:
+                    target = current[stop] + seconds
+                    improved = (stop, seconds)
+            if improved is not None:
+                journeys.append(self._reconstruct(labels, round_number, *improved))
+            previous = current
+            if not marked:
+                break
+
+        return journeys, target
+
+    def _reconstruct(self, labels, round_number, stop, egress_seconds):
+        legs = [('walk', stop, None, egress_seconds)]
+        while True:
+            while stop not in labels[round_number]:
+                round_number -= 1
+            label = labels[round_number][stop]
+            legs.append(label)
+            if label[0] == 'walk':
+                if label[1] is None:
+                    break
+                stop = label[1]
+            else:
+                route, board = label[1], label[3]
+                stop = self.route_stops[self.route_stop_offset[route] + board]
+                round_number -= 1
+        legs.reverse()
+        return legs
+
+    def _location(self, stop, fallback):
+        if stop is None:
+            return {'lat': fallback[0], 'lng': fallback[1]}
+        return {'lat': float(self.lats[stop]), 'lng': float(self.lngs[stop])}
+
+    def journey_steps(self, legs, origin, destination):
+        """Legs of one search() journey as parse_route_steps() shaped steps"""
+        steps = []
+        for leg in legs:
+            if leg[0] == 'walk':
+                _, from_stop, to_stop, seconds = leg
+                start_location = self._location(from_stop, origin)
+                end_location = self._location(to_stop, destination)
+                if start_location == end_location:
+                    continue
+                distance = haversine(start_location['lat'], start_location['lng'],
+                                     end_location['lat'], end_location['lng'])
+                steps.append({
+                    'step_number': len(steps) + 1,
+                    'type': 'walking',
+                    'instruction': f"Walk to {self.stop_names[to_stop]}" if to_stop is not None else 'Walk to destination',
+                    'distance': format_distance(distance),
+                    'duration': format_duration(seconds),
+                    'start_location': start_location,
+                    'end_location': end_location,
+                    'maneuver': '',
+                    'polyline': encode_polyline([(start_location['lat'], start_location['lng']),
+                                                 (end_location['lat'], end_location['lng'])])
+                })
+                continue
+
+            _, route, trip, board, alight, shift = leg
+            stop_base = self.route_stop_offset[route]
+            n_stops = self.route_stop_offset[route + 1] - stop_base
+            time_base = self.route_time_offset[route] + trip * n_stops
+            stops = [self.route_stops[stop_base + position] for position in range(board, alight + 1)]
+            departure = self.departures[time_base + board] + shift
+            arrival = self.arrivals[time_base + alight] + shift
+            # Trips of different lines can share a route, so name the trip's own
+            line = self.lines[self.journey_line[self.route_trips[self.route_trip_offset[route] + trip]]]
+            distance = sum(haversine(self.lats[a], self.lngs[a], self.lats[b], self.lngs[b])
+                           for a, b in zip(stops, stops[1:]))
+            steps.append({
+                'step_number': len(steps) + 1,
+                'type': 'transit',
+                'instruction': f"Bus towards {line['destination_name'] or line['destination_ref']}",
+                'distance': format_distance(distance),
+                'duration': format_duration(arrival - departure),
+                'departure_stop': self.stop_names[stops[0]],
+                'departure_stop_ref': self.stop_refs[stops[0]],
+                'departure_time': format_clock(departure),
+                'arrival_stop': self.stop_names[stops[-1]],
+                'arrival_stop_ref': self.stop_refs[stops[-1]],
+                'arrival_time': format_clock(arrival),
+                'line_operator': line['operator_ref'],
+                'line_name': line['line_ref'],
+                'line_short_name': line['line_ref'],
+                'num_stops': alight - board,
+                'start_location': self._location(stops[0], origin),
+                'end_location': self._location(stops[-1], destination)
+            })
+        return steps
+
+    def plan(self, origin, destination, at=None, max_transfers=PLANNER_MAX_TRANSFERS):
+        """
+        Steps of the earliest arriving journey, shaped like GoogleMapsHandler.parse_route_steps()
+        output so the rest of get_route_info can treat both planners alike. Empty if none is found.
+        """
+        if at is None:
+            at = datetime.now(TIMETABLE_TIMEZONE)
+        journeys = self.search(origin, destination, at, max_transfers)
+        if not journeys:
+            return []
+        return self.journey_steps(journeys[-1], origin, destination)
+
+    def stats(self):
+        return {
+            'built': self.built,
+            'built_at': self.built_at,
+            'build_seconds': self.build_seconds,
+            'routes': len(self.route_line) if self.built else 0,
+            'stops': len(self.stop_refs) if self.built else 0,
+            'queries': self.queries
+        }
+
+
+journey_planner = JourneyPlanner()
+
+
+def init_journey_planner(source=timetable):
+    """Build the shared planner from the loaded timetable; planner=raptor is unavailable otherwise"""
+    if not source.loaded:
+        return journey_planner
+    try:
+        journey_planner.build(source)
+    except Exception as e:
+        logger.warning("Journey planner could not be built: %s", e)
+    return journey_planner
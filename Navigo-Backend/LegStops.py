@@ -0,0 +1,169 @@
+import os
+import re
+from dotenv import load_dotenv
+from Geometry import cut_shape, haversine
+from RouteStore import pattern_stops
+
+load_dotenv()
+
+# Stops further than this from a leg's start/end location are only candidates if their name matches
+LEG_MATCH_RADIUS_M = float(os.getenv('LEG_MATCH_RADIUS_M', '250'))
+# Extra cost, in metres, of a stop picked by location alone, so an exact name wins ties
+NAME_MISMATCH_PENALTY_M = 150
+# Extra cost, in metres, per stop the slice differs from the leg's num_stops
+STOP_COUNT_PENALTY_M = 40
+
+_BRACKETS = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_stop_name(name):
+    """'Derby Bus Station (Stand B3)' -> 'derbybusstation', so Google and TransXChange names compare"""
+    if not name:
+        return ''
+    name = _BRACKETS.sub('', str(name).lower().replace('&', ' and '))
+    return _NON_ALNUM.sub('', name)
+
+
+def stop_location(stop):
+    """(lat, lng) floats of a stop document, or None"""
+    try:
+        return float(stop['Latitude']), float(stop['Longitude'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def build_stop_index(patterns, stops_by_ref):
+    """
+    Precompute what match_leg() needs for one line.
+
+    Args:
+        patterns (list): All canonical journey patterns of the line
+        stops_by_ref (dict): Stop documents keyed on StopPointRef
+
+    Returns:
+        dict: 'names' (normalized name -> stop refs), 'locations' (stop ref -> (lat, lng)) and
+              'positions' (per pattern, stop ref -> its positions in that pattern)
+    """
+    names = {}
+    locations = {}
+    positions = []
+    for pattern in patterns:
+        pattern_positions = {}
+        for position, (stop_ref, _) in enumerate(pattern_stops(pattern)):
+            pattern_positions.setdefault(stop_ref, []).append(position)
+            stop = stops_by_ref.get(stop_ref)
+            if stop is None or stop_ref in locations:
+                continue
+            location = stop_location(stop)
+            if location is not None:
+                locations[stop_ref] = location
+            # Google names stops either by common name or prefixed with the locality
+            for name in (stop.get('CommonName'), f"{stop.get('LocalityName') or ''} {stop.get('CommonName') or ''}"):
+                key = normalize_stop_name(name)
+                if key and stop_ref not in names.setdefault(key, []):
+                    names[key].append(stop_ref)
+        positions.append(pattern_positions)
+    return {'names': names, 'locations': locations, 'positions': positions}
+
+
+def _leg_location(location):
+    try:
+        return float(location['lat']), float(location['lng'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _candidates(index, name, location, stop_ref=None):
+    """Stops of the line that could be the named stop of a leg, with a cost in metres"""
+    if stop_ref and stop_ref in index['locations']:
+        return {stop_ref: 0.0}
+    named = set(index['names'].get(normalize_stop_name(name), ()))
+    point = _leg_location(location)
+    candidates = {}
+    for ref in named:
+        stop_point = index['locations'].get(ref)
+        candidates[ref] = haversine(*point, *stop_point) if point and stop_point else 0.0
+    if point is not None:
+        for ref, stop_point in index['locations'].items():
+            if ref in named:
+                continue
+            distance = haversine(*point, *stop_point)
+            if distance <= LEG_MATCH_RADIUS_M:
+                candidates[ref] = distance + NAME_MISMATCH_PENALTY_M
+    return candidates
+
+
+def match_leg(index, leg):
+    """
+    Find the journey pattern segment a transit leg rides.
+
+    Args:
+        index (dict): build_stop_index() of the leg's line
+        leg (dict): A transit_details entry (departure_stop, arrival_stop, start_location,
+                    end_location, num_stops, and departure_stop_ref/arrival_stop_ref if known)
+
+    Returns:
+        tuple: (pattern index, boarding position, alighting position), or None if nothing fits
+    """
+    best = score_leg(index, leg)
+    return best[1:] if best else None
+
+
+def score_leg(index, leg):
+    """match_leg() with the cost of the match, in metres, first, so matches on different lines compare"""
+    if not index:
+        return None
+    boarding = _candidates(index, leg.get('departure_stop'), leg.get('start_location'), leg.get('departure_stop_ref'))
+    alighting = _candidates(index, leg.get('arrival_stop'), leg.get('end_location'), leg.get('arrival_stop_ref'))
+    if not boarding or not alighting:
+        return None
+    num_stops = leg.get('num_stops') or 0
+
+    best = None
+    for pattern_index, positions in enumerate(index['positions']):
+        for board_ref, board_cost in boarding.items():
+            for board in positions.get(board_ref, ()):
+                for alight_ref, alight_cost in alighting.items():
+                    for alight in positions.get(alight_ref, ()):
+                        if alight <= board:
+                            continue
+                        cost = board_cost + alight_cost
+                        if num_stops:
+                            cost += abs(alight - board - num_stops) * STOP_COUNT_PENALTY_M
+                        if best is None or cost < best[0]:
+                            best = (cost, pattern_index, board, alight)
+    return best
+
+
+def slice_pattern(pattern, board, alight, stops_by_ref):
+    """
+    The boarding-to-alighting part of a journey pattern.
+
+    The pattern's shape is cut to the same stretch, with distances from the boarding stop. A
+    shape without the distance of each stop along it cannot be cut, and is left out.
+
+    Returns:
+        tuple: (pattern with only those stops, their stop documents with 'sequence' set)
+    """
+    stop_refs = pattern.get('stop_refs') or []
+    sequences = pattern.get('sequences') or []
+    leg_pattern = dict(pattern)
+    leg_pattern['stop_refs'] = stop_refs[board:alight + 1]
+    leg_pattern['sequences'] = sequences[board:alight + 1]
+    leg_pattern.pop('shape', None)
+    stop_distances = (pattern.get('shape') or {}).get('stop_distances')
+    if stop_distances and len(stop_distances) == len(stop_refs):
+        leg_distances = stop_distances[board:alight + 1]
+        shape = None if None in leg_distances else cut_shape(pattern['shape'], leg_distances[0], leg_distances[-1])
+        if shape is not None:
+            shape['stop_distances'] = [distance - leg_distances[0] for distance in leg_distances]
+            leg_pattern['shape'] = shape
+    stops = []
+    for stop_ref, sequence in pattern_stops(leg_pattern):
+        stop = stops_by_ref.get(stop_ref)
+        if stop is not None:
+            stop = dict(stop)
+            stop['sequence'] = sequence
+            stops.append(stop)
+    return leg_pattern, stops
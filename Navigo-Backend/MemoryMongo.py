@@ -0,0 +1,549 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError
+from dotenv import load_dotenv
+from Replay import fixtures
+
+load_dotenv()
+
+# In-process stand-in for the MongoDB cluster, for running the API and its benchmarks offline
+# (MONGO_BACKEND=memory in MongoHandler.py). Supports the queries the API makes (equality,
+# $in, $exists, $or and $and, with projections and single-field indexes) and the writes of
+# write_to_db.py (bulk InsertOne, UpdateOne with $set and DeleteOne, delete_many). Unique
+# indexes are enforced, compound ones included, so duplicate writes fail as they would on a server.
+MEMORY_MONGO_ROUTES = os.getenv('MEMORY_MONGO_ROUTES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.json'))
+# Operator of route documents that do not name one, as '<operator_name> <operator_ref>' like the
+# old per-operator collections; test.json is an export of trentbarton's
+MEMORY_MONGO_ROUTES_OPERATOR = os.getenv('MEMORY_MONGO_ROUTES_OPERATOR', 'trentbarton TBTN')
+MEMORY_MONGO_STOPS = os.getenv('MEMORY_MONGO_STOPS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'all_stops.json'))
+
+
+def _lookup(doc, path):
+    """Values at a dotted path, descending into arrays the way MongoDB does"""
+    values = [doc]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, list):
+                found.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+            elif isinstance(value, dict) and part in value:
+                found.append(value[part])
+        values = found
+    return values
+
+
+def _equals(values, expected):
+    return any(value == expected or (isinstance(value, list) and expected in value) for value in values)
+
+
+def _is_operator_dict(condition):
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith('$') for key in condition)
+
+
+def matches(doc, query):
+    """Whether a document satisfies a query filter"""
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(matches(doc, part) for part in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(doc, part) for part in condition):
+                return False
+        elif _is_operator_dict(condition):
+            values = _lookup(doc, key)
+            for operator, argument in condition.items():
+                if operator == '$in':
+                    ok = any(_equals(values, expected) for expected in argument)
+                elif operator == '$nin':
+                    ok = not any(_equals(values, expected) for expected in argument)
+                elif operator == '$ne':
+                    ok = not _equals(values, argument)
+                elif operator == '$exists':
+                    ok = bool(values) == bool(argument)
+                else:
+                    raise NotImplementedError(f"MemoryMongo does not support {operator}")
+                if not ok:
+                    return False
+        elif not _equals(_lookup(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc, projection):
+    """Copy of a document restricted by a find() projection"""
+    if not projection:
+        return dict(doc)
+    included = [field for field, keep in projection.items() if keep and field != '_id']
+    if included:
+        result = {field: doc[field] for field in included if field in doc}
+        if projection.get('_id', 1) and '_id' in doc:
+            result['_id'] = doc['_id']
+        return result
+    return {field: value for field, value in doc.items() if projection.get(field, 1)}
+
+
+class MemoryCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def __iter__(self):
+        return iter(self._docs)
+
+    def limit(self, count):
+        if count:
+            self._docs = self._docs[:count]
+        return self
+
+    def to_list(self, length=None):
+        return list(self._docs if length is None else self._docs[:length])
+
+
+# The code MongoDB reports a unique index violation with
+DUPLICATE_KEY = 11000
+
+
+def _unique_key(doc, fields):
+    """A document's value for a unique index; like MongoDB, a missing field counts as null"""
+    key = []
+    for field in fields:
+        values = _lookup(doc, field)
+        value = values[0] if values else None
+        key.append(repr(value) if isinstance(value, (list, dict)) else value)
+    return tuple(key)
+
+
+def _apply_update(doc, update):
+    """Apply a $set/$unset update, or replace the document if update has no operators"""
+    if not any(key.startswith('$') for key in update):
+        return dict(update, _id=doc.get('_id'))
+    doc = dict(doc)
+    for operator, fields in update.items():
+        if operator == '$set':
+            doc.update(fields)
+        elif operator == '$unset':
+            for field in fields:
+                doc.pop(field, None)
+        else:
+            raise NotImplementedError(f"MemoryMongo does not support {operator}")
+    return doc
+
+
+class MemoryCollection:
+    def __init__(self, name, database=None):
+        self.name = name
+        self.database = database
+        self.full_name = f"{database.name if database else ''}.{name}"
+        # Deleted documents leave None behind, so index positions stay valid
+        self._docs = []
+        # field -> value -> positions in _docs; array fields are indexed per element
+        self._indexes = {}
+        # fields of a unique index -> _unique_key() -> position in _docs
+        self._unique = {}
+        self._lock = threading.Lock()
+
+    def _index_doc(self, field, position, doc):
+        index = self._indexes[field]
+        for value in _lookup(doc, field):
+            for item in value if isinstance(value, list) else (value,):
+                try:
+                    index.setdefault(item, []).append(position)
+                except TypeError:
+                    pass  # unhashable values are only found by a full scan
+
+    def _unindex_doc(self, position, doc):
+        for fields, owners in self._unique.items():
+            key = _unique_key(doc, fields)
+            if owners.get(key) == position:
+                del owners[key]
+        for field, index in self._indexes.items():
+            for value in _lookup(doc, field):
+                for item in value if isinstance(value, list) else (value,):
+                    try:
+                        positions = index.get(item)
+                    except TypeError:
+                        continue
+                    if positions and position in positions:
+                        positions.remove(position)
+
+    def create_index(self, keys, unique=False, **kwargs):
+        fields = (keys,) if isinstance(keys, str) else tuple(field for field, _ in keys)
+        name = '_'.join(f"{field}_1" for field in fields)
+        with self._lock:
+            if unique and fields not in self._unique:
+                owners = {}
+                for position, doc in enumerate(self._docs):
+                    if doc is None:
+                        continue
+                    key = _unique_key(doc, fields)
+                    if key in owners:
+                        raise OperationFailure(f"Index build failed: E11000 duplicate key error collection: "
+                                               f"{self.full_name} index: {name} dup key: {key}", code=DUPLICATE_KEY)
+                    owners[key] = position
+                self._unique[fields] = owners
+            field = fields[0]
+            if field not in self._indexes:
+                self._indexes[field] = {}
+                for position, doc in enumerate(self._docs):
+                    if doc is not None:
+                        self._index_doc(field, position, doc)
+        return name
+
+    def _check_unique(self, doc, position=None):
+        """Raise DuplicateKeyError if doc, stored at position, would break a unique index"""
+        for fields, owners in self._unique.items():
+            owner = owners.get(_unique_key(doc, fields))
+            if owner is not None and owner != position:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} dup key: "
+                                        f"{dict(zip(fields, _unique_key(doc, fields)))}", code=DUPLICATE_KEY)
+
+    def _insert(self, doc):
+        doc = dict(doc)
+        doc.setdefault('_id', ObjectId())
+        self._check_unique(doc)
+        position = len(self._docs)
+        self._docs.append(doc)
+        for field in self._indexes:
+            self._index_doc(field, position, doc)
+        for fields, owners in self._unique.items():
+            owners[_unique_key(doc, fields)] = position
+
+    def _first_position(self, query):
+        for position in self._positions(query):
+            if matches(self._docs[position], query):
+                return position
+        return None
+
+    def _update(self, query, update, upsert=False):
+        position = self._first_position(query)
+        if position is None:
+            if upsert:
+                base = {key: value for key, value in query.items()
+                        if not key.startswith('$') and not _is_operator_dict(value)}
+                self._insert(_apply_update(base, update))
+            return
+        old = self._docs[position]
+        new = _apply_update(old, update)
+        self._check_unique(new, position)
+        self._unindex_doc(position, old)
+        self._docs[position] = new
+        for field in self._indexes:
+            self._index_doc(field, position, new)
+        for fields, owners in self._unique.items():
+            owners[_unique_key(new, fields)] = position
+
+    def _delete(self, query, limit=None):
+        if not query:
+            # Fast path for clearing the collection, as write_to_db.py does before a full load
+            deleted = sum(doc is not None for doc in self._docs)
+            self._docs = []
+            self._indexes = {field: {} for field in self._indexes}
+            self._unique = {fields: {} for fields in self._unique}
+            return deleted
+        deleted = 0
+        for position in self._positions(query):
+            doc = self._docs[position]
+            if matches(doc, query):
+                self._unindex_doc(position, doc)
+                self._docs[position] = None
+                deleted += 1
+                if limit and deleted >= limit:
+                    break
+        return deleted
+
+    def insert_many(self, docs):
+        with self._lock:
+            for doc in docs:
+                self._insert(doc)
+
+    def insert_one(self, doc):
+        self.insert_many([doc])
+
+    def update_one(self, query, update, upsert=False):
+        _wait()
+        with self._lock:
+            self._update(query, update, upsert)
+
+    def delete_many(self, query):
+        _wait()
+        with self._lock:
+            return self._delete(query)
+
+    def bulk_write(self, requests, ordered=True):
+        """
+        InsertOne, UpdateOne and DeleteOne operations, applied in one round trip. Like pymongo,
+        duplicate key errors are raised together as a BulkWriteError once the batch is done, or
+        at the first one if ordered.
+        """
+        _wait()
+        counts = {'inserted': 0, 'updated': 0, 'deleted': 0}
+        write_errors = []
+        with self._lock:
+            for index, operation in enumerate(requests):
+                # pymongo keeps an operation's arguments in these attributes
+                try:
+                    if isinstance(operation, InsertOne):
+                        self._insert(operation._doc)
+                        counts['inserted'] += 1
+                    elif isinstance(operation, UpdateOne):
+                        self._update(operation._filter, operation._doc, operation._upsert)
+                        counts['updated'] += 1
+                    elif isinstance(operation, DeleteOne):
+                        counts['deleted'] += self._delete(operation._filter, limit=1)
+                    else:
+                        raise NotImplementedError(f"MemoryMongo does not support {type(operation).__name__}")
+                except DuplicateKeyError as e:
+                    write_errors.append({'index': index, 'code': e.code, 'errmsg': str(e)})
+                    if ordered:
+                        break
+        if write_errors:
+            raise BulkWriteError({'writeErrors': write_errors, 'writeConcernErrors': [], 'upserted': [],
+                                  'nInserted': counts['inserted'], 'nMatched': counts['updated'],
+                                  'nModified': counts['updated'], 'nRemoved': counts['deleted'], 'nUpserted': 0})
+        return counts
+
+    def _positions(self, query):
+        """Positions of the documents an index narrows the query down to, or of all of them"""
+        for field, condition in query.items():
+            index = self._indexes.get(field)
+            if index is None:
+                continue
+            if _is_operator_dict(condition):
+                if set(condition) != {'$in'}:
+                    continue
+                wanted = condition['$in']
+            else:
+                wanted = [condition]
+            try:
+                return sorted({position for value in wanted for position in index.get(value, ())})
+            except TypeError:
+                continue
+        return [position for position, doc in enumerate(self._docs) if doc is not None]
+
+    def _find(self, query, projection):
+        query = query or {}
+        docs = self._docs
+        return [project(docs[position], projection) for position in self._positions(query)
+                if matches(docs[position], query)]
+
+    def find(self, query=None, projection=None):
+        _wait()
+        return MemoryCursor(self._find(query, projection))
+
+    def find_one(self, query=None, projection=None):
+        _wait()
+        found = self._find(query, projection)
+        return found[0] if found else None
+
+    def count_documents(self, query):
+        _wait()
+        return len(self._find(query, None))
+
+    def drop(self):
+        # Like a pymongo handle, the collection can be used again after a drop and starts out empty
+        with self._lock:
+            self._docs = []
+            self._indexes = {}
+            self._unique = {}
+
+    def rename(self, new_name, dropTarget=False, **kwargs):
+        self.database.rename_collection(self, new_name, dropTarget)
+
+    def watch(self, *args, **kwargs):
+        raise NotImplementedError("MemoryMongo has no change streams")
+
+
+class MemoryDatabase:
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(name, self)
+            return self._collections[name]
+
+    def drop_collection(self, name):
+        with self._lock:
+            collection = self._collections.pop(name, None)
+        if collection is not None:
+            collection.drop()
+
+    def rename_collection(self, collection, new_name, drop_target=False):
+        with self._lock:
+            if new_name in self._collections and not drop_target:
+                raise OperationFailure(f"target namespace {self.name}.{new_name} exists", code=48)
+            self._collections.pop(collection.name, None)
+            collection.name = new_name
+            collection.full_name = f"{self.name}.{new_name}"
+            self._collections[new_name] = collection
+
+    def list_collection_names(self):
+        return list(self._collections)
+
+    def command(self, name, *args, **kwargs):
+        _wait()
+        if name == 'ping':
+            return {'ok': 1.0}
+        raise NotImplementedError(f"MemoryMongo does not support the {name} command")
+
+
+class MemoryClient:
+    """The subset of pymongo.MongoClient the API uses"""
+
+    def __init__(self):
+        self._databases = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = MemoryDatabase(name)
+            return self._databases[name]
+
+    @property
+    def admin(self):
+        return self['admin']
+
+    def list_database_names(self):
+        return list(self._databases)
+
+    def close(self):
+        pass
+
+
+def _wait():
+    seconds = fixtures.delay('mongo')
+    if seconds:
+        time.sleep(seconds)
+
+
+class AsyncMemoryCursor:
+    def __init__(self, find):
+        self._find = find
+
+    async def to_list(self, length=None):
+        seconds = fixtures.delay('mongo')
+        if seconds:
+            await asyncio.sleep(seconds)
+        docs = self._find()
+        return docs if length is None else docs[:length]
+
+    def __aiter__(self):
+        async def documents():
+            for doc in await self.to_list(None):
+                yield doc
+        return documents()
+
+
+class AsyncMemoryCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, query=None, projection=None):
+        return AsyncMemoryCursor(lambda: self._collection._find(query, projection))
+
+    async def find_one(self, query=None, projection=None):
+        found = await self.find(query, projection).to_list(1)
+        return found[0] if found else None
+
+
+class AsyncMemoryDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return AsyncMemoryCollection(self._database[name])
+
+    async def command(self, name, *args, **kwargs):
+        seconds = fixtures.delay('mongo')
+        if seconds:
+            await asyncio.sleep(seconds)
+        if name == 'ping':
+            return {'ok': 1.0}
+        raise NotImplementedError(f"MemoryMongo does not support the {name} command")
+
+
+class AsyncMemoryClient:
+    """The subset of pymongo.AsyncMongoClient the API uses, over the same data as memory_client()"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getitem__(self, name):
+        return AsyncMemoryDatabase(self._client[name])
+
+    @property
+    def admin(self):
+        return self['admin']
+
+    async def close(self):
+        pass
+
+
+def load_json(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def seed(client, routes_path=MEMORY_MONGO_ROUTES, routes_operator=MEMORY_MONGO_ROUTES_OPERATOR,
+         stops_path=MEMORY_MONGO_STOPS):
+    """
+    Fill RouteInfo.Routes and Stops.AllStops the way write_to_db.py would.
+
+    Args:
+        routes_path (str): Route documents, either the routes output of ingest.py or an export
+                           of one of the old per-operator collections such as test.json
+        routes_operator (str): '<operator_name> <operator_ref>' for documents without an operator
+        stops_path (str): Stop documents, e.g. all_stops.json
+    """
+    from RouteStore import ROUTES_DB, ROUTES_COLLECTION, route_document, ensure_route_indexes, merge_line_routes
+
+    operator_name, _, operator_ref = routes_operator.rpartition(' ')
+    # One document per line, holding the patterns of all its files, as write_to_db.py writes them
+    lines = {}
+    if routes_path and os.path.exists(routes_path):
+        for route_data in load_json(routes_path):
+            route_data = {key: value for key, value in route_data.items() if key != '_id'}
+            route_data.setdefault('operator_ref', operator_ref)
+            route_data.setdefault('operator_name', operator_name)
+            route_data.setdefault('file_name', None)
+            lines.setdefault((route_data['operator_ref'], route_data['line_ref']), []).append(route_data)
+    routes = [route_document(merge_line_routes(records)) for records in lines.values()]
+    routes_collection = client[ROUTES_DB][ROUTES_COLLECTION]
+    ensure_route_indexes(routes_collection)
+    routes_collection.insert_many(routes)
+
+    stops = []
+    if stops_path and os.path.exists(stops_path):
+        stops = [{key: value for key, value in stop.items() if key != '_id'} for stop in load_json(stops_path)]
+    stops_collection = client['Stops']['AllStops']
+    stops_collection.create_index('StopPointRef')
+    stops_collection.insert_many(stops)
+    return len(routes), len(stops)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def memory_client():
+    """The process-wide in-memory client, seeded on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = MemoryClient()
+                seed(client)
+                _client = client
+    return _client
+
+
+def async_memory_client():
+    return AsyncMemoryClient(memory_client())
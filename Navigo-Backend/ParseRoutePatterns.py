@@ -2,100 +2,138 @@ import xml.etree.ElementTree as ET
 import json
 import os
 from collections import defaultdict
+from TransXChangeReader import read_transxchange, journey_pattern_timing_links
+from stops import build_stop_info
+from Geometry import build_shape
+from Timetable import build_journeys
 
 
-
-def parse_transxchange(file_path):
-  
+def _point(longitude, latitude):
     try:
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-        ns = {'txc': 'http://www.transxchange.org.uk/'}
-
-        # Extract OperatorRef
-        operator_ref = root.find('.//txc:Operators/txc:Operator/txc:NationalOperatorCode', ns)
-        operator_name = root.find('.//txc:Operators/txc:Operator/txc:OperatorShortName', ns)
-        print(operator_name)
-        if operator_ref is None:
-            operator_ref = root.find('.//txc:Operators/txc:Operator/txc:OperatorCode', ns)
-        operator_ref = operator_ref.text if operator_ref is not None else None
-        operator_name = operator_name.text if operator_name is not None else None
-
-        # Extract LineRef
-        line_ref = root.find('.//txc:Services/txc:Service/txc:Line/txc:LineName', ns)
-        if line_ref is None:
-            line_ref = root.find('.//txc:Services/txc:Service/txc:Lines/txc:Line/txc:LineName', ns)
-        line_ref = line_ref.text if line_ref is not None else None
-
-        # Extract RouteName
-        route_name = root.find('.//txc:Services/txc:Service/txc:Line/txc:MarketingName', ns)
-        if route_name is None:
-            route_name = root.find('.//txc:Services/txc:Service//txc:MarketingName', ns)
-        route_name = route_name.text if route_name is not None else line_ref
-
-        # Process Journey Patterns
-        journey_patterns = []
-        for jp in root.findall('.//txc:JourneyPattern', ns):
-            jp_ref = jp.get('id')
-            direction = jp.find('txc:Direction', ns)
-            direction = direction.text if direction is not None else 'unknown'
-            route_ref = jp.find('txc:RouteRef', ns)
-            route_ref = route_ref.text if route_ref is not None else None
-            jp_section_ref = jp.find('txc:JourneyPatternSectionRefs', ns)
-            jp_section_ref = jp_section_ref.text if jp_section_ref is not None else None
-
-            # Find the corresponding JourneyPatternSection
-            stops = []
+        return float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+
+def pattern_path(document, timing_links, stop_locations):
+    """
+    (lat, lng) path of a journey pattern: the track of each route link it runs over, or a
+    straight line between the link's stops where the file has no track for it.
+
+    Returns:
+        tuple: (points, link_ends) where link_ends holds the index in points of each timing
+               link's first and last point, or None for a link that added no points
+    """
+    points = []
+    link_ends = []
+    for timing_link in timing_links:
+        route_link = document['route_link_index'].get(timing_link['route_link_ref'])
+        track = [_point(*coords) for coords in route_link['track']] if route_link else []
+        if not track:
+            track = [stop_locations.get(timing_link['from']), stop_locations.get(timing_link['to'])]
+        start = len(points)
+        points.extend(point for point in track if point is not None)
+        link_ends.append((start, len(points) - 1) if len(points) > start else None)
+    return points, link_ends
+
+
+def build_route_patterns(document, file_path):
+    """Build the route pattern record for one file from a read_transxchange() document."""
+    # Extract OperatorRef
+    operator_ref = next((op['national_operator_code'] for op in document['operators']
+                         if op['national_operator_code'] is not None), None)
+    if operator_ref is None:
+        operator_ref = next((op['operator_code'] for op in document['operators']
+                             if op['operator_code'] is not None), None)
+    operator_name = next((op['operator_short_name'] for op in document['operators']
+                          if op['operator_short_name'] is not None), None)
+
+    # Every code and name the operators go by, for looking routes up by whatever name a caller has
+    operator_aliases = []
+    for op in document['operators']:
+        for alias in (op['national_operator_code'], op['operator_code'], op['operator_short_name'],
+                      op['operator_name_on_licence'], op['trading_name']):
+            if alias is not None and alias not in operator_aliases:
+                operator_aliases.append(alias)
+
+    # Extract LineRef
+    line_ref = next((line['line_name'] for service in document['services']
+                     for line in service['lines'] if line['line_name'] is not None), None)
+
+    # Extract RouteName
+    route_name = next((service['marketing_name'] for service in document['services']
+                       if service['marketing_name'] is not None), None)
+    route_name = route_name if route_name is not None else line_ref
+
+    stop_locations = {}
+    for stop_point in document['stop_points']:
+        point = _point(stop_point['Longitude'], stop_point['Latitude'])
+        if point is not None:
+            stop_locations.setdefault(stop_point['StopPointRef'], point)
+
+    # Process Journey Patterns
+    journey_patterns = []
+    for service in document['services']:
+        for jp in service['journey_patterns']:
+            timing_links = journey_pattern_timing_links(document, jp)
+            # Stops are stored as parallel arrays, see RouteStore.pattern_stops()
+            points, link_ends = pattern_path(document, timing_links, stop_locations)
+            stop_refs = []
+            sequences = []
+            # Where each stop is on the path: a link starts at its From stop and ends at its To stop
+            stop_indexes = []
             seen_stops = set()
-            sequence = 1
-            if jp_section_ref:
-                jp_section = root.find(f".//txc:JourneyPatternSections/txc:JourneyPatternSection[@id='{jp_section_ref}']", ns)
-                if jp_section is not None:
-                    for timing_link in jp_section.findall('txc:JourneyPatternTimingLink', ns):
-                        from_stop = timing_link.find('txc:From/txc:StopPointRef', ns)
-                        to_stop = timing_link.find('txc:To/txc:StopPointRef', ns)
-
-                        if from_stop is not None and from_stop.text not in seen_stops:
-                            stops.append({
-                                "stop_ref": from_stop.text,
-                                "sequence": sequence
-                            })
-                            seen_stops.add(from_stop.text)
-                            sequence += 1
-
-                        if to_stop is not None and to_stop.text not in seen_stops:
-                            stops.append({
-                                "stop_ref": to_stop.text,
-                                "sequence": sequence
-                            })
-                            seen_stops.add(to_stop.text)
-                            sequence += 1
+            for timing_link, ends in zip(timing_links, link_ends):
+                for stop_ref, end in zip((timing_link['from'], timing_link['to']), ends or (None, None)):
+                    if stop_ref is not None and stop_ref not in seen_stops:
+                        stop_refs.append(stop_ref)
+                        sequences.append(len(stop_refs))
+                        stop_indexes.append(end)
+                        seen_stops.add(stop_ref)
 
             journey_patterns.append({
-                "journey_pattern_ref": jp_ref,
-                "direction": direction,
-                "route_ref": route_ref,
-                "stops": stops
+                "journey_pattern_ref": jp['id'],
+                "direction": jp['direction'] if jp['direction'] is not None else 'unknown',
+                "route_ref": jp['route_ref'],
+                "stop_refs": stop_refs,
+                "sequences": sequences,
+                "shape": build_shape(points, stop_indexes=stop_indexes)
             })
 
-        return {
-            "file_name": file_path,
-            "operator_ref": operator_ref,
-            "operator_name": operator_name,
-            "line_ref": line_ref,
-            "route_name": route_name,
-            "journey_patterns": journey_patterns
-        }
+    return {
+        "file_name": file_path,
+        "operator_ref": operator_ref,
+        "operator_name": operator_name,
+        "operator_aliases": operator_aliases,
+        "line_ref": line_ref,
+        "route_name": route_name,
+        "journey_patterns": journey_patterns
+    }
+
+def parse_transxchange(file_path):
+    route_result, _, _ = parse_file(file_path)
+    return route_result
+
+def parse_file(file_path):
+    """
+    Read a TransXChange file once and build its route patterns, its stops and its timed journeys.
+
+    Returns:
+        tuple: (route_result, stops, journeys), or (None, None, None) if the file could not be read
+    """
+    try:
+        document = read_transxchange(file_path)
+        route_result = build_route_patterns(document, file_path)
+        return route_result, build_stop_info(document), build_journeys(document, route_result)
 
     except ET.ParseError as e:
         print(f"Error parsing XML file {file_path}: {e}")
-        return None
+        return None, None, None
     except FileNotFoundError:
         print(f"Error: File not found at {file_path}")
-        return None
+        return None, None, None
     except Exception as e:
         print(f"An unexpected error occurred for {file_path}: {e}")
-        return None
+        return None, None, None
 
 def find_all_xml_files(directory):
     """Recursively find all XML files in the given directory and its subdirectories."""
@@ -106,35 +144,31 @@ def find_all_xml_files(directory):
                 xml_files.append(os.path.join(root, file))
     return xml_files
 
+def add_route_result(route_dict, route_result):
+    """Add one file's result to route_dict, keyed on (operator_ref, line_ref), skipping files already seen."""
+    if route_result and route_result['operator_ref'] and route_result['line_ref']:
+        key = (route_result['operator_ref'], route_result['line_ref'])
+        if not any(r['file_name'] == route_result['file_name'] for r in route_dict[key]):
+            route_dict[key].append(route_result)
+
+def flatten_route_results(route_dict):
+    route_results = []
+    for key in route_dict:
+        route_results.extend(route_dict[key])
+    return route_results
+
 def process_files(directory):
   
     xml_files = find_all_xml_files(directory)
     
-
-  
-    route_results = []
-    
     # Using dictionaries to avoid duplicates based on operator_ref and line_ref
-  
     route_dict = defaultdict(list)
     
     for file_path in xml_files:
         print(f"Processing file: {file_path}")
-      
-        
-        # Second parser
-        result2 = parse_transxchange(file_path)
-        if result2 and result2['operator_ref'] and result2['line_ref']:
-            key = (result2['operator_ref'], result2['line_ref'])
-            if not any(r['file_name'] == result2['file_name'] for r in route_dict[key]):
-                route_dict[key].append(result2)
-    
-  
+        add_route_result(route_dict, parse_transxchange(file_path))
     
-    for key in route_dict:
-        route_results.extend(route_dict[key])
-    
-    return route_results
+    return flatten_route_results(route_dict)
 
 def main():
     # Process all XML files in the TimeTables directory
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 'live' calls Google and BODS, 'record' calls them and saves every response under
+# UPSTREAM_FIXTURES_DIR, 'replay' answers from those files without any network access
+UPSTREAM_MODE = os.getenv('UPSTREAM_MODE', 'live').lower()
+UPSTREAM_FIXTURES_DIR = os.getenv('UPSTREAM_FIXTURES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures'))
+# Latency added to every replayed call, in milliseconds: one number for all upstreams or
+# per upstream, e.g. 'google=180,bods=400,mongo=3'. Also applies to the in-memory Mongo.
+UPSTREAM_LATENCY_MS = os.getenv('UPSTREAM_LATENCY_MS', '0')
+# Each delay is drawn uniformly from latency * (1 +/- jitter)
+UPSTREAM_LATENCY_JITTER = float(os.getenv('UPSTREAM_LATENCY_JITTER', '0'))
+
+UPSTREAM_MODES = ('live', 'record', 'replay')
+
+
+class ReplayMiss(LookupError):
+    """No recorded response for a call made in replay mode"""
+
+
+def parse_latency(spec):
+    """'50' -> {'*': 0.05}; 'google=180,bods=400' -> {'google': 0.18, 'bods': 0.4}"""
+    latency = {}
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, value = part.rpartition('=')
+        latency[name.strip() or '*'] = float(value) / 1000
+    return latency
+
+
+class FixtureStore:
+    """
+    Recorded upstream responses, one JSON file per call under <directory>/<upstream>/.
+
+    Keys identify a call independently of when it is made (no API keys or departure times),
+    so a recording can be replayed on any day.
+    """
+
+    def __init__(self, directory=UPSTREAM_FIXTURES_DIR, mode=UPSTREAM_MODE, latency=UPSTREAM_LATENCY_MS,
+                 jitter=UPSTREAM_LATENCY_JITTER, seed=None):
+        if mode not in UPSTREAM_MODES:
+            raise ValueError(f"UPSTREAM_MODE must be one of {', '.join(UPSTREAM_MODES)}, not {mode!r}")
+        self.directory = directory
+        self.mode = mode
+        self.latency = parse_latency(latency) if isinstance(latency, str) else dict(latency)
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+    def path(self, upstream, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, upstream, f"{digest}.json")
+
+    def delay(self, upstream):
+        """Seconds to wait before answering a call to upstream in replay mode"""
+        seconds = self.latency.get(upstream, self.latency.get('*', 0.0))
+        if seconds and self.jitter:
+            seconds *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        return max(seconds, 0.0)
+
+    def save(self, upstream, key, response):
+        if isinstance(response, bytes):
+            entry = {'key': key, 'recorded_at': time.time(), 'bytes': response.decode('utf-8')}
+        else:
+            entry = {'key': key, 'recorded_at': time.time(), 'json': response}
+        path = self.path(upstream, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A temporary file of its own, so concurrent recordings of the same key cannot interleave
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.recorded += 1
+
+    def load(self, upstream, key):
+        try:
+            with open(self.path(upstream, key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            raise ReplayMiss(f"No recorded {upstream} response for {key}") from None
+        self.replayed += 1
+        return entry['bytes'].encode('utf-8') if 'bytes' in entry else entry['json']
+
+    def call(self, upstream, key, func, *args, **kwargs):
+        """func(*args, **kwargs), recorded or replayed according to the mode"""
+        if self.mode == 'replay':
+            seconds = self.delay(upstream)
+            if seconds:
+                time.sleep(seconds)
+            return self.load(upstream, key)
+        response = func(*args, **kwargs)
+        if self.mode == 'record':
+            self.save(upstream, key, response)
+        return response
+
+    async def call_async(self, upstream, key, func, *args, **kwargs):
+        """call() for a coroutine function"""
+        if self.mode == 'replay':
+            seconds = self.delay(upstream)
+            if seconds:
+                await asyncio.sleep(seconds)
+            return self.load(upstream, key)
+        response = await func(*args, **kwargs)
+        if self.mode == 'record':
+            self.save(upstream, key, response)
+        return response
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'directory': self.directory,
+            'recorded': self.recorded,
+            'replayed': self.replayed,
+            'misses': self.misses
+        }
+
+
+fixtures = FixtureStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List recorded upstream responses')
+    parser.add_argument('--directory', default=UPSTREAM_FIXTURES_DIR)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"No fixtures in {args.directory}; run the API with UPSTREAM_MODE=record first")
+        return
+    for upstream in sorted(os.listdir(args.directory)):
+        upstream_dir = os.path.join(args.directory, upstream)
+        if not os.path.isdir(upstream_dir):
+            continue
+        names = sorted(name for name in os.listdir(upstream_dir) if name.endswith('.json'))
+        print(f"{upstream}: {len(names)} recorded responses")
+        for name in names:
+            with open(os.path.join(upstream_dir, name), 'r', encoding='utf-8') as f:
+                print(f"    {json.load(f)['key']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class SqliteBackend:
+    """Shared on-disk cache so several worker processes can reuse each other's responses"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL, value TEXT)')
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT expires, value FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[0] < time.time():
+            return MISSING
+        return json.loads(row[1])
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO cache (key, expires, value) VALUES (?, ?, ?)',
+                               (key, time.time() + ttl, json.dumps(value)))
+            self._conn.commit()
+
+
+class RedisBackend:
+    """Shared cache on any Redis-compatible server. Needs the optional redis package."""
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._redis.get(key)
+        return MISSING if value is None else json.loads(value)
+
+    def set(self, key, value, ttl):
+        self._redis.set(key, json.dumps(value), ex=max(int(ttl), 1))
+
+
+def make_backend(spec):
+    """Build a shared backend from a spec: '' or 'memory' for none, 'sqlite:<path>' or 'redis://...'"""
+    if not spec or spec == 'memory':
+        return None
+    if spec.startswith('sqlite:'):
+        return SqliteBackend(spec[len('sqlite:'):])
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(spec)
+    raise ValueError(f"Unknown cache backend: {spec}")
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory LRU cache whose entries expire after a TTL, optionally backed by
+    a shared backend. Reads check memory first, then the backend; writes go to both.
+    """
+
+    def __init__(self, max_size=1024, ttl=300, backend=None, name='cache'):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self.name = name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.backend_errors = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+
+        if self.backend is not None:
+            try:
+                value = self.backend.get(key)
+            except Exception as e:
+                self.backend_errors += 1
+                logger.warning("%s backend read failed: %s", self.name, e)
+                value = MISSING
+            if value is not MISSING:
+                self._store(key, value)
+                with self._lock:
+                    self.backend_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return MISSING
+
+    def set(self, key, value):
+        self._store(key, value)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value, self.ttl)
+            except Exception as e:
+                self.backend_errors += 1
+                logger.warning("%s backend write failed: %s", self.name, e)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_call(self, key, func, *args, **kwargs):
+        value = self.get(key)
+        if value is MISSING:
+            value = func(*args, **kwargs)
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.backend_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'backend_hits': self.backend_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.backend_hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'backend_errors': self.backend_errors
+            }
@@ -0,0 +1,205 @@
+import argparse
+import json
+import logging
+import os
+import pickle
+import time
+from dotenv import load_dotenv
+from RouteStore import (normalize_name, operator_keys, first_line_patterns, operator_aliases, canonical_pattern,
+                        pattern_stops, merge_line_routes)
+from LegStops import build_stop_index
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Prebuilt, ready-to-serve stop sequences per operator and line. Built offline with
+#   python RouteCatalog.py --routes route_patterns.json --stops all_stops.json
+ROUTE_CATALOG_PATH = os.getenv('ROUTE_CATALOG_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'route_catalog.pkl'))
+CATALOG_VERSION = 5
+
+
+def resolve_line(route_data, stops_by_ref):
+    """
+    Resolve one route document into what get_route_info serves for a leg on that line: all its
+    patterns, their stops and the index LegStops.match_leg() slices legs with, plus the first
+    inbound and outbound patterns with stops embedded for legs that cannot be matched.
+    """
+    all_patterns = [canonical_pattern(pattern) for pattern in route_data.get('journey_patterns') or []]
+    line_stops = {}
+    for pattern in all_patterns:
+        for stop_ref in pattern.get('stop_refs') or ():
+            if stop_ref in stops_by_ref:
+                line_stops.setdefault(stop_ref, stops_by_ref[stop_ref])
+
+    patterns = [canonical_pattern(pattern) for pattern in first_line_patterns(route_data)]
+    inbound_stops = []
+    outbound_stops = []
+    for pattern in patterns:
+        direction_stops = []
+        for stop_ref, sequence in pattern_stops(pattern):
+            stop = stops_by_ref.get(stop_ref)
+            if stop is None:
+                continue
+            stop = dict(stop)
+            stop['sequence'] = sequence
+            direction_stops.append(stop)
+        if pattern.get('direction') == 'inbound':
+            inbound_stops.extend(direction_stops)
+        elif 'direction' in pattern:
+            outbound_stops.extend(direction_stops)
+    return {
+        'operator_ref': route_data.get('operator_ref'),
+        'line_ref': route_data.get('line_ref'),
+        'route_name': route_data.get('route_name'),
+        'patterns': all_patterns,
+        'stops': line_stops,
+        'stop_index': build_stop_index(all_patterns, line_stops),
+        'journey_patterns': patterns,
+        'inbound_stops': inbound_stops,
+        'outbound_stops': outbound_stops
+    }
+
+
+def build_catalog(routes, stops):
+    """
+    Args:
+        routes (list): Route documents as written to RouteInfo.Routes (or the ingest routes output)
+        stops (iterable): AllStops documents
+
+    Returns:
+        dict: The catalog, ready to be pickled by save_catalog()
+    """
+    stops_by_ref = {}
+    for stop in stops:
+        stop = {k: v for k, v in stop.items() if k != '_id'}
+        stops_by_ref.setdefault(stop.get('StopPointRef'), stop)
+
+    # A line registered in several files is one line; merge its records as write_to_db does
+    line_routes = {}
+    for route_data in routes:
+        line_routes.setdefault((route_data.get('operator_ref'), route_data.get('line_ref')), []).append(route_data)
+
+    # Lookup keys are shared by lines of different operators (e.g. a brand name prefix), so each
+    # maps to every line it matches, and the leg's stops decide between them
+    lines = []
+    index = {}
+    for route_data in (merge_line_routes(records) for records in line_routes.values()):
+        # The same keys RouteStore.route_query() matches on, so lookups agree with the Mongo path
+        line_keys = {normalize_name(route_data.get('line_ref')), normalize_name(route_data.get('route_name'))}
+        for operator_key in operator_keys(route_data):
+            for line_key in line_keys:
+                if line_key:
+                    index.setdefault((operator_key, line_key), []).append(len(lines))
+        lines.append(resolve_line(route_data, stops_by_ref))
+
+    return {'version': CATALOG_VERSION, 'built_at': time.time(), 'lines': lines, 'index': index}
+
+
+def save_catalog(catalog, path=ROUTE_CATALOG_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+class RouteCatalog:
+    """Read-only, in-memory lookup of prebuilt line entries. Loaded once per process."""
+
+    def __init__(self):
+        self._lines = []
+        self._index = {}
+        self.path = None
+        self.built_at = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def loaded(self):
+        return self.path is not None
+
+    def load(self, path=ROUTE_CATALOG_PATH):
+        with open(path, 'rb') as f:
+            catalog = pickle.load(f)
+        if catalog.get('version') != CATALOG_VERSION:
+            raise ValueError(f"Route catalog {path} has version {catalog.get('version')}, expected {CATALOG_VERSION}")
+        self._lines = catalog['lines']
+        self._index = catalog['index']
+        self.built_at = catalog['built_at']
+        self.path = path
+        logger.info("Route catalog loaded %d lines from %s", len(self._lines), path)
+        return self
+
+    def get(self, operator, line_name):
+        """
+        The prebuilt entries of every line an operator and line name can refer to, or None.
+        Entries are shared, so do not modify them.
+        """
+        operator_key = normalize_name(operator)
+        line_key = normalize_name(line_name)
+        positions = list(self._index.get((operator_key, line_key), ()))
+        if operator_key in operator_aliases:
+            positions.extend(position for position in self._index.get((operator_aliases[operator_key], line_key), ())
+                             if position not in positions)
+        if not positions:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [self._lines[position] for position in positions]
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'path': self.path,
+            'lines': len(self._lines),
+            'built_at': self.built_at,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+route_catalog = RouteCatalog()
+
+
+def init_route_catalog(path=ROUTE_CATALOG_PATH):
+    """Load the shared catalog if it has been built; requests fall back to Mongo otherwise"""
+    if not os.path.exists(path):
+        return route_catalog
+    try:
+        route_catalog.load(path)
+    except Exception as e:
+        logger.warning("Route catalog could not be loaded, falling back to Mongo lookups: %s", e)
+    return route_catalog
+
+
+def load_json(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the route catalog served by the API')
+    parser.add_argument('--routes', default='route_patterns.json', help="routes output of ingest.py")
+    parser.add_argument('--stops', default='all_stops.json', help="stops output of ingest.py")
+    parser.add_argument('--from-mongo', action='store_true', help="read RouteInfo.Routes and Stops.AllStops instead")
+    parser.add_argument('--output', default=ROUTE_CATALOG_PATH)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.from_mongo:
+        from MongoHandler import get_database, close_client
+        from RouteStore import get_routes_collection
+        routes = list(get_routes_collection().find({}, {'_id': 0}))
+        stops = get_database('Stops')['AllStops'].find({}, {'_id': 0})
+        catalog = build_catalog(routes, stops)
+        close_client()
+    else:
+        catalog = build_catalog(load_json(args.routes), load_json(args.stops))
+
+    save_catalog(catalog, args.output)
+    print(f"Wrote {len(catalog['lines'])} lines ({len(catalog['index'])} lookup keys) to {args.output} "
+          f"in {time.perf_counter() - start:.2f}s ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+import argparse
+import ast
+import json
+import logging
+import os
+import re
+import bson
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import ConnectionFailure, OperationFailure
+from MongoHandler import get_database
+from Telemetry import UPSTREAM_ERRORS
+from SingleFlight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+ROUTES_DB = 'RouteInfo'
+ROUTES_COLLECTION = 'Routes'
+
+# Optional JSON file mapping extra operator names (e.g. Google agency names) to a NOC
+OPERATOR_ALIASES_FILE = os.getenv('OPERATOR_ALIASES_FILE', 'operator_aliases.json')
+
+ROUTE_PROJECTION = {'_id': 0, 'operator_ref': 1, 'line_ref': 1, 'route_name': 1, 'journey_patterns': 1}
+
+
+def normalize_name(name):
+    """Lowercase a name and strip everything but letters and digits, so 'Notts & Derby' == 'notts and derby'"""
+    if not name:
+        return ''
+    return re.sub(r'[^a-z0-9]', '', name.lower().replace('&', 'and'))
+
+
+def _load_operator_aliases():
+    if not os.path.exists(OPERATOR_ALIASES_FILE):
+        return {}
+    with open(OPERATOR_ALIASES_FILE, 'r') as f:
+        return {normalize_name(name): normalize_name(noc) for name, noc in json.load(f).items()}
+
+
+operator_aliases = _load_operator_aliases()
+
+# Concurrent lookups of the same line share one query
+route_flight = SingleFlight('route_patterns')
+
+
+def operator_keys(route_data):
+    """
+    Lookup keys for a route's operator: its codes and names, normalized, plus every leading
+    run of words of each name. The prefixes keep short brand names such as 'Arriva' matching
+    'Arriva Midlands', as the old collection-name substring search did.
+    """
+    names = [route_data.get('operator_ref'), route_data.get('operator_name')]
+    names.extend(route_data.get('operator_aliases') or [])
+
+    keys = []
+    for name in names:
+        if not name:
+            continue
+        words = re.split(r'\s+', name.strip())
+        for end in range(1, len(words) + 1):
+            key = normalize_name(' '.join(words[:end]))
+            if key and key not in keys:
+                keys.append(key)
+    return keys
+
+
+def pattern_stops(pattern):
+    """(stop_ref, sequence) pairs of a journey pattern stored in the canonical encoding"""
+    return zip(pattern.get('stop_refs') or (), pattern.get('sequences') or ())
+
+
+def canonical_pattern(pattern):
+    """
+    A journey pattern with its stops as parallel 'stop_refs' and 'sequences' arrays.
+
+    Converts the older 'stops' list of {'stop_ref', 'sequence'} dicts, some of which were
+    stored as Python-repr strings. Patterns already in the canonical form are returned as is.
+    """
+    if 'stop_refs' in pattern:
+        return pattern
+    stop_refs = []
+    sequences = []
+    for stop_obj in pattern.get('stops') or []:
+        if isinstance(stop_obj, str):
+            try:
+                stop_obj = ast.literal_eval(stop_obj)
+            except (ValueError, SyntaxError):
+                logger.warning("Couldn't parse stop object: %s", stop_obj)
+                continue
+        if isinstance(stop_obj, dict) and stop_obj.get('stop_ref'):
+            stop_refs.append(stop_obj['stop_ref'])
+            sequences.append(stop_obj.get('sequence'))
+    converted = {key: value for key, value in pattern.items() if key != 'stops'}
+    converted['stop_refs'] = stop_refs
+    converted['sequences'] = sequences
+    return converted
+
+
+def route_document(route_data):
+    return {
+        'operator_ref': route_data['operator_ref'],
+        'operator_name': route_data['operator_name'],
+        'operator_keys': operator_keys(route_data),
+        'line_ref': route_data['line_ref'],
+        'line_key': normalize_name(route_data['line_ref']),
+        'route_name': route_data['route_name'],
+        'route_key': normalize_name(route_data['route_name']),
+        'file_name': route_data['file_name'],
+        'journey_patterns': [canonical_pattern(pattern) for pattern in route_data['journey_patterns']]
+    }
+
+
+def route_upsert(route_data):
+    return UpdateOne(
+        {'operator_ref': route_data['operator_ref'], 'line_ref': route_data['line_ref']},
+        {'$set': route_document(route_data)},
+        upsert=True
+    )
+
+
+def line_route_upserts(route_records):
+    """
+    (key, upsert) pairs, one per (operator_ref, line_ref), each writing the journey patterns of
+    every record of that line in order. A line registered in several TransXChange files has one
+    record per file; upserting those one by one would leave only the last file's patterns.
+    """
+    lines = {}
+    for route_data in route_records:
+        lines.setdefault((route_data['operator_ref'], route_data['line_ref']), []).append(route_data)
+    return [(key, route_upsert(merge_line_routes(records))) for key, records in lines.items()]
+
+
+def get_routes_collection():
+    return get_database(ROUTES_DB)[ROUTES_COLLECTION]
+
+
+def ensure_route_indexes(collection=None):
+    collection = collection if collection is not None else get_routes_collection()
+    collection.create_index([('operator_ref', ASCENDING), ('line_ref', ASCENDING)], unique=True)
+    collection.create_index([('operator_keys', ASCENDING), ('line_key', ASCENDING)])
+    collection.create_index([('operator_keys', ASCENDING), ('route_key', ASCENDING)])
+
+
+def route_query(operator, line_name):
+    """The Routes filter for one operator and line, or None if either name is empty"""
+    operator_key = normalize_name(operator)
+    line_key = normalize_name(line_name)
+    if not operator_key or not line_key:
+        return None
+
+    keys = [operator_key]
+    if operator_key in operator_aliases:
+        keys.append(operator_aliases[operator_key])
+
+    return {
+        'operator_keys': {'$in': keys},
+        '$or': [{'route_key': line_key}, {'line_key': line_key}]
+    }
+
+
+def line_flight_key(operator, line_name):
+    """Key on which identical concurrent line lookups are coalesced, see SingleFlight.py"""
+    return normalize_name(operator), normalize_name(line_name)
+
+
+def find_line_routes(operator, line_name):
+    """
+    Look up the lines an operator and line name can refer to with a single indexed query. Short
+    names can match more than one line, e.g. a brand shared by several operators; the caller
+    picks the one a leg rides with LegStops.match_leg() instead of merging them.
+
+    Args:
+        operator (str): Operator name or code, e.g. the agency name from Google Directions
+        line_name (str): Line name or marketing name, e.g. the transit short name
+
+    Returns:
+        list: Route documents with operator_ref, line_ref, route_name and journey_patterns, empty if none match
+    """
+    query = route_query(operator, line_name)
+    if query is None:
+        return []
+
+    try:
+        return route_flight.do(line_flight_key(operator, line_name), _find_line_routes, query)
+    except (ConnectionFailure, OperationFailure) as e:
+        UPSTREAM_ERRORS.inc(upstream='mongo')
+        logger.error("Route lookup failed for %s %s: %s", operator, line_name, e)
+        return []
+
+
+def _find_line_routes(query):
+    return list(get_routes_collection().find(query, ROUTE_PROJECTION))
+
+
+def merge_line_routes(route_docs):
+    """One route document with the journey patterns of all the given documents of a line, in order"""
+    if not route_docs:
+        return None
+    merged = dict(route_docs[0])
+    merged['journey_patterns'] = [pattern for route_data in route_docs
+                                  for pattern in route_data.get('journey_patterns') or ()]
+    return merged
+
+
+def first_line_patterns(line_route):
+    """First inbound and first outbound journey pattern of a route document"""
+    # Variables to track the first inbound and outbound patterns
+    first_inbound = None
+    first_outbound = None
+
+    # Find the first inbound and outbound patterns of the line
+    if line_route:
+        for pattern in line_route['journey_patterns']:
+            if pattern['direction'] == 'inbound' and first_inbound is None:
+                first_inbound = pattern
+            elif pattern['direction'] == 'outbound' and first_outbound is None:
+                first_outbound = pattern
+            if first_inbound and first_outbound:
+                break
+
+    # Return only the first inbound and outbound patterns, if found(For demo purposes only. Parsed xml not accurate)
+    current_patterns = []
+    if first_inbound:
+        current_patterns.append(first_inbound)
+    if first_outbound:
+        current_patterns.append(first_outbound)
+    return current_patterns
+
+
+def migrate_route_collections(batch_size=1000):
+    """
+    Copy routes from the old per-operator '<operator_name> <operator_ref>' collections
+    into the normalized Routes collection.
+    """
+    db = get_database(ROUTES_DB)
+    collection = get_routes_collection()
+    ensure_route_indexes(collection)
+
+    migrated = 0
+    for coll_name in db.list_collection_names():
+        if coll_name == ROUTES_COLLECTION or ' ' not in coll_name:
+            continue
+        operator_name, operator_ref = coll_name.rsplit(' ', 1)
+        route_records = []
+        for doc in db[coll_name].find({}, {'_id': 0}):
+            route_data = dict(doc, operator_ref=operator_ref, operator_name=operator_name)
+            route_data.setdefault('file_name', None)
+            route_records.append(route_data)
+        operations = []
+        for _, operation in line_route_upserts(route_records):
+            operations.append(operation)
+            if len(operations) >= batch_size:
+                collection.bulk_write(operations, ordered=False)
+                migrated += len(operations)
+                operations = []
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+        print(f"Migrated collection '{coll_name}'")
+
+    print(f"Migrated {migrated} routes into {ROUTES_DB}.{ROUTES_COLLECTION}")
+
+
+def migrate_stop_encoding(batch_size=1000):
+    """Rewrite Routes documents whose journey patterns still use the old 'stops' encoding"""
+    collection = get_routes_collection()
+    operations = []
+    migrated = 0
+    bytes_before = 0
+    bytes_after = 0
+    for doc in collection.find({'journey_patterns.stops': {'$exists': True}}):
+        journey_patterns = [canonical_pattern(pattern) for pattern in doc['journey_patterns']]
+        bytes_before += len(bson.encode(doc))
+        bytes_after += len(bson.encode(dict(doc, journey_patterns=journey_patterns)))
+        operations.append(UpdateOne({'_id': doc['_id']}, {'$set': {'journey_patterns': journey_patterns}}))
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            operations = []
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+
+    print(f"Re-encoded stops of {migrated} routes: {bytes_before / 1e6:.2f} MB -> {bytes_after / 1e6:.2f} MB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='One-off RouteInfo migrations')
+    parser.add_argument('migration', nargs='?', choices=['collections', 'stops', 'all'], default='all',
+                        help="'collections' copies the old per-operator collections into Routes, "
+                             "'stops' re-encodes journey pattern stops as parallel arrays")
+    args = parser.parse_args()
+    if args.migration in ('collections', 'all'):
+        migrate_route_collections()
+    if args.migration in ('stops', 'all'):
+        migrate_stop_encoding()
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import threading
+from dotenv import load_dotenv
+from Telemetry import metrics
+
+load_dotenv()
+
+# Concurrent identical calls (the same route query, line or BODS filters) share one in-flight
+# computation, so Google, Mongo and BODS see one call per distinct query instead of one per user.
+# Nothing is kept once the call finishes; the caches do that.
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+COALESCED_CALLS = metrics.counter('navigo_coalesced_calls_total',
+                                  'Calls answered by an identical call that was already in flight', ('flight',))
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key across threads: the first caller runs the
+    function, the others block until it finishes and get the same result or exception.
+    """
+
+    def __init__(self, name, enabled=SINGLE_FLIGHT_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """func(*args, **kwargs), or the result of the identical call already running. A None key is never shared."""
+        if not self.enabled or key is None:
+            return func(*args, **kwargs)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            COALESCED_CALLS.inc(flight=self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'shared': self.shared
+        }
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutine functions on one event loop.
+
+    The shared call runs as a task of its own, so a caller that is cancelled (its client went
+    away) stops waiting without cancelling the call for everyone else.
+    """
+
+    def __init__(self, name, enabled=SINGLE_FLIGHT_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self._tasks = {}
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        """await func(*args, **kwargs), or the result of the identical call already running"""
+        if not self.enabled or key is None:
+            return await func(*args, **kwargs)
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(func(*args, **kwargs))
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.leaders += 1
+        else:
+            self.shared += 1
+            COALESCED_CALLS.inc(flight=self.name)
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # mark it retrieved, in case every caller was cancelled
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'in_flight': len(self._tasks),
+            'leaders': self.leaders,
+            'shared': self.shared
+        }
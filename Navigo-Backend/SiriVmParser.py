@@ -0,0 +1,206 @@
+import io
+import logging
+import os
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from typing import NamedTuple, Optional
+from Telemetry import UPSTREAM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+SIRI = '{http://www.siri.org.uk/siri}'
+_BOM = b'\xef\xbb\xbf'
+
+
+class VehicleActivity(NamedTuple):
+    """One SIRI-VM VehicleActivity. Any field missing from the feed is None."""
+    recorded_at: Optional[datetime] = None
+    item_identifier: Optional[str] = None
+    valid_until: Optional[datetime] = None
+    line_ref: Optional[str] = None
+    direction_ref: Optional[str] = None
+    data_frame_ref: Optional[str] = None
+    dated_vehicle_journey_ref: Optional[str] = None
+    published_line_name: Optional[str] = None
+    operator_ref: Optional[str] = None
+    origin_ref: Optional[str] = None
+    origin_name: Optional[str] = None
+    destination_ref: Optional[str] = None
+    destination_name: Optional[str] = None
+    origin_aimed_departure_time: Optional[datetime] = None
+    destination_aimed_arrival_time: Optional[datetime] = None
+    longitude: Optional[float] = None
+    latitude: Optional[float] = None
+    bearing: Optional[float] = None
+    block_ref: Optional[str] = None
+    vehicle_ref: Optional[str] = None
+    ticket_machine_service_code: Optional[str] = None
+    journey_code: Optional[str] = None
+    vehicle_unique_id: Optional[str] = None
+
+
+def _datetime(text):
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        # Python < 3.11 rejects the 'Z' suffix, and some feeds send more than 6 fractional digits
+        try:
+            return datetime.fromisoformat(text.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+
+
+def _float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+# Local element name -> (record field, converter). The element names are unique within a
+# VehicleActivity, so one flat table covers the nested MonitoredVehicleJourney and Extensions.
+_FIELDS = {
+    'RecordedAtTime': ('recorded_at', _datetime),
+    'ItemIdentifier': ('item_identifier', None),
+    'ValidUntilTime': ('valid_until', _datetime),
+    'LineRef': ('line_ref', None),
+    'DirectionRef': ('direction_ref', None),
+    'DataFrameRef': ('data_frame_ref', None),
+    'DatedVehicleJourneyRef': ('dated_vehicle_journey_ref', None),
+    'PublishedLineName': ('published_line_name', None),
+    'OperatorRef': ('operator_ref', None),
+    'OriginRef': ('origin_ref', None),
+    'OriginName': ('origin_name', None),
+    'DestinationRef': ('destination_ref', None),
+    'DestinationName': ('destination_name', None),
+    'OriginAimedDepartureTime': ('origin_aimed_departure_time', _datetime),
+    'DestinationAimedArrivalTime': ('destination_aimed_arrival_time', _datetime),
+    'Longitude': ('longitude', _float),
+    'Latitude': ('latitude', _float),
+    'Bearing': ('bearing', _float),
+    'BlockRef': ('block_ref', None),
+    'VehicleRef': ('vehicle_ref', None),
+    'TicketMachineServiceCode': ('ticket_machine_service_code', None),
+    'JourneyCode': ('journey_code', None),
+    'VehicleUniqueId': ('vehicle_unique_id', None),
+}
+
+# Dispatch on the qualified tag, so the common case needs no string splitting
+_DISPATCH = {SIRI + name: target for name, target in _FIELDS.items()}
+_DISPATCH.update(_FIELDS)  # Feeds without the SIRI default namespace
+_ACTIVITY_TAGS = {SIRI + 'VehicleActivity', 'VehicleActivity'}
+
+
+def _lookup(tag):
+    """Dispatch entry for a tag in an unexpected namespace, cached for the next occurrence"""
+    target = _FIELDS.get(tag.rpartition('}')[2], False)
+    _DISPATCH[tag] = target
+    return target
+
+
+def iter_vehicle_activities(source):
+    """
+    Stream VehicleActivity records out of a SIRI-VM document in a single pass.
+
+    Args:
+        source: Raw XML as bytes or str (a str is always the document, never a file name),
+                or an os.PathLike path or binary file object
+
+    Yields:
+        VehicleActivity: One record per VehicleActivity, in document order
+    """
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    if isinstance(source, (bytes, bytearray)):
+        # A byte order mark or whitespace before the XML declaration is not well-formed, but feeds send it
+        source = io.BytesIO(bytes(source).lstrip().removeprefix(_BOM).lstrip())
+    elif not (isinstance(source, os.PathLike) or hasattr(source, 'read')):
+        raise TypeError(f"Expected XML as bytes or str, a path or a file object, not {type(source).__name__}")
+
+    dispatch = _DISPATCH
+    activity_tags = _ACTIVITY_TAGS
+    fields = {}
+    for _, element in ET.iterparse(source, events=('end',)):
+        tag = element.tag
+        target = dispatch.get(tag)
+        if target is None:
+            target = _lookup(tag)
+        if target:
+            text = element.text
+            if text is not None:
+                text = text.strip()
+                if text:
+                    name, convert = target
+                    fields[name] = convert(text) if convert is not None else text
+        elif tag in activity_tags:
+            yield VehicleActivity(**fields)
+            fields = {}
+            element.clear()  # Drop the finished subtree so memory stays flat on national feeds
+
+
+def parse_vehicle_activities(source):
+    """All VehicleActivity records of a SIRI-VM document, or None if it is missing or not well-formed XML"""
+    if source is None:
+        return None
+    try:
+        return list(iter_vehicle_activities(source))
+    except ET.ParseError as e:
+        UPSTREAM_ERRORS.inc(upstream='bods')
+        logger.warning("BODS returned a SIRI-VM document that is not well-formed XML: %s", e)
+        return None
+
+
+def _iso(value):
+    """ISO 8601 text of a parsed time, with the 'Z' suffix BODS sends for UTC"""
+    if value is None:
+        return None
+    text = value.isoformat()
+    return text[:-6] + 'Z' if text.endswith('+00:00') else text
+
+
+def activity_to_dict(activity):
+    """The nested dict shape parse_siri_xml has always returned, with numeric coordinates"""
+    journey = {
+        'LineRef': activity.line_ref,
+        'DirectionRef': activity.direction_ref,
+        'PublishedLineName': activity.published_line_name,
+        'OperatorRef': activity.operator_ref,
+        'OriginRef': activity.origin_ref,
+        'OriginName': activity.origin_name,
+        'DestinationRef': activity.destination_ref,
+        'DestinationName': activity.destination_name,
+        'OriginAimedDepartureTime': _iso(activity.origin_aimed_departure_time),
+        'DestinationAimedArrivalTime': _iso(activity.destination_aimed_arrival_time)
+    }
+    if activity.data_frame_ref is not None or activity.dated_vehicle_journey_ref is not None:
+        journey['FramedVehicleJourneyRef'] = {
+            'DataFrameRef': activity.data_frame_ref,
+            'DatedVehicleJourneyRef': activity.dated_vehicle_journey_ref
+        }
+    if activity.longitude is not None or activity.latitude is not None:
+        journey['VehicleLocation'] = {'Longitude': activity.longitude, 'Latitude': activity.latitude}
+    if activity.block_ref is not None:
+        journey['BlockRef'] = activity.block_ref
+    if activity.vehicle_ref is not None:
+        journey['VehicleRef'] = activity.vehicle_ref
+    if activity.bearing is not None:
+        journey['Bearing'] = activity.bearing
+
+    result = {
+        'RecordedAtTime': _iso(activity.recorded_at),
+        'ItemIdentifier': activity.item_identifier,
+        'ValidUntilTime': _iso(activity.valid_until),
+        'MonitoredVehicleJourney': journey
+    }
+
+    extensions = {}
+    if activity.ticket_machine_service_code is not None or activity.journey_code is not None:
+        extensions['Operational'] = {'TicketMachine': {
+            'TicketMachineServiceCode': activity.ticket_machine_service_code,
+            'JourneyCode': activity.journey_code
+        }}
+    if activity.vehicle_unique_id is not None:
+        extensions['VehicleUniqueId'] = activity.vehicle_unique_id
+    if extensions:
+        result['Extensions'] = {'VehicleJourney': extensions}
+    return result
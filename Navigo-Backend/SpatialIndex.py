@@ -0,0 +1,83 @@
+import math
+import numpy as np
+from Geometry import haversine_many, METRES_PER_DEGREE
+
+
+class GridIndex:
+    """
+    Uniform lat/lng grid over point arrays for radius queries.
+
+    Points are sorted by cell key (row * columns + column), so all the cells of one grid row
+    that a query touches form a single contiguous slice found with searchsorted. A query reads
+    one slice per row it covers and then filters the candidates with vectorized haversine.
+    """
+
+    def __init__(self, lats, lngs, cell_size_deg=0.01):
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        valid = np.flatnonzero(~(np.isnan(lats) | np.isnan(lngs)))
+
+        self.cell_size = cell_size_deg
+        self.min_lat = float(lats[valid].min()) if len(valid) else 0.0
+        self.min_lng = float(lngs[valid].min()) if len(valid) else 0.0
+        max_lng = float(lngs[valid].max()) if len(valid) else 0.0
+        self.columns = int((max_lng - self.min_lng) / cell_size_deg) + 1
+
+        keys = self._keys(lats[valid], lngs[valid])
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        # Row numbers in the caller's arrays, plus coordinates laid out in cell order
+        self.rows = valid[order]
+        self.lats = lats[self.rows]
+        self.lngs = lngs[self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _cell(self, lat, lng):
+        return (np.floor((lat - self.min_lat) / self.cell_size).astype(np.int64),
+                np.floor((lng - self.min_lng) / self.cell_size).astype(np.int64))
+
+    def _keys(self, lats, lngs):
+        row, column = self._cell(lats, lngs)
+        return row * self.columns + column
+
+    def query(self, lat, lng, radius_m, limit=None):
+        """
+        Find indexed points within radius_m metres of (lat, lng).
+
+        Returns:
+            tuple: (rows, distances) as NumPy arrays sorted by distance, where rows are
+                   positions in the arrays the index was built from
+        """
+        if not len(self.rows):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        dlat = radius_m / METRES_PER_DEGREE
+        dlng = radius_m / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        row_lo, col_lo = self._cell(np.float64(lat - dlat), np.float64(lng - dlng))
+        row_hi, col_hi = self._cell(np.float64(lat + dlat), np.float64(lng + dlng))
+        col_lo = max(int(col_lo), 0)
+        col_hi = min(int(col_hi), self.columns - 1)
+        if col_lo > col_hi:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        row_range = np.arange(max(int(row_lo), 0), int(row_hi) + 1, dtype=np.int64)
+        starts = np.searchsorted(self.keys, row_range * self.columns + col_lo, side='left')
+        ends = np.searchsorted(self.keys, row_range * self.columns + col_hi, side='right')
+        candidates = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends) if e > s] or
+                                    [np.empty(0, dtype=np.int64)])
+        if not len(candidates):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        distances = haversine_many(lat, lng, self.lats[candidates], self.lngs[candidates])
+        within = distances <= radius_m
+        candidates = candidates[within]
+        distances = distances[within]
+
+        if limit is not None and len(distances) > limit:
+            nearest = np.argpartition(distances, limit - 1)[:limit]
+            candidates = candidates[nearest]
+            distances = distances[nearest]
+        order = np.argsort(distances, kind='stable')
+        return self.rows[candidates[order]], distances[order]
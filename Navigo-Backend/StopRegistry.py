@@ -0,0 +1,250 @@
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from array import array
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 'off', 'snapshot' (load STOP_SNAPSHOT_PATH) or 'mongo' (load Stops.AllStops)
+STOP_REGISTRY = os.getenv('STOP_REGISTRY', 'off').lower()
+STOP_SNAPSHOT_PATH = os.getenv('STOP_SNAPSHOT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'all_stops.json'))
+STOP_REGISTRY_REFRESH_SECONDS = int(os.getenv('STOP_REGISTRY_REFRESH_SECONDS', '3600'))
+STOP_REGISTRY_CHANGE_STREAM = os.getenv('STOP_REGISTRY_CHANGE_STREAM', '0') == '1'
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class _StopTable:
+    """One immutable, column-oriented copy of the stop set. Replaced wholesale on refresh."""
+
+    def __init__(self, stops):
+        self.index = {}
+        self.refs = []
+        self.common_names = []
+        self.indicators = []
+        self.locality_names = []
+        # Coordinates as stored in AllStops, so stops served from here match Mongo's exactly,
+        # and as floats for the spatial index
+        self.longitude_values = []
+        self.latitude_values = []
+        self.longitudes = array('d')
+        self.latitudes = array('d')
+        self._spatial_index = None
+
+        for stop in stops:
+            stop_ref = stop.get('StopPointRef')
+            if not stop_ref or stop_ref in self.index:
+                continue
+            self.index[stop_ref] = len(self.refs)
+            self.refs.append(_intern(stop_ref))
+            # Names and localities repeat a lot across stops, so share one string object each
+            self.common_names.append(_intern(stop.get('CommonName')))
+            self.indicators.append(_intern(stop.get('Indicator')))
+            self.locality_names.append(_intern(stop.get('LocalityName')))
+            self.longitude_values.append(stop.get('Longitude'))
+            self.latitude_values.append(stop.get('Latitude'))
+            self.longitudes.append(_float(stop.get('Longitude')))
+            self.latitudes.append(_float(stop.get('Latitude')))
+
+    def spatial_index(self):
+        """Grid index over this table's coordinates, built on first use"""
+        if self._spatial_index is None:
+            from SpatialIndex import GridIndex
+            import numpy as np
+            self._spatial_index = GridIndex(np.frombuffer(self.latitudes), np.frombuffer(self.longitudes))
+        return self._spatial_index
+
+    def stop(self, row):
+        """Build a stop dict in the same shape as an AllStops document"""
+        return {
+            'StopPointRef': self.refs[row],
+            'CommonName': self.common_names[row],
+            'Indicator': self.indicators[row],
+            'LocalityName': self.locality_names[row],
+            'Longitude': self.longitude_values[row],
+            'Latitude': self.latitude_values[row]
+        }
+
+
+class StopRegistry:
+    """
+    In-process copy of the AllStops collection for StopPointRef lookups without a database round trip.
+
+    Loads from a local snapshot (all_stops.json) or from Mongo, and can keep itself up to date on
+    a timer or from a Mongo change stream. Reads never take a lock: a refresh builds a new table
+    and swaps it in with a single assignment.
+    """
+
+    def __init__(self):
+        self._table = None
+        self._refresh_thread = None
+        self._stop_event = threading.Event()
+        self.source = None
+        self.loaded_at = None
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._table is not None
+
+    def __len__(self):
+        return len(self._table.refs) if self._table is not None else 0
+
+    def load_snapshot(self, path=STOP_SNAPSHOT_PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            stops = json.load(f)
+        self._swap(_StopTable(stops), f'snapshot:{path}')
+
+    def load_from_mongo(self):
+        from MongoHandler import get_database
+        stops = get_database('Stops')['AllStops'].find({}, {'_id': 0})
+        self._swap(_StopTable(stops), 'mongo')
+
+    def reload(self):
+        if self.source == 'mongo':
+            self.load_from_mongo()
+        elif self.source:
+            self.load_snapshot(self.source.split(':', 1)[1])
+
+    def _swap(self, table, source):
+        self._table = table
+        self.source = source
+        self.loaded_at = time.time()
+        logger.info("Stop registry loaded %d stops from %s", len(table.refs), source)
+
+    def _count(self, hits, misses):
+        with self._counter_lock:
+            self.hits += hits
+            self.misses += misses
+
+    def get(self, stop_ref):
+        table = self._table
+        if table is None:
+            return None
+        row = table.index.get(stop_ref)
+        if row is None:
+            self._count(0, 1)
+            return None
+        self._count(1, 0)
+        return table.stop(row)
+
+    def get_many(self, stop_refs):
+        """
+        Look up several stops at once.
+
+        Returns:
+            tuple: (found, missing) where found maps StopPointRef to a stop dict and
+                   missing lists the refs the registry does not know
+        """
+        table = self._table
+        if table is None:
+            return {}, list(stop_refs)
+        found = {}
+        missing = []
+        for stop_ref in stop_refs:
+            row = table.index.get(stop_ref)
+            if row is None:
+                missing.append(stop_ref)
+            else:
+                found[stop_ref] = table.stop(row)
+        self._count(len(found), len(missing))
+        return found, missing
+
+    def nearby(self, lat, lng, radius_m=500, limit=20):
+        """Stops within radius_m metres of a point, nearest first, each with its distance_m"""
+        table = self._table
+        if table is None:
+            return []
+        rows, distances = table.spatial_index().query(lat, lng, radius_m, limit)
+        stops = []
+        for row, distance in zip(rows.tolist(), distances.tolist()):
+            stop = table.stop(row)
+            stop['distance_m'] = round(distance, 1)
+            stops.append(stop)
+        return stops
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'source': self.source,
+            'stops': len(self),
+            'loaded_at': self.loaded_at,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def start_refresh(self, interval=STOP_REGISTRY_REFRESH_SECONDS, change_stream=STOP_REGISTRY_CHANGE_STREAM):
+        """Reload in a background thread, either every interval seconds or whenever AllStops changes"""
+        if self._refresh_thread is not None:
+            return
+        if change_stream and self.source == 'mongo':
+            target = self._watch_changes
+        elif interval > 0:
+            target = lambda: self._refresh_every(interval)
+        else:
+            return
+        self._refresh_thread = threading.Thread(target=target, name='stop-registry-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def stop_refresh(self):
+        self._stop_event.set()
+
+    def _refresh_every(self, interval):
+        while not self._stop_event.wait(interval):
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error("Stop registry refresh failed: %s", e)
+
+    def _watch_changes(self):
+        from MongoHandler import get_database
+        collection = get_database('Stops')['AllStops']
+        while not self._stop_event.is_set():
+            try:
+                with collection.watch(max_await_time_ms=1000) as stream:
+                    while not self._stop_event.is_set():
+                        if stream.try_next() is None:
+                            continue
+                        # Drain the rest of a burst (e.g. a bulk load) before reloading once
+                        while stream.try_next() is not None:
+                            pass
+                        self.load_from_mongo()
+            except Exception as e:
+                logger.error("Stop registry change stream failed: %s", e)
+                self._stop_event.wait(5)
+
+
+stop_registry = StopRegistry()
+
+
+def init_stop_registry(mode=STOP_REGISTRY):
+    """Load the shared registry according to STOP_REGISTRY and start its refresh thread"""
+    if mode == 'off':
+        return stop_registry
+    try:
+        if mode == 'mongo':
+            stop_registry.load_from_mongo()
+        else:
+            stop_registry.load_snapshot()
+        stop_registry.start_refresh()
+    except Exception as e:
+        logger.warning("Stop registry could not be loaded, falling back to Mongo lookups: %s", e)
+    return stop_registry
@@ -0,0 +1,560 @@
+import os
+import logging
+import pickle
+import re
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from dotenv import load_dotenv
+from TransXChangeReader import journey_pattern_timing_links
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Compiled per-stop departures, written by ingest.py alongside the routes and stops
+TIMETABLE_PATH = os.getenv('TIMETABLE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'timetable.pkl'))
+# TransXChange times are local to the operator, so queries are answered in this zone
+TIMETABLE_TIMEZONE = ZoneInfo(os.getenv('TIMETABLE_TIMEZONE', 'Europe/London'))
+TIMETABLE_VERSION = 2
+
+DAY_SECONDS = 24 * 60 * 60
+ALL_DAYS = 0b1111111
+
+_WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+# DaysOfWeek element -> bitmask of date.weekday() values
+_DAYS_OF_WEEK = {name: 1 << day for day, name in enumerate(_WEEKDAYS)}
+_DAYS_OF_WEEK.update({f'Not{name}': ALL_DAYS & ~(1 << day) for day, name in enumerate(_WEEKDAYS)})
+_DAYS_OF_WEEK.update({
+    'MondayToFriday': 0b0011111,
+    'MondayToSaturday': 0b0111111,
+    'MondayToSunday': ALL_DAYS,
+    'Weekend': 0b1100000
+})
+
+# Bank holiday groups TransXChange allows in place of the individual days
+_HOLIDAY_MONDAYS = {'EasterMonday', 'MayDay', 'SpringBank', 'LateSummerBankHolidayNotScotland'}
+_HOLIDAY_GROUPS = {
+    'HolidayMondays': _HOLIDAY_MONDAYS,
+    'Christmas': {'ChristmasDay', 'BoxingDay'},
+    'DisplacementHolidays': {'ChristmasDayHoliday', 'BoxingDayHoliday', 'NewYearsDayHoliday'},
+    'EarlyRunOff': {'ChristmasEve', 'NewYearsEve'},
+    'AllHolidaysExceptChristmas': {'NewYearsDay', 'GoodFriday', 'NewYearsDayHoliday'} | _HOLIDAY_MONDAYS,
+}
+_HOLIDAY_GROUPS['AllBankHolidays'] = (_HOLIDAY_GROUPS['AllHolidaysExceptChristmas'] | _HOLIDAY_GROUPS['Christmas']
+                                      | _HOLIDAY_GROUPS['DisplacementHolidays'])
+
+_DURATION = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?$')
+
+
+@lru_cache(maxsize=4096)
+def parse_duration(text):
+    """Seconds in an ISO 8601 duration such as PT2M30S; 0 if missing or malformed"""
+    match = _DURATION.match(text.strip()) if text else None
+    if match is None:
+        return 0
+    days, hours, minutes, seconds = match.groups()
+    return (int(days or 0) * DAY_SECONDS + int(hours or 0) * 3600 + int(minutes or 0) * 60
+            + int(float(seconds or 0)))
+
+
+def parse_clock(text):
+    """Seconds after midnight of an HH:MM[:SS] time"""
+    parts = [int(part) for part in text.strip().split(':')]
+    return parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)
+
+
+def format_clock(seconds):
+    """HH:MM of a time of day, wrapping past midnight"""
+    return f"{seconds // 3600 % 24:02d}:{seconds // 60 % 60:02d}"
+
+
+def _easter(year):
+    """Easter Sunday in the Gregorian calendar (anonymous Gregorian algorithm)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    weekday = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 19 * weekday) // 433
+    month = (h + weekday - 7 * m + 90) // 25
+    return date(year, month, (h + weekday - 7 * m + 33 * month + 19) % 32)
+
+
+def _first_monday(year, month):
+    first = date(year, month, 1)
+    return first + timedelta(days=-first.weekday() % 7)
+
+
+def _last_monday(year, month):
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=last.weekday())
+
+
+def _next_weekday(day, taken=()):
+    while day.weekday() >= 5 or day in taken:
+        day += timedelta(days=1)
+    return day
+
+
+@lru_cache(maxsize=16)
+def bank_holidays(year):
+    """
+    English and Welsh bank holidays of a year, keyed on date, as the sets of TransXChange
+    names that fall on each date. One-off holidays come from OtherPublicHoliday dates instead.
+    """
+    easter = _easter(year)
+    christmas = date(year, 12, 25)
+    boxing_day = date(year, 12, 26)
+    new_year = date(year, 1, 1)
+    named = {
+        'NewYearsDay': new_year,
+        'GoodFriday': easter - timedelta(days=2),
+        'EasterMonday': easter + timedelta(days=1),
+        'MayDay': _first_monday(year, 5),
+        'SpringBank': _last_monday(year, 5),
+        'LateSummerBankHolidayNotScotland': _last_monday(year, 8),
+        'ChristmasEve': date(year, 12, 24),
+        'ChristmasDay': christmas,
+        'BoxingDay': boxing_day,
+        'NewYearsEve': date(year, 12, 31)
+    }
+    # Substitute weekdays when the day itself falls at a weekend
+    if new_year.weekday() >= 5:
+        named['NewYearsDayHoliday'] = _next_weekday(new_year)
+    if christmas.weekday() >= 5:
+        named['ChristmasDayHoliday'] = _next_weekday(christmas, {boxing_day})
+    if boxing_day.weekday() >= 5:
+        named['BoxingDayHoliday'] = _next_weekday(boxing_day, {named.get('ChristmasDayHoliday')})
+
+    holidays = {}
+    for name, day in named.items():
+        holidays.setdefault(day, set()).add(name)
+    return holidays
+
+
+def _holiday_names(names):
+    expanded = set()
+    for name in names:
+        expanded |= _HOLIDAY_GROUPS.get(name, {name})
+    return sorted(expanded)
+
+
+def _date_ordinals(ranges):
+    ordinals = []
+    for start, end in ranges:
+        try:
+            ordinals.append((date.fromisoformat(start).toordinal(), date.fromisoformat(end).toordinal()))
+        except (TypeError, ValueError):
+            continue
+    return ordinals
+
+
+def calendar(profile, start_date, end_date):
+    """
+    Resolve an OperatingProfile, as read by TransXChangeReader, into the days a journey runs.
+
+    A journey runs on a day inside its operating period unless that day is a special day or
+    bank holiday of non-operation. Otherwise it runs on special days and bank holidays of
+    operation and on its regular days of the week. Serviced organisation (school term)
+    days are not modelled, so such journeys run on their regular days.
+
+    Returns:
+        tuple: (weekday mask, first day, last day, holidays on, holidays off, date ranges on,
+                date ranges off), with days as date ordinals and None for an open end.
+                Hashable, so identical calendars can be shared.
+    """
+    profile = profile or {}
+    if profile.get('holidays_only'):
+        mask = 0
+    elif profile.get('days_of_week'):
+        mask = 0
+        for name in profile['days_of_week']:
+            mask |= _DAYS_OF_WEEK.get(name, 0)
+    else:
+        mask = ALL_DAYS
+    first_day = _date_ordinals([(start_date, start_date)])
+    last_day = _date_ordinals([(end_date, end_date)])
+    return (
+        mask,
+        first_day[0][0] if first_day else None,
+        last_day[0][0] if last_day else None,
+        tuple(_holiday_names(profile.get('holidays_on', []))),
+        tuple(_holiday_names(profile.get('holidays_off', []))),
+        tuple(_date_ordinals(profile.get('dates_on', []))
+              + _date_ordinals([(day, day) for day in profile.get('holiday_dates_on', [])])),
+        tuple(_date_ordinals(profile.get('dates_off', []))
+              + _date_ordinals([(day, day) for day in profile.get('holiday_dates_off', [])]))
+    )
+
+
+def runs_on(calendar_entry, day):
+    """Whether a calendar() runs on a date"""
+    mask, first_day, last_day, holidays_on, holidays_off, dates_on, dates_off = calendar_entry
+    ordinal = day.toordinal()
+    if (first_day is not None and ordinal < first_day) or (last_day is not None and ordinal > last_day):
+        return False
+    if any(start <= ordinal <= end for start, end in dates_off):
+        return False
+    names = bank_holidays(day.year).get(day)
+    if names:
+        if any(name in names for name in holidays_off):
+            return False
+        if any(name in names for name in holidays_on):
+            return True
+    if any(start <= ordinal <= end for start, end in dates_on):
+        return True
+    return bool(mask & (1 << day.weekday()))
+
+
+def freeze_calendar(calendar_entry):
+    """A calendar() that has been through JSON (the ingest cache) back in its hashable form"""
+    mask, first_day, last_day, holidays_on, holidays_off, dates_on, dates_off = calendar_entry
+    return (mask, first_day, last_day, tuple(holidays_on), tuple(holidays_off),
+            tuple(tuple(pair) for pair in dates_on), tuple(tuple(pair) for pair in dates_off))
+
+
+def calendar_weekdays(calendar_entry):
+    """Weekday mask of the days a calendar can run on at all, including its extra days of operation"""
+    mask, _, _, holidays_on, _, dates_on, _ = calendar_entry
+    return ALL_DAYS if holidays_on or dates_on else mask
+
+
+def journey_times(timing_links, departure, overrides):
+    """
+    Walk a journey pattern's timing links from a departure time.
+
+    Returns:
+        tuple: (stop_refs, arrivals, departures) with times in seconds after midnight of the
+               day the journey starts, so after-midnight running goes past 86400
+    """
+    stop_refs = [timing_links[0]['from']]
+    arrivals = [departure]
+    departures = []
+    clock = departure
+    wait = 0
+    for link in timing_links:
+        override = overrides.get(link['id'], {})
+        wait += parse_duration(override.get('from_wait_time') or link['from_wait_time'])
+        clock += wait
+        departures.append(clock)
+        clock += parse_duration(override.get('run_time') or link['run_time'])
+        stop_refs.append(link['to'])
+        arrivals.append(clock)
+        wait = parse_duration(override.get('to_wait_time') or link['to_wait_time'])
+    departures.append(clock)
+    return stop_refs, arrivals, departures
+
+
+def build_journeys(document, route_result):
+    """
+    Timed journeys of one file from a read_transxchange() document.
+
+    Returns:
+        list: One dict per vehicle journey, with the line it runs on, its calendar(), and the
+              stop_refs, arrivals and departures it makes in order
+    """
+    if not route_result or not document['vehicle_journeys']:
+        return []
+    if not document['services']:
+        logger.warning("%s has VehicleJourneys but no Service, skipping its journeys", route_result.get('file_name'))
+        return []
+
+    services = {service['service_code']: service for service in document['services']}
+    line_names = {line['id']: line['line_name'] for service in document['services'] for line in service['lines']}
+    patterns = {jp['id']: jp for service in document['services'] for jp in service['journey_patterns']}
+    pattern_links = {}
+    calendars = {}
+
+    journeys = []
+    for vehicle_journey in document['vehicle_journeys']:
+        jp = patterns.get(vehicle_journey['journey_pattern_ref'])
+        if jp is None or not vehicle_journey['departure_time']:
+            continue
+        if jp['id'] not in pattern_links:
+            pattern_links[jp['id']] = journey_pattern_timing_links(document, jp)
+        timing_links = pattern_links[jp['id']]
+        if not timing_links:
+            continue
+
+        service = services.get(vehicle_journey['service_ref']) or document['services'][0]
+        profile = vehicle_journey['operating_profile'] or service['operating_profile']
+        calendar_key = (repr(profile), service['start_date'], service['end_date'])
+        if calendar_key not in calendars:
+            calendars[calendar_key] = calendar(profile, service['start_date'], service['end_date'])
+
+        departure = (parse_clock(vehicle_journey['departure_time'])
+                     + int(vehicle_journey['departure_day_shift'] or 0) * DAY_SECONDS)
+        overrides = {link['journey_pattern_timing_link_ref']: link for link in vehicle_journey['timing_links']}
+        stop_refs, arrivals, departures = journey_times(timing_links, departure, overrides)
+
+        journeys.append({
+            'operator_ref': route_result['operator_ref'],
+            'line_ref': line_names.get(vehicle_journey['line_ref']) or route_result['line_ref'],
+            'direction': jp['direction'] if jp['direction'] is not None else 'unknown',
+            'calendar': calendars[calendar_key],
+            'stop_refs': stop_refs,
+            'arrivals': arrivals,
+            'departures': departures
+        })
+    return journeys
+
+
+def build_timetable(journeys, stops):
+    """
+    Compile timed journeys into a columnar departures index.
+
+    Journeys calling at a stop are grouped by day type (the weekdays their calendar can run
+    on), and each group is a sorted array of departure times with a parallel array of journey
+    ids. A departure board is then a binary search and a short forward scan per day type.
+    Whether a journey actually runs on a given date is checked at query time. Journeys are
+    not listed at their last stop.
+
+    Args:
+        journeys (iterable): build_journeys() output of every file
+        stops (iterable): AllStops documents, for destination names and stop locations
+
+    Returns:
+        dict: The timetable, ready to be pickled by save_timetable()
+    """
+    stops = list(stops)
+    stop_names = {stop.get('StopPointRef'): stop.get('CommonName') for stop in stops}
+
+    lines = []
+    line_ids = {}
+    calendars = []
+    calendar_ids = {}
+    patterns = []
+    pattern_ids = {}
+    journey_line = array('I')
+    journey_calendar = array('I')
+    journey_pattern = array('I')
+    # Stop times of journey i are arrivals/departures[journey_offset[i]:journey_offset[i + 1]]
+    journey_offset = array('I', [0])
+    journey_arrivals = array('I')
+    journey_departures = array('I')
+    seen = set()
+    by_stop = {}
+
+    for journey in journeys:
+        journey_calendar_entry = freeze_calendar(journey['calendar'])
+        stop_refs = tuple(journey['stop_refs'])
+        # The same journey is often published in more than one file
+        key = (journey['operator_ref'], journey['line_ref'], journey_calendar_entry, stop_refs,
+               tuple(journey['departures']))
+        if key in seen:
+            continue
+        seen.add(key)
+
+        line_key = (journey['operator_ref'], journey['line_ref'], journey['direction'], stop_refs[-1])
+        if line_key not in line_ids:
+            line_ids[line_key] = len(lines)
+            lines.append({
+                'operator_ref': journey['operator_ref'],
+                'line_ref': journey['line_ref'],
+                'direction': journey['direction'],
+                'destination_ref': stop_refs[-1],
+                'destination_name': stop_names.get(stop_refs[-1])
+            })
+        if journey_calendar_entry not in calendar_ids:
+            calendar_ids[journey_calendar_entry] = len(calendars)
+            calendars.append(journey_calendar_entry)
+        if stop_refs not in pattern_ids:
+            pattern_ids[stop_refs] = len(patterns)
+            patterns.append(stop_refs)
+
+        journey_id = len(journey_line)
+        journey_line.append(line_ids[line_key])
+        journey_calendar.append(calendar_ids[journey_calendar_entry])
+        journey_pattern.append(pattern_ids[stop_refs])
+        journey_arrivals.extend(journey['arrivals'])
+        journey_departures.extend(journey['departures'])
+        journey_offset.append(len(journey_departures))
+
+        day_type = calendar_weekdays(journey_calendar_entry)
+        for stop_ref, departure in zip(stop_refs[:-1], journey['departures']):
+            by_stop.setdefault(stop_ref, {}).setdefault(day_type, []).append((departure, journey_id))
+
+    # Name and (lat, lng) of every stop a journey calls at, for journey planning
+    called_at = {stop_ref for pattern in patterns for stop_ref in pattern}
+    stop_locations = {}
+    for stop in stops:
+        stop_ref = stop.get('StopPointRef')
+        if stop_ref not in called_at or stop_ref in stop_locations:
+            continue
+        try:
+            stop_locations[stop_ref] = (stop.get('CommonName'), float(stop['Latitude']), float(stop['Longitude']))
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    stops_index = {}
+    for stop_ref, day_types in by_stop.items():
+        columns = []
+        for day_type, entries in sorted(day_types.items()):
+            entries.sort()
+            columns.append((day_type,
+                            array('I', [departure for departure, _ in entries]),
+                            array('I', [journey_id for _, journey_id in entries])))
+        stops_index[stop_ref] = columns
+
+    return {
+        'version': TIMETABLE_VERSION,
+        'built_at': time.time(),
+        'lines': lines,
+        'calendars': calendars,
+        'patterns': patterns,
+        'journeys': {
+            'line': journey_line,
+            'calendar': journey_calendar,
+            'pattern': journey_pattern,
+            'offset': journey_offset,
+            'arrivals': journey_arrivals,
+            'departures': journey_departures
+        },
+        'stops': stops_index,
+        'stop_locations': stop_locations
+    }
+
+
+def save_timetable(timetable, path=TIMETABLE_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(timetable, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+class Timetable:
+    """Read-only, in-memory departures index. Loaded once per process."""
+
+    def __init__(self):
+        self.lines = []
+        self.calendars = []
+        self.patterns = []
+        self.journeys = {}
+        self._stops = {}
+        self.stop_locations = {}
+        self.path = None
+        self.built_at = None
+        self.queries = 0
+
+    @property
+    def loaded(self):
+        return self.path is not None
+
+    def load(self, path=TIMETABLE_PATH):
+        with open(path, 'rb') as f:
+            timetable = pickle.load(f)
+        if timetable.get('version') != TIMETABLE_VERSION:
+            raise ValueError(f"Timetable {path} has version {timetable.get('version')}, expected {TIMETABLE_VERSION}")
+        self.lines = timetable['lines']
+        self.calendars = timetable['calendars']
+        self.patterns = timetable['patterns']
+        self.journeys = timetable['journeys']
+        self._stops = timetable['stops']
+        self.stop_locations = timetable['stop_locations']
+        self.built_at = timetable['built_at']
+        self.path = path
+        logger.info("Timetable loaded %d journeys at %d stops from %s", len(self.journeys['line']), len(self._stops), path)
+        return self
+
+    def has_stop(self, stop_ref):
+        return stop_ref in self._stops
+
+    def departures(self, stop_ref, at, limit=10):
+        """
+        The next scheduled departures from a stop.
+
+        Args:
+            stop_ref (str): StopPointRef
+            at (datetime): Naive local time, or an aware time in any zone
+            limit (int): Most departures to return
+
+        Returns:
+            list: Up to limit dicts in departure order, or None if the stop has no departures
+        """
+        columns = self._stops.get(stop_ref)
+        if columns is None:
+            return None
+        self.queries += 1
+        if at.tzinfo is not None:
+            at = at.astimezone(TIMETABLE_TIMEZONE).replace(tzinfo=None)
+        today = at.date()
+        now = at.hour * 3600 + at.minute * 60 + at.second
+        journey_calendar = self.journeys['calendar']
+        journey_line = self.journeys['line']
+        running = {}
+
+        found = []
+        # Journeys of yesterday still running after midnight, then today's, then tomorrow's if needed
+        for offset in (-1, 0, 1):
+            day = today + timedelta(days=offset)
+            weekday = 1 << day.weekday()
+            for day_type, times, journey_ids in columns:
+                if not day_type & weekday:
+                    continue
+                taken = 0
+                for position in range(bisect_left(times, now - offset * DAY_SECONDS), len(times)):
+                    journey_id = journey_ids[position]
+                    calendar_id = journey_calendar[journey_id]
+                    if (calendar_id, day) not in running:
+                        running[calendar_id, day] = runs_on(self.calendars[calendar_id], day)
+                    if running[calendar_id, day]:
+                        found.append((offset * DAY_SECONDS + times[position], day, times[position], journey_id))
+                        taken += 1
+                        if taken == limit:
+                            break
+            found.sort()
+            # Tomorrow's journeys all leave after midnight, so they are only needed to fill the board
+            if offset == 0 and len(found) >= limit and found[limit - 1][0] < DAY_SECONDS:
+                break
+
+        result = []
+        for _, day, departure, journey_id in found[:limit]:
+            line = self.lines[journey_line[journey_id]]
+            departs_at = datetime.combine(day, datetime.min.time()) + timedelta(seconds=departure)
+            result.append({
+                'departure_time': departs_at.isoformat(),
+                'scheduled': format_clock(departure),
+                'operator_ref': line['operator_ref'],
+                'line_ref': line['line_ref'],
+                'direction': line['direction'],
+                'destination_ref': line['destination_ref'],
+                'destination_name': line['destination_name']
+            })
+        return result
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'path': self.path,
+            'stops': len(self._stops),
+            'journeys': len(self.journeys.get('line', [])),
+            'built_at': self.built_at,
+            'queries': self.queries
+        }
+
+
+timetable = Timetable()
+
+
+def init_timetable(path=TIMETABLE_PATH):
+    """Load the shared timetable if ingest has built one; the departures endpoint is unavailable otherwise"""
+    if not os.path.exists(path):
+        return timetable
+    try:
+        timetable.load(path)
+    except Exception as e:
+        logger.warning("Timetable could not be loaded: %s", e)
+    return timetable
+
+
+def parse_departure_time(text):
+    """The time a departure board is for: ?at= as ISO 8601, or now in the timetable's zone"""
+    if not text:
+        return datetime.now(TIMETABLE_TIMEZONE)
+    return datetime.fromisoformat(text)
@@ -0,0 +1,243 @@
+import os
+import logging
+import threading
+import time
+from datetime import timezone
+from dotenv import load_dotenv
+from BodsApiHandler import fetch_datafeed, make_session
+from SiriVmParser import parse_vehicle_activities, activity_to_dict
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 'off' or 'on'. Each server process runs its own poller, so run one worker per poller where possible.
+VEHICLE_POLLER = os.getenv('VEHICLE_POLLER', 'off').lower()
+# Comma separated National Operator Codes to poll, e.g. 'NDTR,TBTN'
+BODS_POLL_OPERATORS = os.getenv('BODS_POLL_OPERATORS', '')
+# minLon,minLat,maxLon,maxLat; used instead of operators when set
+BODS_POLL_BOUNDING_BOX = os.getenv('BODS_POLL_BOUNDING_BOX', '')
+# BODS republishes positions roughly every 10 seconds
+BODS_POLL_INTERVAL_SECONDS = float(os.getenv('BODS_POLL_INTERVAL_SECONDS', '10'))
+# Used for activities without a ValidUntilTime
+VEHICLE_DEFAULT_TTL_SECONDS = float(os.getenv('VEHICLE_DEFAULT_TTL_SECONDS', '120'))
+
+
+def expiry_time(value):
+    """Seconds since the epoch of a parsed SIRI timestamp, reading naive times as UTC"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def normalize_ref(value):
+    return value.strip().lower() if value else ''
+
+
+def vehicle_id(activity):
+    """Stable id of a VehicleActivity: operator plus vehicle, falling back to the item id"""
+    if activity.vehicle_ref:
+        return f"{activity.operator_ref}:{activity.vehicle_ref}"
+    return activity.item_identifier
+
+
+def line_keys(activity):
+    """
+    (operator, line) keys a vehicle is filed under: its OperatorRef, a national operator code,
+    with its LineRef and with its PublishedLineName
+    """
+    operator = normalize_ref(activity.operator_ref)
+    # Index both refs, as Google's short names match PublishedLineName more often than LineRef
+    lines = (normalize_ref(activity.line_ref), normalize_ref(activity.published_line_name))
+    return {(operator, line) for line in lines if line}
+
+
+def _moved(old, new):
+    return (old.longitude != new.longitude or old.latitude != new.latitude or old.bearing != new.bearing
+            or old.recorded_at != new.recorded_at or old.dated_vehicle_journey_ref != new.dated_vehicle_journey_ref)
+
+
+def vehicle_changes(old_vehicles, new_vehicles):
+    """
+    What changed between two snapshots, grouped by line.
+
+    Returns:
+        dict: (operator, line) -> {'updated': [(vehicle id, activity)], 'removed': [vehicle id]}
+    """
+    changes = {}
+    for vid, (_, activity) in new_vehicles.items():
+        old = old_vehicles.get(vid)
+        old_keys = set()
+        if old is not None:
+            old_keys = line_keys(old[1])
+            if not _moved(old[1], activity) and old_keys == line_keys(activity):
+                continue
+        keys = line_keys(activity)
+        for key in keys:
+            changes.setdefault(key, {'updated': [], 'removed': []})['updated'].append((vid, activity))
+        for key in old_keys - keys:
+            changes.setdefault(key, {'updated': [], 'removed': []})['removed'].append(vid)
+    for vid, (_, activity) in old_vehicles.items():
+        if vid not in new_vehicles:
+            for key in line_keys(activity):
+                changes.setdefault(key, {'updated': [], 'removed': []})['removed'].append(vid)
+    return changes
+
+
+class _VehicleSnapshot:
+    """One immutable view of the live feed, indexed by vehicle and by (operator, line)"""
+
+    def __init__(self, vehicles, fetched_at):
+        self.vehicles = vehicles  # vehicle id -> (expires_at, activity)
+        self.fetched_at = fetched_at
+        self.by_line = {}
+        for vid, (expires_at, activity) in vehicles.items():
+            for key in line_keys(activity):
+                self.by_line.setdefault(key, []).append(vid)
+
+
+class VehiclePoller:
+    """
+    Polls the BODS SIRI-VM feed on a fixed cadence and keeps the latest position of every vehicle in memory.
+
+    One upstream request per interval covers every configured operator (or the bounding box), so
+    API reads never call BODS. A vehicle stays visible until its ValidUntilTime, even if it drops
+    out of a single poll. Reads never take a lock: each poll builds a new snapshot and swaps it in.
+    """
+
+    def __init__(self, operators=BODS_POLL_OPERATORS, bounding_box=BODS_POLL_BOUNDING_BOX,
+                 interval=BODS_POLL_INTERVAL_SECONDS):
+        if isinstance(operators, str):
+            operators = operators.split(',')
+        self.operators = [op.strip() for op in operators if op.strip()]
+        self.bounding_box = bounding_box
+        self.interval = interval
+        self._snapshot = _VehicleSnapshot({}, None)
+        self._session = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._listeners = []
+        self.polls = 0
+        self.poll_errors = 0
+        self.last_poll_seconds = None
+
+    def query(self):
+        if self.bounding_box:
+            return {'boundingBox': self.bounding_box}
+        if self.operators:
+            return {'operatorRef': ','.join(self.operators)}
+        return {}
+
+    def add_listener(self, callback):
+        """Call callback(changes) from the polling thread whenever vehicles move, see vehicle_changes()"""
+        self._listeners.append(callback)
+
+    def poll_once(self):
+        """Fetch and parse the feed once, then merge it into the snapshot"""
+        started = time.perf_counter()
+        if self._session is None:
+            self._session = make_session(pool_size=1)
+        xml_data = fetch_datafeed(self.query(), self._session)
+        activities = parse_vehicle_activities(xml_data)
+        if activities is None:
+            self.poll_errors += 1
+            return False
+        self.update(activities)
+        self.polls += 1
+        self.last_poll_seconds = time.perf_counter() - started
+        return True
+
+    def update(self, activities, now=None):
+        """Merge SiriVmParser.VehicleActivity records into a new snapshot, dropping expired vehicles"""
+        now = time.time() if now is None else now
+        vehicles = {vid: entry for vid, entry in self._snapshot.vehicles.items() if entry[0] > now}
+        for activity in activities:
+            vid = vehicle_id(activity)
+            if not vid:
+                continue
+            expires_at = expiry_time(activity.valid_until) or now + VEHICLE_DEFAULT_TTL_SECONDS
+            if expires_at > now:
+                vehicles[vid] = (expires_at, activity)
+        previous = self._snapshot
+        self._snapshot = _VehicleSnapshot(vehicles, now)
+
+        if self._listeners:
+            changes = vehicle_changes(previous.vehicles, vehicles)
+            if changes:
+                for callback in self._listeners:
+                    try:
+                        callback(changes)
+                    except Exception as e:
+                        logger.exception("Vehicle poller listener failed: %s", e)
+
+    def vehicles_for_line(self, operator_ref, line_ref, now=None, with_ids=False):
+        """Live VehicleActivity records of one line, or (vehicle id, record) pairs with with_ids"""
+        now = time.time() if now is None else now
+        snapshot = self._snapshot
+        vids = snapshot.by_line.get((normalize_ref(operator_ref), normalize_ref(line_ref)), [])
+        live = [(vid, snapshot.vehicles[vid][1]) for vid in vids if snapshot.vehicles[vid][0] > now]
+        return live if with_ids else [activity for _, activity in live]
+
+    def line_locations(self, operator_ref, line_ref):
+        """Live vehicles of one line in the nested dict shape of parse_siri_xml"""
+        return [activity_to_dict(activity) for activity in self.vehicles_for_line(operator_ref, line_ref)]
+
+    def vehicle(self, vid, now=None):
+        now = time.time() if now is None else now
+        entry = self._snapshot.vehicles.get(vid)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry[1]
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'running': self.running,
+            'query': self.query(),
+            'vehicles': len(snapshot.vehicles),
+            'lines': len(snapshot.by_line),
+            'fetched_at': snapshot.fetched_at,
+            'polls': self.polls,
+            'poll_errors': self.poll_errors,
+            'last_poll_seconds': self.last_poll_seconds
+        }
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='bods-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.poll_once()
+            except Exception as e:
+                self.poll_errors += 1
+                logger.error("Vehicle poll failed: %s", e)
+            # Keep a fixed cadence regardless of how long the fetch took
+            self._stop_event.wait(max(self.interval - (time.monotonic() - started), 0))
+
+
+vehicle_poller = VehiclePoller()
+
+
+def init_vehicle_poller(mode=VEHICLE_POLLER):
+    """Start the shared poller according to VEHICLE_POLLER"""
+    if mode != 'on':
+        return vehicle_poller
+    if not vehicle_poller.query():
+        logger.warning("Vehicle poller not started: set BODS_POLL_OPERATORS or BODS_POLL_BOUNDING_BOX")
+        return vehicle_poller
+    vehicle_poller.start()
+    return vehicle_poller
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+from dotenv import load_dotenv
+from VehiclePoller import vehicle_poller, normalize_ref
+
+load_dotenv()
+
+# Messages buffered per subscriber before it is considered too slow and sent a fresh snapshot instead
+VEHICLE_STREAM_QUEUE_SIZE = int(os.getenv('VEHICLE_STREAM_QUEUE_SIZE', '32'))
+# Seconds between keep-alive messages, so proxies do not close idle streams
+VEHICLE_STREAM_HEARTBEAT_SECONDS = float(os.getenv('VEHICLE_STREAM_HEARTBEAT_SECONDS', '15'))
+# Most lines one subscriber may follow
+VEHICLE_STREAM_MAX_LINES = int(os.getenv('VEHICLE_STREAM_MAX_LINES', '10'))
+
+
+def vehicle_position(vid, activity):
+    """The fields a live map needs for one vehicle"""
+    return {
+        'id': vid,
+        'operator_ref': activity.operator_ref,
+        'line_ref': activity.line_ref,
+        'published_line_name': activity.published_line_name,
+        'direction': activity.direction_ref,
+        'journey_ref': activity.dated_vehicle_journey_ref,
+        'latitude': activity.latitude,
+        'longitude': activity.longitude,
+        'bearing': activity.bearing,
+        'recorded_at': activity.recorded_at.isoformat() if activity.recorded_at is not None else None
+    }
+
+
+def parse_line_keys(spec):
+    """
+    Turn 'NDTR:U1,TBTN:Indigo' into [('ndtr', 'u1'), ('tbtn', 'indigo')].
+    The operator is a national operator code, the operator_ref getRouteInfo adds to a transit
+    leg, and the line is the leg's line_short_name. See VehiclePoller.line_keys().
+    """
+    keys = []
+    for item in (spec or '').split(','):
+        operator, _, line = item.partition(':')
+        key = (normalize_ref(operator), normalize_ref(line))
+        if key[0] and key[1] and key not in keys:
+            keys.append(key)
+    return keys
+
+
+class Subscriber:
+    def __init__(self, keys, queue_size=VEHICLE_STREAM_QUEUE_SIZE):
+        self.keys = keys
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.resync = False
+
+    def offer(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Too far behind for deltas to be useful: drop them and send a full snapshot next
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.resync = True
+            self.queue.put_nowait(None)
+
+
+class VehicleHub:
+    """
+    Fans vehicle position changes from the shared poller out to streaming clients.
+
+    The poller calls publish() once per poll from its own thread. Each changed line is turned
+    into one JSON message, shared by every subscriber to that line, so the work per poll grows
+    with the number of changed lines plus the number of deliveries, not with the upstream feed.
+    """
+
+    def __init__(self, poller=vehicle_poller):
+        self.poller = poller
+        self.loop = None
+        self.subscribers = {}  # (operator, line) -> set of Subscriber
+        self.published = 0
+        self.delivered = 0
+        self.resyncs = 0
+
+    def start(self, loop):
+        """Attach to the server's event loop and start receiving poller changes"""
+        if self.loop is None:
+            self.loop = loop
+            self.poller.add_listener(self.publish)
+
+    def publish(self, changes):
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._dispatch, changes)
+
+    def _dispatch(self, changes):
+        for key, change in changes.items():
+            subscribers = self.subscribers.get(key)
+            if not subscribers:
+                continue
+            message = json.dumps({
+                'type': 'delta',
+                'operator': key[0],
+                'line': key[1],
+                'updated': [vehicle_position(vid, activity) for vid, activity in change['updated']],
+                'removed': change['removed']
+            })
+            self.published += 1
+            for subscriber in subscribers:
+                subscriber.offer(message)
+                self.delivered += 1
+
+    def snapshot_message(self, keys):
+        lines = []
+        for operator, line in keys:
+            vehicles = self.poller.vehicles_for_line(operator, line, with_ids=True)
+            lines.append({
+                'operator': operator,
+                'line': line,
+                'vehicles': [vehicle_position(vid, activity) for vid, activity in vehicles]
+            })
+        return json.dumps({'type': 'snapshot', 'lines': lines})
+
+    def subscribe(self, keys):
+        subscriber = Subscriber(keys)
+        for key in keys:
+            self.subscribers.setdefault(key, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        for key in subscriber.keys:
+            subscribers = self.subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[key]
+
+    async def messages(self, keys, heartbeat=VEHICLE_STREAM_HEARTBEAT_SECONDS):
+        """
+        Async generator of JSON messages for one client: a snapshot of its lines, then deltas.
+        Yields None when a heartbeat is due.
+        """
+        subscriber = self.subscribe(keys)
+        try:
+            yield self.snapshot_message(keys)
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if subscriber.resync:
+                    subscriber.resync = False
+                    self.resyncs += 1
+                    yield self.snapshot_message(keys)
+                elif message is not None:
+                    yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        return {
+            'lines': len(self.subscribers),
+            'subscriptions': sum(len(s) for s in self.subscribers.values()),
+            'published': self.published,
+            'delivered': self.delivered,
+            'resyncs': self.resyncs
+        }
+
+
+vehicle_hub = VehicleHub()
@@ -0,0 +1,118 @@
+"""
+Compare resolving JourneyPatterns with a per-pattern XPath scan of the document
+(the original parse_transxchange approach) against an id -> section index built
+once per document, which is what TransXChangeReader.read_transxchange() does.
+
+Usage: python benchmarks/bench_journey_patterns.py [TimeTables directory]
+"""
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ParseRoutePatterns import find_all_xml_files, build_route_patterns
+from TransXChangeReader import read_transxchange
+
+ns = {'txc': 'http://www.transxchange.org.uk/'}
+
+# Operator datasets bundled under TimeTables, matched on directory name
+DATASETS = {
+    'NDTR': '10210_90073',
+    'trentbarton': 'trentbarton',
+}
+
+
+def scan_journey_patterns(root):
+    """The original lookup: one full-document XPath search per JourneyPattern."""
+    journey_patterns = []
+    for jp in root.findall('.//txc:JourneyPattern', ns):
+        stops = []
+        for section_ref in jp.findall('txc:JourneyPatternSectionRefs', ns):
+            jp_section = root.find(f".//txc:JourneyPatternSections/txc:JourneyPatternSection[@id='{section_ref.text}']", ns)
+            if jp_section is None:
+                continue
+            for timing_link in jp_section.findall('txc:JourneyPatternTimingLink', ns):
+                from_stop = timing_link.find('txc:From/txc:StopPointRef', ns)
+                to_stop = timing_link.find('txc:To/txc:StopPointRef', ns)
+                if from_stop is not None:
+                    stops.append(from_stop.text)
+                if to_stop is not None:
+                    stops.append(to_stop.text)
+        journey_patterns.append(stops)
+    return journey_patterns
+
+
+def index_journey_patterns(root):
+    """The indexed lookup: build id -> section once, then resolve every reference from it."""
+    sections = {}
+    for jp_section in root.iterfind('.//txc:JourneyPatternSections/txc:JourneyPatternSection', ns):
+        sections.setdefault(jp_section.get('id'), jp_section)
+
+    journey_patterns = []
+    for jp in root.findall('.//txc:JourneyPattern', ns):
+        stops = []
+        for section_ref in jp.findall('txc:JourneyPatternSectionRefs', ns):
+            jp_section = sections.get(section_ref.text)
+            if jp_section is None:
+                continue
+            for timing_link in jp_section.findall('txc:JourneyPatternTimingLink', ns):
+                from_stop = timing_link.find('txc:From/txc:StopPointRef', ns)
+                to_stop = timing_link.find('txc:To/txc:StopPointRef', ns)
+                if from_stop is not None:
+                    stops.append(from_stop.text)
+                if to_stop is not None:
+                    stops.append(to_stop.text)
+        journey_patterns.append(stops)
+    return journey_patterns
+
+
+def run_scan(roots):
+    for root in roots:
+        scan_journey_patterns(root)
+
+
+def run_indexed(roots):
+    for root in roots:
+        index_journey_patterns(root)
+
+
+def run_reader(files):
+    for file_path in files:
+        build_route_patterns(read_transxchange(file_path), file_path)
+
+
+def time_it(func, arg, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else './TimeTables'
+    all_files = find_all_xml_files(directory)
+
+    print("Pattern lookup on pre-parsed trees, plus the full streaming parse for reference")
+    print(f"{'dataset':<12} {'files':>6} {'patterns':>9} {'xpath scan':>11} {'indexed':>9} {'speedup':>8} {'reader':>8}")
+    for name, marker in DATASETS.items():
+        files = sorted(f for f in all_files if marker in f)
+        if not files:
+            print(f"{name:<12} no files found under {directory}")
+            continue
+
+        roots = [ET.parse(f).getroot() for f in files]
+        patterns = sum(len(root.findall('.//txc:JourneyPattern', ns)) for root in roots)
+        scan = time_it(run_scan, roots)
+        indexed = time_it(run_indexed, roots)
+        reader = time_it(run_reader, files)
+        print(f"{name:<12} {len(files):>6} {patterns:>9} {scan:>10.3f}s {indexed:>8.3f}s "
+              f"{scan / indexed:>7.1f}x {reader:>7.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Query latency of the local RAPTOR planner, and optionally a comparison with the Google path
+of a running server on the same origin/destination pairs.
+
+Usage:
+    python benchmarks/bench_journey_planner.py [--timetable timetable.pkl] [--queries 500]
+    python benchmarks/bench_journey_planner.py --server http://localhost:5000 --queries 50
+
+Pairs are random stops of the timetable (seeded), planned at random times of one day. With
+--server, each pair is sent to /api/getRouteInfo with planner=google and planner=raptor.
+Google requests are billed, so keep --queries small there.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Timetable import Timetable, TIMETABLE_PATH
+from JourneyPlanner import JourneyPlanner
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def sample_queries(planner, count, day, seed):
+    rng = random.Random(seed)
+    located = [stop for stop in range(len(planner.stop_refs)) if not math.isnan(planner.lats[stop])]
+    queries = []
+    for _ in range(count):
+        a, b = rng.sample(located, 2)
+        at = datetime.combine(day, datetime.min.time()) + timedelta(seconds=rng.randint(6 * 3600, 21 * 3600))
+        queries.append(((float(planner.lats[a]), float(planner.lngs[a])),
+                        (float(planner.lats[b]), float(planner.lngs[b])), at))
+    return queries
+
+
+def summarize(name, latencies, found):
+    latencies = sorted(latencies)
+    print(f"{name:<20} {len(latencies):>7} {found:>6} {percentile(latencies, 0.50) * 1000:>9.1f} "
+          f"{percentile(latencies, 0.95) * 1000:>9.1f} {percentile(latencies, 0.99) * 1000:>9.1f}")
+
+
+def bench_in_process(planner, queries):
+    latencies = []
+    found = 0
+    for origin, destination, at in queries:
+        started = time.perf_counter()
+        journeys = planner.search(origin, destination, at)
+        latencies.append(time.perf_counter() - started)
+        found += bool(journeys)
+    summarize('raptor (in process)', latencies, found)
+
+
+def bench_server(server, queries):
+    import requests
+
+    session = requests.Session()
+    for planner in ('raptor', 'google'):
+        latencies = []
+        found = 0
+        for origin, destination, at in queries:
+            params = {'origin': f"{origin[0]},{origin[1]}", 'destination': f"{destination[0]},{destination[1]}",
+                      'planner': planner, 'at': at.isoformat()}
+            started = time.perf_counter()
+            response = session.get(f"{server}/api/getRouteInfo?{urlencode(params)}")
+            latencies.append(time.perf_counter() - started)
+            if response.ok and response.json().get('data', {}).get('transit_details'):
+                found += 1
+        summarize(f"{planner} (server)", latencies, found)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local journey planner latency, optionally against Google')
+    parser.add_argument('--timetable', default=TIMETABLE_PATH)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--date', default=None, help="service day to plan on (default: next Monday)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server', default=None, help="also time /api/getRouteInfo on this server")
+    args = parser.parse_args()
+
+    if args.date:
+        day = datetime.fromisoformat(args.date).date()
+    else:
+        today = datetime.now().date()
+        day = today + timedelta(days=7 - today.weekday())
+
+    planner = JourneyPlanner().build(Timetable().load(args.timetable))
+    queries = sample_queries(planner, args.queries, day, args.seed)
+
+    print(f"{'planner':<20} {'queries':>7} {'found':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    bench_in_process(planner, queries)
+    if args.server:
+        bench_server(args.server.rstrip('/'), queries)
+
+
+if __name__ == '__main__':
+    main()
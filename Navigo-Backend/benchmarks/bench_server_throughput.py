@@ -0,0 +1,85 @@
+"""
+Measure concurrent-request throughput and latency of one or more running API servers,
+e.g. the Flask app (FrontendApi.py) against the ASGI app (AsyncFrontendApi.py under uvicorn).
+
+Usage:
+    python benchmarks/bench_server_throughput.py http://localhost:5000 http://localhost:8000 \
+        --path "/api/getRouteInfo?origin=DE22 3FY&destination=Queens Medical Centre, Nottingham" \
+        --concurrency 1 8 32 128 --requests 500
+
+To measure the pipeline without Google, BODS or Atlas, record the requests once against the
+live services and then replay them with a fixed upstream latency (see Replay.py and MemoryMongo.py):
+    UPSTREAM_MODE=record python FrontendApi.py            # and send the benchmark paths once
+    UPSTREAM_MODE=replay MONGO_BACKEND=memory UPSTREAM_LATENCY_MS=google=180,mongo=3 \
+        GMAPS_CACHE_SIZE=0 uvicorn AsyncFrontendApi:app --port 8000
+"""
+import argparse
+import asyncio
+import time
+import aiohttp
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+async def run_level(session, url, concurrency, total_requests):
+    """Send total_requests GETs to url (or round-robin over a list of urls), at most concurrency at a time"""
+    urls = [url] if isinstance(url, str) else list(url)
+    latencies = []
+    errors = 0
+    remaining = iter(range(total_requests))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            started = time.perf_counter()
+            try:
+                async with session.get(urls[i % len(urls)]) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total_requests,
+        'errors': errors,
+        'req_per_s': total_requests / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000
+    }
+
+
+async def main(args):
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        print(f"{'server':<32} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for base_url in args.servers:
+            url = base_url.rstrip('/') + args.path
+            # Warm caches and connection pools before measuring
+            await run_level(session, url, 1, args.warmup)
+            for concurrency in args.concurrency:
+                result = await run_level(session, url, concurrency, args.requests)
+                print(f"{base_url:<32} {concurrency:>5} {result['req_per_s']:>9.1f} {result['p50_ms']:>9.1f} "
+                      f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['errors']:>7}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrent-request throughput of API servers')
+    parser.add_argument('servers', nargs='+', help='Base URLs, e.g. http://localhost:5000')
+    parser.add_argument('--path', default='/api/getRouteInfo?origin=DE22%203FY&destination=Queens%20Medical%20Centre',
+                        help='Request path and query string')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--requests', type=int, default=500, help='Requests per concurrency level')
+    parser.add_argument('--warmup', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,197 @@
+"""
+Compare the original parse_siri_xml (namespaced find() per field) with the streaming
+SiriVmParser on a national-size SIRI-VM payload.
+
+Usage: python benchmarks/bench_siri_parser.py [recorded SIRI-VM file] [--activities N]
+
+Without a recorded file, a synthetic payload with the BODS element layout is generated.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SiriVmParser import parse_vehicle_activities, activity_to_dict
+
+ACTIVITY_TEMPLATE = """<VehicleActivity>
+<RecordedAtTime>2024-05-01T12:{m:02d}:{s:02d}+00:00</RecordedAtTime>
+<ItemIdentifier>{item}</ItemIdentifier>
+<ValidUntilTime>2024-05-01T12:{vm:02d}:{s:02d}.123456</ValidUntilTime>
+<MonitoredVehicleJourney>
+<LineRef>{line}</LineRef>
+<DirectionRef>{direction}</DirectionRef>
+<FramedVehicleJourneyRef>
+<DataFrameRef>2024-05-01</DataFrameRef>
+<DatedVehicleJourneyRef>{journey}</DatedVehicleJourneyRef>
+</FramedVehicleJourneyRef>
+<PublishedLineName>{line}</PublishedLineName>
+<OperatorRef>{operator}</OperatorRef>
+<OriginRef>3390C{origin}</OriginRef>
+<OriginName>Victoria_Bus_Station</OriginName>
+<DestinationRef>1000DG{destination}</DestinationRef>
+<DestinationName>Queens_Medical_Centre</DestinationName>
+<OriginAimedDepartureTime>2024-05-01T11:50:00+00:00</OriginAimedDepartureTime>
+<DestinationAimedArrivalTime>2024-05-01T12:45:00+00:00</DestinationAimedArrivalTime>
+<VehicleLocation>
+<Longitude>{lon:.6f}</Longitude>
+<Latitude>{lat:.6f}</Latitude>
+</VehicleLocation>
+<Bearing>{bearing}</Bearing>
+<BlockRef>{block}</BlockRef>
+<VehicleRef>{vehicle}</VehicleRef>
+</MonitoredVehicleJourney>
+<Extensions>
+<VehicleJourney>
+<Operational>
+<TicketMachine>
+<TicketMachineServiceCode>{line}</TicketMachineServiceCode>
+<JourneyCode>{journey}</JourneyCode>
+</TicketMachine>
+</Operational>
+<VehicleUniqueId>{vehicle}</VehicleUniqueId>
+</VehicleJourney>
+</Extensions>
+</VehicleActivity>
+"""
+
+
+def synthetic_payload(activities, seed=1):
+    rng = random.Random(seed)
+    body = []
+    for i in range(activities):
+        m, s = rng.randrange(60), rng.randrange(60)
+        body.append(ACTIVITY_TEMPLATE.format(
+            m=m, s=s, vm=(m + 5) % 60, item=f"{rng.getrandbits(64):016x}-{i}",
+            line=rng.choice(['1', 'U1', 'swi', 'Indigo', 'Y5', '36']), direction=rng.choice(['inbound', 'outbound']),
+            journey=rng.randrange(1000, 9999), operator=rng.choice(['NDTR', 'TBTN', 'NCTR', 'ARBB']),
+            origin=rng.randrange(10000), destination=rng.randrange(10000),
+            lon=rng.uniform(-5.5, 1.7), lat=rng.uniform(50.0, 55.8), bearing=rng.randrange(360),
+            block=rng.randrange(100), vehicle=f"{rng.randrange(100000)}"))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<Siri xmlns="http://www.siri.org.uk/siri" version="2.0"><ServiceDelivery>'
+            '<ResponseTimestamp>2024-05-01T12:00:00+00:00</ResponseTimestamp><ProducerRef>DepartmentForTransport</ProducerRef>'
+            '<VehicleMonitoringDelivery><ResponseTimestamp>2024-05-01T12:00:00+00:00</ResponseTimestamp>'
+            + ''.join(body) +
+            '</VehicleMonitoringDelivery></ServiceDelivery></Siri>').encode('utf-8')
+
+
+def legacy_parse_siri_xml(xml_string):
+    """The original parser: about 20 namespaced find() calls per VehicleActivity."""
+
+    try:
+        root = ET.fromstring(xml_string)
+        # Define the namespace to handle the xmlns attributes
+        namespaces = {'siri': 'http://www.siri.org.uk/siri'}
+        vehicle_activities = []
+        for vehicle_activity_element in root.findall('.//siri:VehicleActivity', namespaces):
+            activity_data = {}
+            activity_data['RecordedAtTime'] = vehicle_activity_element.find('./siri:RecordedAtTime', namespaces).text
+            activity_data['ItemIdentifier'] = vehicle_activity_element.find('./siri:ItemIdentifier', namespaces).text
+            activity_data['ValidUntilTime'] = vehicle_activity_element.find('./siri:ValidUntilTime', namespaces).text
+
+            monitored_vehicle_journey = vehicle_activity_element.find('./siri:MonitoredVehicleJourney', namespaces)
+            if monitored_vehicle_journey is not None:
+                mvj_data = {}
+                mvj_data['LineRef'] = monitored_vehicle_journey.find('./siri:LineRef', namespaces).text
+                mvj_data['DirectionRef'] = monitored_vehicle_journey.find('./siri:DirectionRef', namespaces).text
+
+                framed_vehicle_journey_ref = monitored_vehicle_journey.find('./siri:FramedVehicleJourneyRef', namespaces)
+                if framed_vehicle_journey_ref is not None:
+                    fvjr_data = {}
+                    fvjr_data['DataFrameRef'] = framed_vehicle_journey_ref.find('./siri:DataFrameRef', namespaces).text
+                    fvjr_data['DatedVehicleJourneyRef'] = framed_vehicle_journey_ref.find('./siri:DatedVehicleJourneyRef', namespaces).text
+                    mvj_data['FramedVehicleJourneyRef'] = fvjr_data
+
+                mvj_data['PublishedLineName'] = monitored_vehicle_journey.find('./siri:PublishedLineName', namespaces).text
+                mvj_data['OperatorRef'] = monitored_vehicle_journey.find('./siri:OperatorRef', namespaces).text
+                mvj_data['OriginRef'] = monitored_vehicle_journey.find('./siri:OriginRef', namespaces).text
+                mvj_data['OriginName'] = monitored_vehicle_journey.find('./siri:OriginName', namespaces).text
+                mvj_data['DestinationRef'] = monitored_vehicle_journey.find('./siri:DestinationRef', namespaces).text
+                mvj_data['DestinationName'] = monitored_vehicle_journey.find('./siri:DestinationName', namespaces).text
+                mvj_data['OriginAimedDepartureTime'] = monitored_vehicle_journey.find('./siri:OriginAimedDepartureTime', namespaces).text
+                mvj_data['DestinationAimedArrivalTime'] = monitored_vehicle_journey.find('./siri:DestinationAimedArrivalTime', namespaces).text
+
+                vehicle_location = monitored_vehicle_journey.find('./siri:VehicleLocation', namespaces)
+                if vehicle_location is not None:
+                    location_data = {}
+                    location_data['Longitude'] = vehicle_location.find('./siri:Longitude', namespaces).text
+                    location_data['Latitude'] = vehicle_location.find('./siri:Latitude', namespaces).text
+                    mvj_data['VehicleLocation'] = location_data
+
+                block_ref = monitored_vehicle_journey.find('./siri:BlockRef', namespaces)
+                if block_ref is not None:
+                    mvj_data['BlockRef'] = block_ref.text
+
+                vehicle_ref = monitored_vehicle_journey.find('./siri:VehicleRef', namespaces)
+                if vehicle_ref is not None:
+                    mvj_data['VehicleRef'] = vehicle_ref.text
+
+                bearing = monitored_vehicle_journey.find('./siri:Bearing', namespaces)
+                if bearing is not None:
+                    mvj_data['Bearing'] = bearing.text
+
+                activity_data['MonitoredVehicleJourney'] = mvj_data
+
+            extensions = vehicle_activity_element.find('./siri:Extensions/siri:VehicleJourney', namespaces)
+            if extensions is not None:
+                extensions_data = {}
+                operational = extensions.find('./siri:Operational/siri:TicketMachine', namespaces)
+                if operational is not None:
+                    ticket_machine_data = {}
+                    ticket_machine_data['TicketMachineServiceCode'] = operational.find('./siri:TicketMachineServiceCode', namespaces).text
+                    ticket_machine_data['JourneyCode'] = operational.find('./siri:JourneyCode', namespaces).text
+                    extensions_data['Operational'] = {'TicketMachine': ticket_machine_data}
+
+                vehicle_unique_id = extensions.find('./siri:VehicleUniqueId', namespaces)
+                if vehicle_unique_id is not None:
+                    extensions_data['VehicleUniqueId'] = vehicle_unique_id.text
+
+                activity_data['Extensions'] = {'VehicleJourney': extensions_data}
+
+            vehicle_activities.append(activity_data)
+        return vehicle_activities
+    except ET.ParseError as e:
+        print(f"Error parsing XML: {e}")
+        return None
+
+
+def time_it(func, arg, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SIRI-VM parse rate, original vs streaming parser')
+    parser.add_argument('payload', nargs='?', help='Recorded SIRI-VM XML file')
+    parser.add_argument('--activities', type=int, default=20000, help='Size of the synthetic payload')
+    args = parser.parse_args()
+
+    if args.payload:
+        with open(args.payload, 'rb') as f:
+            payload = f.read()
+    else:
+        payload = synthetic_payload(args.activities)
+
+    records = parse_vehicle_activities(payload)
+    legacy = time_it(legacy_parse_siri_xml, payload.decode('utf-8'))
+    streaming = time_it(parse_vehicle_activities, payload)
+    with_dicts = time_it(lambda data: [activity_to_dict(a) for a in parse_vehicle_activities(data)], payload)
+
+    print(f"{len(records)} activities, {len(payload) / 1e6:.1f} MB")
+    print(f"{'parser':<28} {'seconds':>8} {'activities/s':>13} {'speedup':>8}")
+    for name, elapsed in [('parse_siri_xml (original)', legacy), ('SiriVmParser records', streaming),
+                          ('SiriVmParser + dicts', with_dicts)]:
+        print(f"{name:<28} {elapsed:>8.3f} {len(records) / elapsed:>13.0f} {legacy / elapsed:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
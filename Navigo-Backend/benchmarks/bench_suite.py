@@ -0,0 +1,316 @@
+"""
+Benchmark suite whose results are kept as JSON and compared between commits.
+
+Groups (all by default, or pick some with --only):
+    ingest  parse_transxchange and parse_stop_info over the TimeTables corpus (files/s, MB/s)
+    siri    parse_siri_xml on recorded SIRI-VM feeds, or on a synthetic national-size one (records/s)
+    write   write_to_db.py loading route patterns and stops into the in-memory Mongo (docs/s)
+    api     /api/getRouteInfo latency and requests/s at increasing concurrency, against
+            AsyncFrontendApi under uvicorn replaying recorded Google/BODS responses
+
+Usage:
+    python benchmarks/bench_suite.py --output bench-$(git rev-parse --short HEAD).json
+    python benchmarks/bench_suite.py --baseline bench-main.json --output bench-new.json
+
+With --baseline, every metric is compared with the baseline run and the script exits with
+status 1 if one got worse by more than --threshold (--api-threshold for the noisier api group).
+
+The api group needs recorded responses (UPSTREAM_MODE=record, see Replay.py): it sends one
+request per recorded Google directions call. Use --server to measure an already running server
+instead of starting one.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# The api group's server keeps the caller's settings (e.g. MEMORY_MONGO_ROUTES to serve)
+SERVER_ENV = dict(os.environ)
+# The write group loads into the in-memory Mongo, starting from empty collections
+os.environ['MONGO_BACKEND'] = 'memory'
+os.environ['MEMORY_MONGO_ROUTES'] = ''
+os.environ['MEMORY_MONGO_STOPS'] = ''
+
+GROUPS = ('ingest', 'siri', 'write', 'api')
+DEFAULT_LATENCY = 'google=180,bods=300,mongo=2'
+
+
+def metric(value, unit, better='higher'):
+    return {'value': round(value, 3), 'unit': unit, 'better': better}
+
+
+def best_time(func, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def corpus_files(directory, max_files):
+    from ParseRoutePatterns import find_all_xml_files
+
+    files = sorted(find_all_xml_files(directory))
+    return files[:max_files] if max_files else files
+
+
+def bench_ingest(args):
+    from ParseRoutePatterns import parse_transxchange
+    from stops import parse_stop_info
+
+    files = corpus_files(args.timetables, args.max_files)
+    if not files:
+        return {}, f"no TransXChange files under {args.timetables}"
+    megabytes = sum(os.path.getsize(path) for path in files) / 1e6
+    results = {}
+    for name, parse in (('parse_transxchange', parse_transxchange), ('parse_stop_info', parse_stop_info)):
+        elapsed = best_time(lambda paths: [parse(path) for path in paths], files, args.repeat)
+        results[f"ingest.{name}.files_per_s"] = metric(len(files) / elapsed, 'files/s')
+        results[f"ingest.{name}.mb_per_s"] = metric(megabytes / elapsed, 'MB/s')
+    print(f"ingest: {len(files)} files, {megabytes:.1f} MB")
+    return results, None
+
+
+def bench_siri(args):
+    from BodsApiHandler import parse_siri_xml
+
+    if args.siri_file:
+        payloads = []
+        for path in args.siri_file:
+            with open(path, 'rb') as f:
+                payloads.append(f.read())
+    else:
+        from bench_siri_parser import synthetic_payload
+        payloads = [synthetic_payload(args.siri_activities)]
+
+    records = sum(len(parse_siri_xml(payload) or ()) for payload in payloads)
+    megabytes = sum(len(payload) for payload in payloads) / 1e6
+    elapsed = best_time(lambda items: [parse_siri_xml(payload) for payload in items], payloads, args.repeat)
+    print(f"siri: {records} records, {megabytes:.1f} MB")
+    return {
+        'siri.parse_siri_xml.records_per_s': metric(records / elapsed, 'records/s'),
+        'siri.parse_siri_xml.mb_per_s': metric(megabytes / elapsed, 'MB/s')
+    }, None
+
+
+def bench_write(args):
+    from ParseRoutePatterns import parse_transxchange, add_route_result, flatten_route_results
+    from collections import defaultdict
+    import write_to_db
+
+    route_dict = defaultdict(list)
+    for path in corpus_files(args.timetables, args.max_files):
+        add_route_result(route_dict, parse_transxchange(path))
+    routes = flatten_route_results(route_dict)
+    if not routes or not os.path.exists(args.stops):
+        return {}, "no route patterns or stops to load"
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        routes_path = os.path.join(tmp, 'route_patterns.json')
+        with open(routes_path, 'w') as f:
+            json.dump(routes, f)
+        for name, load, path in (('routes', write_to_db.process_route_patterns, routes_path),
+                                 ('stops', write_to_db.process_all_stops, args.stops)):
+            started = time.perf_counter()
+            writer = load(path, args.batch_size)
+            elapsed = time.perf_counter() - started
+            results[f"write.{name}.docs_per_s"] = metric(writer.operations / elapsed, 'docs/s')
+    return results, None
+
+
+def recorded_paths(fixtures_dir):
+    """A getRouteInfo path for every recorded Google directions call"""
+    google_dir = os.path.join(fixtures_dir, 'google')
+    if not os.path.isdir(google_dir):
+        return []
+    paths = []
+    for name in sorted(os.listdir(google_dir)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(google_dir, name), 'r', encoding='utf-8') as f:
+            key = json.load(f)['key']
+        # directions_replay_key(): directions|<origin>|<destination>|<mode>
+        kind, origin, destination, mode = key.split('|')
+        if kind == 'directions' and mode == 'transit':
+            paths.append('/api/getRouteInfo?' + urlencode({'origin': origin, 'destination': destination}))
+    return paths
+
+
+def start_server(args, port):
+    env = dict(SERVER_ENV, UPSTREAM_MODE='replay', UPSTREAM_FIXTURES_DIR=os.path.abspath(args.fixtures),
+               UPSTREAM_LATENCY_MS=args.latency, GMAPS_CACHE_SIZE='0', MONGO_BACKEND='memory',
+               METRICS_ENABLED='false', LOG_LEVEL='WARNING')
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'AsyncFrontendApi:app', '--port', str(port),
+                               '--log-level', 'warning'], cwd=BACKEND_DIR, env=env)
+    return server
+
+
+async def wait_for_server(session, base_url, timeout=60):
+    import aiohttp
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{base_url}/api/health") as response:
+                if response.status < 500:
+                    return True
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.25)
+    return False
+
+
+async def measure_api(args, base_url, paths):
+    import aiohttp
+    from bench_server_throughput import run_level
+
+    urls = [base_url + path for path in paths]
+    results = {}
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        if not await wait_for_server(session, base_url):
+            return {}, f"server at {base_url} did not come up"
+        await run_level(session, urls, 1, args.warmup)
+        for concurrency in args.concurrency:
+            level = await run_level(session, urls, concurrency, args.requests)
+            prefix = f"api.getRouteInfo.c{concurrency}"
+            results[f"{prefix}.req_per_s"] = metric(level['req_per_s'], 'req/s')
+            for name in ('p50_ms', 'p95_ms', 'p99_ms'):
+                results[f"{prefix}.{name}"] = metric(level[name], 'ms', 'lower')
+            results[f"{prefix}.errors"] = metric(level['errors'], 'requests', 'lower')
+            print(f"api: concurrency {concurrency}: {level['req_per_s']:.1f} req/s, p50 {level['p50_ms']:.1f} ms, "
+                  f"p99 {level['p99_ms']:.1f} ms, {level['errors']} errors")
+    return results, None
+
+
+def bench_api(args):
+    paths = recorded_paths(args.fixtures)
+    if not paths:
+        return {}, f"no recorded Google directions responses under {args.fixtures}"
+    if args.server:
+        return asyncio.run(measure_api(args, args.server.rstrip('/'), paths))
+    server = start_server(args, args.port)
+    try:
+        return asyncio.run(measure_api(args, f"http://127.0.0.1:{args.port}", paths))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BACKEND_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def compare(baseline, current, threshold, api_threshold):
+    """Print each metric against the baseline and return the names of those that regressed"""
+    regressions = []
+    print(f"{'metric':<44} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, entry in sorted(current['metrics'].items()):
+        old = baseline.get('metrics', {}).get(name)
+        if old is None:
+            continue
+        before, after = old['value'], entry['value']
+        if before:
+            change = (after - before) / before
+        else:
+            change = 0.0 if after == before else float('inf')
+        worse = -change if entry['better'] == 'higher' else change
+        limit = api_threshold if name.startswith('api.') else threshold
+        flag = ''
+        if worse > limit:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<44} {before:>12.3f} {after:>12.3f} {change * 100:>7.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite with JSON results and regression thresholds')
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=list(GROUPS))
+    parser.add_argument('--output', default=None, help="write the results here (default: stdout)")
+    parser.add_argument('--baseline', default=None, help="results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="allowed relative slowdown before a metric counts as a regression")
+    parser.add_argument('--api-threshold', type=float, default=0.25, help="--threshold for the api group")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per parse benchmark; the best one counts")
+    parser.add_argument('--timetables', default=os.path.join(BACKEND_DIR, 'TimeTables'))
+    parser.add_argument('--max-files', type=int, default=0, help="only the first N corpus files (0 = all)")
+    parser.add_argument('--siri-file', nargs='*', default=[], help="recorded SIRI-VM feeds")
+    parser.add_argument('--siri-activities', type=int, default=20000, help="size of the synthetic feed")
+    parser.add_argument('--stops', default=os.path.join(BACKEND_DIR, 'all_stops.json'))
+    parser.add_argument('--batch-size', type=int, default=1000, help="write_to_db bulk_write batch size")
+    parser.add_argument('--fixtures', default=os.getenv('UPSTREAM_FIXTURES_DIR', os.path.join(BACKEND_DIR, 'fixtures')))
+    parser.add_argument('--latency', default=DEFAULT_LATENCY, help="UPSTREAM_LATENCY_MS of the replaying server")
+    parser.add_argument('--server', default=None, help="measure this running server instead of starting one")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--requests', type=int, default=300, help="requests per concurrency level")
+    parser.add_argument('--warmup', type=int, default=20)
+    args = parser.parse_args()
+
+    commit, dirty = git_revision()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {'max_files': args.max_files, 'repeat': args.repeat, 'latency': args.latency,
+                   'concurrency': args.concurrency, 'requests': args.requests},
+        'metrics': {},
+        'skipped': {}
+    }
+    benches = {'ingest': bench_ingest, 'siri': bench_siri, 'write': bench_write, 'api': bench_api}
+    # Progress goes to stderr so stdout is only the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        for group in GROUPS:
+            if group not in args.only:
+                continue
+            results, skipped = benches[group](args)
+            report['metrics'].update(results)
+            if skipped:
+                report['skipped'][group] = skipped
+                print(f"{group}: skipped, {skipped}")
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        with contextlib.redirect_stdout(sys.stderr):
+            regressions = compare(baseline, report, args.threshold, args.api_threshold)
+            if regressions:
+                print(f"{len(regressions)} metrics regressed against {baseline.get('commit') or args.baseline}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
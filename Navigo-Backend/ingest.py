@@ -0,0 +1,291 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from ParseRoutePatterns import find_all_xml_files, parse_file, add_route_result, flatten_route_results
+from stops import merge_stops
+from Timetable import build_timetable, save_timetable, TIMETABLE_PATH
+
+
+def ingest_file(file_path):
+    """Parse one TransXChange file in a worker. Returns (file_path, route_result, stops, journeys, seconds)."""
+    start = time.perf_counter()
+    route_result, stops, journeys = parse_file(file_path)
+    return file_path, route_result, stops, journeys, time.perf_counter() - start
+
+
+def merge_results(results):
+    """
+    Merge per-file (file_path, route_result, stops, journeys) results, in the order given.
+
+    Returns:
+        tuple: (route_dict, all_stops, all_journeys) with routes keyed on (operator_ref, line_ref),
+               stops keyed on StopPointRef and journeys in file order
+    """
+    route_dict = defaultdict(list)
+    all_stops = {}
+    all_journeys = []
+    for file_path, route_result, stops, journeys in results:
+        add_route_result(route_dict, route_result)
+        if stops:
+            merge_stops(all_stops, stops)
+        if journeys:
+            all_journeys.extend(journeys)
+    return route_dict, all_stops, all_journeys
+
+
+def parse_files(xml_files, workers=None, chunksize=4):
+    """Parse files across a process pool, yielding (file_path, route_result, stops, journeys, seconds) in input order."""
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for file_path, route_result, stops, journeys, elapsed in executor.map(ingest_file, xml_files,
+                                                                              chunksize=chunksize):
+            print(f"Processed {file_path} in {elapsed * 1000:.1f} ms")
+            yield file_path, route_result, stops, journeys, elapsed
+
+
+def ingest_directory(directory, workers=None, chunksize=4):
+    """
+    Parse every TransXChange file under directory across a process pool and merge the results.
+
+    Files are parsed in parallel but merged in sorted path order, so the output does not
+    depend on the worker count or on which worker finishes first.
+
+    Args:
+        directory (str): Root of the TimeTables tree
+        workers (int): Number of worker processes, defaults to the number of CPUs
+        chunksize (int): Files handed to a worker at a time
+
+    Returns:
+        tuple: (route_results, all_stops, all_journeys, timings) where timings is a list of
+               (file_path, seconds) in merge order
+    """
+    xml_files = sorted(find_all_xml_files(directory))
+
+    results = []
+    timings = []
+    for file_path, route_result, stops, journeys, elapsed in parse_files(xml_files, workers, chunksize):
+        timings.append((file_path, elapsed))
+        results.append((file_path, route_result, stops, journeys))
+
+    route_dict, all_stops, all_journeys = merge_results(results)
+    return flatten_route_results(route_dict), list(all_stops.values()), all_journeys, timings
+
+
+def hash_file(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {'files': {}}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+# Bumped whenever the shape of a parse result changes, so cached results of older parsers are not reused
+CACHE_FORMAT = 5
+
+
+def _cache_path(cache_dir, sha256):
+    return os.path.join(cache_dir, f"{sha256}.v{CACHE_FORMAT}.json")
+
+
+def _load_cached(cache_dir, sha256):
+    try:
+        with open(_cache_path(cache_dir, sha256), 'r') as f:
+            cached = json.load(f)
+        return cached['route'], cached['stops'], cached['journeys']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+
+def diff_results(old_routes, new_routes, old_stops, new_stops):
+    """
+    Work out the database writes needed to move from one merged state to another.
+
+    A route document is rewritten when the records merged into its (operator_ref, line_ref)
+    key change, and removed when no file provides that key any more. Stops are upserted when
+    new or changed and removed when no file references them any more.
+    """
+    route_upserts = []
+    for key, records in new_routes.items():
+        if old_routes.get(key) != records:
+            route_upserts.extend(records)
+
+    route_deletes = []
+    for key, records in old_routes.items():
+        if key not in new_routes:
+            route_deletes.append({
+                'operator_ref': key[0],
+                'operator_name': records[-1]['operator_name'],
+                'line_ref': key[1]
+            })
+
+    stop_upserts = [stop for stop_ref, stop in new_stops.items() if old_stops.get(stop_ref) != stop]
+    stop_deletes = [stop_ref for stop_ref in old_stops if stop_ref not in new_stops]
+
+    return {
+        'routes': {'upsert': route_upserts, 'delete': route_deletes},
+        'stops': {'upsert': stop_upserts, 'delete': stop_deletes}
+    }
+
+
+def ingest_incremental(directory, manifest_path, cache_dir, workers=None, chunksize=4):
+    """
+    Re-ingest only the files that changed since the last run recorded in manifest_path.
+
+    A file is treated as unchanged when its size and mtime match the manifest, or when they
+    differ but its SHA-256 does not. Parse results are cached by content hash in cache_dir,
+    so unchanged files are merged from the cache instead of being parsed again.
+
+    Returns:
+        tuple: (route_results, all_stops, all_journeys, timings, changes) where changes is the
+               diff_results() between the previous run and this one. When the previous run's
+               results are not all cached, changes lists every route and stop and has
+               'full': True, so apply_changes deletes anything else in the database. The
+               timetable is not part of changes, it is rebuilt in full from the cached
+               journeys every run.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    old_manifest = load_manifest(manifest_path)
+    old_files = old_manifest['files']
+
+    xml_files = sorted(find_all_xml_files(directory))
+    new_files = {}
+    to_parse = []
+    for file_path in xml_files:
+        stat = os.stat(file_path)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        previous = old_files.get(file_path)
+        if previous and previous['size'] == entry['size'] and previous['mtime'] == entry['mtime']:
+            entry['sha256'] = previous['sha256']
+        else:
+            entry['sha256'] = hash_file(file_path)
+        new_files[file_path] = entry
+        if not os.path.exists(_cache_path(cache_dir, entry['sha256'])):
+            to_parse.append(file_path)
+
+    removed = [file_path for file_path in old_files if file_path not in new_files]
+    changed = [file_path for file_path in xml_files
+               if file_path not in old_files or old_files[file_path]['sha256'] != new_files[file_path]['sha256']]
+    print(f"{len(xml_files)} files: {len(changed)} new or changed, {len(removed)} removed, "
+          f"{len(to_parse)} to parse")
+
+    timings = []
+    for file_path, route_result, stops, journeys, elapsed in parse_files(to_parse, workers, chunksize):
+        timings.append((file_path, elapsed))
+        with open(_cache_path(cache_dir, new_files[file_path]['sha256']), 'w') as f:
+            json.dump({'route': route_result, 'stops': stops, 'journeys': journeys}, f)
+
+    loaded = {}
+
+    def cached_results(files, missing):
+        for file_path in sorted(files):
+            sha256 = files[file_path]['sha256']
+            if sha256 not in loaded:
+                loaded[sha256] = _load_cached(cache_dir, sha256)
+            if loaded[sha256] is not None:
+                yield (file_path,) + loaded[sha256]
+            else:
+                missing.append(file_path)
+
+    unknown = []
+    old_routes, old_stops, _ = merge_results(cached_results(old_files, unknown))
+    new_routes, new_stops, new_journeys = merge_results(cached_results(new_files, []))
+    if not old_files or unknown:
+        # What the previous run wrote cannot be worked out (no manifest, or the cached results of
+        # changed or removed files are gone after a CACHE_FORMAT bump or a cleaned cache directory),
+        # so write everything and let apply_changes remove whatever else the database holds
+        print(f"No previous results for {len(unknown) if old_files else 'any'} files, "
+              f"so the changes are a full rebuild")
+        changes = diff_results({}, new_routes, {}, new_stops)
+        changes['full'] = True
+    else:
+        changes = diff_results(old_routes, new_routes, old_stops, new_stops)
+
+    with open(manifest_path, 'w') as f:
+        json.dump({'files': new_files}, f, indent=2)
+
+    # Drop cached results no file refers to any more
+    live = {os.path.basename(_cache_path(cache_dir, entry['sha256'])) for entry in new_files.values()}
+    for cache_file in os.listdir(cache_dir):
+        if cache_file.endswith('.json') and cache_file not in live:
+            os.remove(os.path.join(cache_dir, cache_file))
+
+    return flatten_route_results(new_routes), list(new_stops.values()), new_journeys, timings, changes
+
+
+def print_timings(timings, wall_time, slowest=10):
+    total = sum(elapsed for _, elapsed in timings)
+    print(f"\nParsed {len(timings)} files in {wall_time:.2f}s wall time "
+          f"({total:.2f}s of parsing, {len(timings) / wall_time if wall_time else 0:.1f} files/s)")
+    print(f"Slowest {min(slowest, len(timings))} files:")
+    for file_path, elapsed in sorted(timings, key=lambda t: t[1], reverse=True)[:slowest]:
+        print(f"  {elapsed * 1000:8.1f} ms  {file_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse a TimeTables directory into route patterns and stops.")
+    parser.add_argument('directory', nargs='?', default='./TimeTables')
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--chunksize', type=int, default=4, help="files sent to a worker at a time")
+    parser.add_argument('--routes-output', default='route_patterns.json')
+    parser.add_argument('--stops-output', default='all_stops.json')
+    parser.add_argument('--timetable-output', default=TIMETABLE_PATH, help="departures index served by the API")
+    parser.add_argument('--timings-output', default=None, help="optional JSON file of per-file parse times")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only parse files that changed since the last run and write the database changes")
+    parser.add_argument('--manifest', default='ingest_manifest.json')
+    parser.add_argument('--cache-dir', default='.ingest_cache')
+    parser.add_argument('--changes-output', default='ingest_changes.json')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.directory):
+        print(f"Error: Directory not found - {args.directory}")
+        return
+
+    start = time.perf_counter()
+    if args.incremental:
+        route_results, all_stops, all_journeys, timings, changes = ingest_incremental(
+            args.directory, args.manifest, args.cache_dir, args.workers, args.chunksize)
+        with open(args.changes_output, 'w', encoding='utf-8') as f:
+            json.dump(changes, f, indent=2, ensure_ascii=False)
+        print(f"Changes{' (full rebuild)' if changes.get('full') else ''}: "
+              f"{len(changes['routes']['upsert'])} route records to upsert, "
+              f"{len(changes['routes']['delete'])} to delete, {len(changes['stops']['upsert'])} stops to upsert, "
+              f"{len(changes['stops']['delete'])} to delete. Saved to {args.changes_output}")
+    else:
+        route_results, all_stops, all_journeys, timings = ingest_directory(args.directory, args.workers,
+                                                                           args.chunksize)
+    wall_time = time.perf_counter() - start
+
+    with open(args.routes_output, 'w') as f:
+        json.dump(route_results, f, indent=2)
+
+    with open(args.stops_output, 'w', encoding='utf-8') as f:
+        json.dump(all_stops, f, indent=2, ensure_ascii=False)
+
+    timetable = build_timetable(all_journeys, all_stops)
+    save_timetable(timetable, args.timetable_output)
+
+    if args.timings_output:
+        with open(args.timings_output, 'w') as f:
+            json.dump([{'file_name': file_path, 'seconds': elapsed} for file_path, elapsed in timings], f, indent=2)
+
+    print_timings(timings, wall_time)
+    print(f"Wrote {len(route_results)} route records to {args.routes_output} "
+          f"and {len(all_stops)} unique stops to {args.stops_output}")
+    print(f"Wrote {len(timetable['journeys']['line'])} timetabled journeys at {len(timetable['stops'])} stops "
+          f"to {args.timetable_output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,101 +2,29 @@ import os
 import json
 import xml.etree.ElementTree as ET
 from collections import defaultdict
+from TransXChangeReader import read_transxchange
 
-def parse_stop_info(xml_file):
-    """Parse stop information from a TransXChange XML file"""
-    namespaces = {
-        'txc': 'http://www.transxchange.org.uk/',
-        'xsi': 'http://www.w3.org/2001/XMLSchema-instance'
-    }
-    
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-    
+def build_stop_info(document):
+    """Build the stop list for one file from a read_transxchange() document"""
     stops = []
     
     # First, create a mapping of StopPointRef to coordinates from RouteSections if they exist
     stop_coords = {}
-    for route_section in root.findall('.//txc:RouteSection', namespaces):
-        for route_link in route_section.findall('.//txc:RouteLink', namespaces):
-            # Get the From stop coordinates
-            from_ref = route_link.find('.//txc:From/txc:StopPointRef', namespaces)
-            if from_ref is not None:
-                location = route_link.find('.//txc:Location', namespaces)
-                if location is not None:
-                    translation = location.find('txc:Translation', namespaces)
-                    if translation is not None:
-                        longitude = translation.find('txc:Longitude', namespaces)
-                        latitude = translation.find('txc:Latitude', namespaces)
-                        if longitude is not None and latitude is not None:
-                            stop_coords[from_ref.text] = {
-                                'Longitude': longitude.text,
-                                'Latitude': latitude.text
-                            }
-            
-            # Get the To stop coordinates
-            to_ref = route_link.find('.//txc:To/txc:StopPointRef', namespaces)
-            if to_ref is not None:
-                location = route_link.find('.//txc:Location', namespaces)
-                if location is not None:
-                    translation = location.find('txc:Translation', namespaces)
-                    if translation is not None:
-                        longitude = translation.find('txc:Longitude', namespaces)
-                        latitude = translation.find('txc:Latitude', namespaces)
-                        if longitude is not None and latitude is not None:
-                            stop_coords[to_ref.text] = {
-                                'Longitude': longitude.text,
-                                'Latitude': latitude.text
-                            }
+    for route_link in document['route_links']:
+        if route_link['track']:
+            # A link's track starts at its From stop and ends at its To stop
+            for stop_ref, (longitude, latitude) in ((route_link['from'], route_link['track'][0]),
+                                                    (route_link['to'], route_link['track'][-1])):
+                if stop_ref is not None and stop_ref not in stop_coords:
+                    stop_coords[stop_ref] = {
+                        'Longitude': longitude,
+                        'Latitude': latitude
+                    }
     
-    # Find all AnnotatedStopPointRef elements
-    for stop_point in root.findall('.//txc:AnnotatedStopPointRef', namespaces):
-        stop_info = {
-            'StopPointRef': None,
-            'CommonName': None,
-            'Indicator': None,
-            'LocalityName': None,
-            'Longitude': None,
-            'Latitude': None
-        }
-        
-        # Get basic stop info
-        stop_point_ref = stop_point.find('txc:StopPointRef', namespaces)
-        if stop_point_ref is not None:
-            stop_info['StopPointRef'] = stop_point_ref.text
-            
-        common_name = stop_point.find('txc:CommonName', namespaces)
-        if common_name is not None:
-            stop_info['CommonName'] = common_name.text
-            
-        indicator = stop_point.find('txc:Indicator', namespaces)
-        if indicator is not None:
-            stop_info['Indicator'] = indicator.text
-            
-        locality_name = stop_point.find('txc:LocalityName', namespaces)
-        if locality_name is not None:
-            stop_info['LocalityName'] = locality_name.text
-            
-        # First try to get location from the stop point itself
-        location = stop_point.find('txc:Location', namespaces)
-        if location is not None:
-            # First format: Direct longitude/latitude
-            longitude = location.find('txc:Longitude', namespaces)
-            latitude = location.find('txc:Latitude', namespaces)
-            if longitude is not None and latitude is not None:
-                stop_info['Longitude'] = longitude.text
-                stop_info['Latitude'] = latitude.text
-            else:
-                # Second format: Translation element
-                translation = location.find('txc:Translation', namespaces)
-                if translation is not None:
-                    longitude = translation.find('txc:Longitude', namespaces)
-                    latitude = translation.find('txc:Latitude', namespaces)
-                    if longitude is not None and latitude is not None:
-                        stop_info['Longitude'] = longitude.text
-                        stop_info['Latitude'] = latitude.text
+    for stop_point in document['stop_points']:
+        stop_info = dict(stop_point)
         
-        # If we still don't have coordinates, check if they're in the RouteSections mapping
+        # If we don't have coordinates on the stop point itself, check if they're in the RouteSections mapping
         if stop_info['StopPointRef'] and (stop_info['Longitude'] is None or stop_info['Latitude'] is None):
             if stop_info['StopPointRef'] in stop_coords:
                 stop_info['Longitude'] = stop_coords[stop_info['StopPointRef']]['Longitude']
@@ -108,6 +36,22 @@ def parse_stop_info(xml_file):
             
     return stops
 
+def parse_stop_info(xml_file):
+    """Parse stop information from a TransXChange XML file"""
+    return build_stop_info(read_transxchange(xml_file))
+
+def merge_stops(all_stops, stops):
+    """Merge one file's stops into all_stops, keyed on StopPointRef"""
+    for stop in stops:
+        # Use StopPointRef as key to avoid duplicates
+        stop_id = stop['StopPointRef']
+        # Only add if we don't have it already or if we have more complete info
+        existing_stop = all_stops.get(stop_id)
+        if (not existing_stop or 
+            (existing_stop['Longitude'] is None and stop['Longitude'] is not None) or
+            (existing_stop['Latitude'] is None and stop['Latitude'] is not None)):
+            all_stops[stop_id] = stop
+
 def process_directory(root_dir):
     all_stops = defaultdict(dict)
     
@@ -118,16 +62,7 @@ def process_directory(root_dir):
                 xml_path = os.path.join(dirpath, filename)
                 print(f"Processing {xml_path}")
                 try:
-                    stops = parse_stop_info(xml_path)
-                    for stop in stops:
-                        # Use StopPointRef as key to avoid duplicates
-                        stop_id = stop['StopPointRef']
-                        # Only add if we don't have it already or if we have more complete info
-                        existing_stop = all_stops.get(stop_id)
-                        if (not existing_stop or 
-                            (existing_stop['Longitude'] is None and stop['Longitude'] is not None) or
-                            (existing_stop['Latitude'] is None and stop['Latitude'] is not None)):
-                            all_stops[stop_id] = stop
+                    merge_stops(all_stops, parse_stop_info(xml_path))
                 except ET.ParseError as e:
                     print(f"Error parsing {xml_path}: {e}")
                 except Exception as e:
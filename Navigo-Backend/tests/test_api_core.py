@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from ApiCore import nearby_stops
+from StopRegistry import stop_registry
+
+STOPS = [
+    {'StopPointRef': 'S1', 'CommonName': 'Market Place', 'Latitude': '52.9200', 'Longitude': '-1.4780'},
+    {'StopPointRef': 'S2', 'CommonName': 'Corn Market', 'Latitude': '52.9210', 'Longitude': '-1.4780'},
+    {'StopPointRef': 'S3', 'CommonName': 'Bus Station', 'Latitude': '52.9340', 'Longitude': '-1.4960'},
+]
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """The shared stop registry, loaded with STOPS for one test"""
+    path = tmp_path / 'all_stops.json'
+    path.write_text(json.dumps(STOPS))
+    monkeypatch.setattr(stop_registry, '_table', None)
+    monkeypatch.setattr(stop_registry, 'source', None)
+    stop_registry.load_snapshot(str(path))
+    return stop_registry
+
+
+def test_nearby_stops(registry):
+    body, status_code = nearby_stops({'lat': '52.92', 'lng': '-1.478', 'radius': '200'})
+    assert status_code == 200
+    assert [(stop['StopPointRef'], stop['distance_m']) for stop in body['data']] == [('S1', 0.0), ('S2', 111.2)]
+
+    body, status_code = nearby_stops({'lat': '52.92', 'lng': '-1.478', 'limit': '1'})
+    assert [stop['StopPointRef'] for stop in body['data']] == ['S1']
+
+
+@pytest.mark.parametrize('args', [
+    {'lng': '-1.478'},
+    {'lat': 'north', 'lng': '-1.478'},
+    {'lat': '91', 'lng': '-1.478'},
+    {'lat': 'nan', 'lng': '-1.478'},
+    {'lat': '52.92', 'lng': '-1.478', 'radius': '0'},
+    {'lat': '52.92', 'lng': '-1.478', 'limit': '0'},
+])
+def test_nearby_stops_rejects_bad_arguments(registry, args):
+    body, status_code = nearby_stops(args)
+    assert status_code == 400 and body['status'] == 'error'
+
+
+def test_nearby_stops_needs_the_registry(monkeypatch):
+    monkeypatch.setattr(stop_registry, '_table', None)
+    assert nearby_stops({'lat': '52.92', 'lng': '-1.478'})[1] == 503
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('quart', reason='AsyncFrontendApi needs quart')
+
+import AsyncFrontendApi
+from AsyncFrontendApi import app
+from StopRegistry import stop_registry
+from VehiclePoller import vehicle_poller
+
+
+@pytest.fixture
+def client():
+    # The test client does not run the before_serving startup, so no Mongo, Google or BODS is needed
+    return app.test_client()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_nearby_stops_route(client, monkeypatch):
+    monkeypatch.setattr(stop_registry, '_table', None)
+
+    async def requests():
+        bad = await client.get('/api/stops/nearby', query_string={'lat': '91', 'lng': '0'})
+        unloaded = await client.get('/api/stops/nearby', query_string={'lat': '52.92', 'lng': '-1.478'})
+        return bad.status_code, unloaded.status_code
+
+    assert run(requests()) == (400, 503)
+
+
+def test_vehicle_locations_answer_502_on_a_bods_timeout(client, monkeypatch):
+    # Without the poller the route fetches from BODS on demand
+    assert not vehicle_poller.running
+
+    async def timed_out(*args, **kwargs):
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(AsyncFrontendApi.datafeed_flight, 'do', timed_out)
+
+    async def request():
+        response = await client.get('/api/getVehicleLocations', query_string={'lineRef': '1', 'operatorRef': 'TBTN'})
+        return response.status_code, await response.get_json()
+
+    status_code, body = run(request())
+    assert status_code == 502 and body['status'] == 'error'
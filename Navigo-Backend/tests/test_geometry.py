@@ -0,0 +1,106 @@
+import math
+
+import pytest
+
+from Geometry import (build_shape, cumulative_distances, cut_shape, decode_polyline, encode_polyline, haversine,
+                      simplify)
+
+
+def test_encode_polyline_matches_googles_example():
+    # The worked example of Google's encoded polyline format documentation
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert encode_polyline(points) == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+    assert decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@') == points
+
+
+@pytest.mark.parametrize('precision', [5, 6])
+def test_polyline_round_trip(precision):
+    points = [(52.92, -1.478), (52.92001, -1.47801), (52.934, -1.496), (-33.8688, 151.2093), (0.0, 0.0)]
+    decoded = decode_polyline(encode_polyline(points, precision), precision)
+    assert len(decoded) == len(points)
+    for (lat, lng), (decoded_lat, decoded_lng) in zip(points, decoded):
+        assert decoded_lat == pytest.approx(lat, abs=10 ** -precision)
+        assert decoded_lng == pytest.approx(lng, abs=10 ** -precision)
+
+
+def test_empty_polyline():
+    assert encode_polyline([]) == ''
+    assert decode_polyline('') == []
+
+
+def test_simplify_keeps_ends_and_drops_collinear_points():
+    line = [(52.9, -1.5 + i * 0.001) for i in range(10)]
+    assert simplify(line, tolerance_m=1) == [0, 9]
+    assert simplify(line[:2]) == [0, 1]
+    assert simplify([]) == []
+
+
+def test_simplify_keeps_corners():
+    # An L shape of about 700 m a side; the corner is far from the line between the ends
+    path = [(52.9, -1.5), (52.9, -1.495), (52.9, -1.49), (52.9063, -1.49), (52.9126, -1.49)]
+    assert simplify(path, tolerance_m=5) == [0, 2, 4]
+
+
+def test_simplify_keeps_points_past_the_ends():
+    # A route that runs past its last stop and doubles back; every point is on the line
+    # between the ends, but not on the segment
+    path = [(52.9, -1.5), (52.9, -1.48), (52.9, -1.49)]
+    assert simplify(path, tolerance_m=5) == [0, 1, 2]
+
+
+def distance_to_path(point, path):
+    """Metres from a point to the nearest of 100 samples along each segment of a path"""
+    return min(haversine(*point, start[0] + t / 100 * (end[0] - start[0]), start[1] + t / 100 * (end[1] - start[1]))
+               for start, end in zip(path, path[1:]) for t in range(101))
+
+
+def test_simplified_path_stays_within_tolerance():
+    path = [(52.9 + 0.0005 * math.sin(i / 3), -1.5 + i * 0.0004) for i in range(200)]
+    kept = simplify(path, tolerance_m=10)
+    assert kept[0] == 0 and kept[-1] == len(path) - 1
+    assert len(kept) < len(path) / 2
+    simplified = [path[i] for i in kept]
+    # A little over the tolerance for the flat projection and the sampling
+    assert max(distance_to_path(point, simplified) for point in path) < 11
+
+
+def test_cumulative_distances():
+    path = [(52.9, -1.5), (52.9, -1.49), (52.91, -1.49)]
+    distances = cumulative_distances(path)
+    assert distances[0] == 0
+    assert distances[1] == pytest.approx(haversine(*path[0], *path[1]))
+    assert distances[2] == pytest.approx(distances[1] + haversine(*path[1], *path[2]))
+
+
+def test_build_shape():
+    path = [(52.9, -1.5), (52.9, -1.5), (52.9, -1.495), (52.9, -1.49), (52.91, -1.49)]
+    shape = build_shape(path, tolerance_m=5)
+    # The repeated first point and the straight middle point are dropped
+    assert decode_polyline(shape['polyline']) == [(52.9, -1.5), (52.9, -1.49), (52.91, -1.49)]
+    assert shape['distances'][0] == 0
+    assert shape['distances'][-1] == round(float(cumulative_distances(path[1:])[-1]))
+    assert build_shape([(52.9, -1.5), (52.9, -1.5)]) is None
+
+
+def test_build_shape_stop_distances():
+    path = [(52.9, -1.5), (52.9, -1.5), (52.9, -1.495), (52.9, -1.49), (52.91, -1.49)]
+    distances = cumulative_distances(path[1:])
+    # The first stop sits on the repeated point, and the third stop's place is unknown
+    shape = build_shape(path, tolerance_m=5, stop_indexes=[1, 3, None, 4])
+    assert shape['stop_distances'] == [0, round(float(distances[2])), None, round(float(distances[3]))]
+    assert 'stop_distances' not in build_shape(path)
+
+
+def test_cut_shape():
+    path = [(52.9, -1.5), (52.9, -1.49), (52.91, -1.49)]
+    shape = build_shape(path, tolerance_m=5)
+    corner = shape['distances'][1]
+    cut = cut_shape(shape, 100, corner + 200)
+    points = decode_polyline(cut['polyline'])
+    assert len(points) == 3 and points[1] == path[1]
+    assert haversine(*path[0], *points[0]) == pytest.approx(100, abs=2)
+    assert haversine(*path[1], *points[2]) == pytest.approx(200, abs=2)
+    assert cut['distances'] == [0, corner - 100, corner + 100]
+    assert cut_shape(shape, 200, 100) is None
+    assert cut_shape(shape, None, 100) is None
+    assert cut_shape(None, 0, 100) is None
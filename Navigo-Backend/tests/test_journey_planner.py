@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import pytest
+
+from JourneyPlanner import JourneyPlanner, parse_location
+from Timetable import DAY_SECONDS, Timetable, build_timetable, calendar, save_timetable
+
+# About 2 km apart, so neither is in walking distance of the other
+STOPS = [
+    {'StopPointRef': 'S1', 'CommonName': 'Market Place', 'Latitude': '52.9200', 'Longitude': '-1.4780'},
+    {'StopPointRef': 'S2', 'CommonName': 'Bus Station', 'Latitude': '52.9340', 'Longitude': '-1.4960'},
+]
+ORIGIN = (52.92, -1.478)
+DESTINATION = (52.934, -1.496)
+
+
+def journey(line_ref, departure, days_of_week):
+    return {
+        'operator_ref': 'TBTN',
+        'line_ref': line_ref,
+        'direction': 'outbound',
+        'calendar': calendar({'days_of_week': days_of_week}, '2025-01-01', '2025-12-31'),
+        'stop_refs': ['S1', 'S2'],
+        'arrivals': [departure, departure + 900],
+        'departures': [departure, departure + 900]
+    }
+
+
+@pytest.fixture(scope='module')
+def planner(tmp_path_factory):
+    path = tmp_path_factory.mktemp('timetable') / 'timetable.pkl'
+    journeys = [
+        # A night bus of the weekday service days, leaving at 00:30 the next morning
+        journey('N1', DAY_SECONDS + 30 * 60, ['MondayToFriday']),
+        journey('1', 6 * 3600, ['MondayToSaturday']),
+        journey('1', 21 * 3600, ['MondayToSaturday']),
+    ]
+    save_timetable(build_timetable(journeys, STOPS), str(path))
+    return JourneyPlanner().build(Timetable().load(str(path)))
+
+
+def rides(planner, at):
+    steps = planner.plan(ORIGIN, DESTINATION, datetime.fromisoformat(at))
+    return [(step['line_short_name'], step['departure_time'], step['arrival_time'])
+            for step in steps if step['type'] == 'transit']
+
+
+def test_plan_on_the_day(planner):
+    assert rides(planner, '2025-05-19T05:00') == [('1', '06:00', '06:15')]
+    assert rides(planner, '2025-05-19T20:00') == [('1', '21:00', '21:15')]
+
+
+def test_plan_with_the_previous_days_journey_after_midnight(planner):
+    # Tuesday 00:10: Monday's night bus has not left yet
+    assert rides(planner, '2025-05-20T00:10') == [('N1', '00:30', '00:45')]
+    # Sunday 00:10: Saturday runs no night bus, and Sunday no day buses, so Monday's first bus
+    assert rides(planner, '2025-05-18T00:10') == [('1', '06:00', '06:15')]
+
+
+def test_plan_with_the_next_days_journeys(planner):
+    # Monday 22:00: the day buses have finished, so Monday's night bus after midnight
+    assert rides(planner, '2025-05-19T22:00') == [('N1', '00:30', '00:45')]
+    # Friday 22:00 likewise; the night bus is Friday's, running into Saturday
+    assert rides(planner, '2025-05-23T22:00') == [('N1', '00:30', '00:45')]
+    # Saturday 22:00: there is no night bus, and nothing runs on Sunday, the furthest a search looks
+    assert rides(planner, '2025-05-24T22:00') == []
+
+
+@pytest.mark.parametrize('text, location', [
+    ('52.92,-1.478', (52.92, -1.478)),
+    (' 52.92 , -1.478 ', (52.92, -1.478)),
+    ('91,0', None),
+    ('52.92', None),
+    (None, None),
+])
+def test_parse_location(text, location):
+    assert parse_location(text) == location
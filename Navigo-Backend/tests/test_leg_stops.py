@@ -0,0 +1,146 @@
+import pytest
+
+from ApiCore import pick_line
+from Geometry import build_shape, decode_polyline, haversine
+from LegStops import build_stop_index, match_leg, normalize_stop_name, slice_pattern
+
+# Five stops about 340 m apart along a street
+STOPS = {
+    f'S{i}': {'StopPointRef': f'S{i}', 'CommonName': name, 'LocalityName': 'Derby',
+              'Latitude': '52.9200', 'Longitude': f'{-1.5 + i * 0.005:.4f}'}
+    for i, name in enumerate(['Market Place', 'Corn Market', 'Bus Station', 'Hospital', 'Park Road'])
+}
+
+
+def pattern(direction, stop_refs, ref=None):
+    return {'journey_pattern_ref': ref or f'JP-{direction}', 'direction': direction,
+            'stop_refs': stop_refs, 'sequences': list(range(1, len(stop_refs) + 1))}
+
+
+OUTBOUND = pattern('outbound', ['S0', 'S1', 'S2', 'S3', 'S4'])
+INBOUND = pattern('inbound', ['S4', 'S3', 'S2', 'S1', 'S0'])
+
+
+def location(stop_ref, north_m=0):
+    stop = STOPS[stop_ref]
+    return {'lat': float(stop['Latitude']) + north_m / 111_195, 'lng': float(stop['Longitude'])}
+
+
+def leg(board, alight, num_stops=None, **extra):
+    leg = {
+        'departure_stop': STOPS[board]['CommonName'],
+        'arrival_stop': STOPS[alight]['CommonName'],
+        'start_location': location(board),
+        'end_location': location(alight),
+        'num_stops': num_stops
+    }
+    leg.update(extra)
+    return leg
+
+
+@pytest.fixture
+def index():
+    return build_stop_index([OUTBOUND, INBOUND], STOPS)
+
+
+@pytest.mark.parametrize('name, normalized', [
+    ('Derby Bus Station (Stand B3)', 'derbybusstation'),
+    ('Corn Market [Stop CM2]', 'cornmarket'),
+    ('Bath St & Park Rd', 'bathstandparkrd'),
+    (None, ''),
+])
+def test_normalize_stop_name(name, normalized):
+    assert normalize_stop_name(name) == normalized
+
+
+def test_match_leg_picks_the_direction_travelled(index):
+    assert match_leg(index, leg('S1', 'S3', num_stops=2)) == (0, 1, 3)
+    assert match_leg(index, leg('S3', 'S1', num_stops=2)) == (1, 1, 3)
+
+
+def test_match_leg_by_locality_name_or_location_alone(index):
+    assert match_leg(index, leg('S0', 'S2', departure_stop='Derby Market Place')) == (0, 0, 2)
+    # Google's name for the stop is unknown, but it is 30 m from S2
+    assert match_leg(index, leg('S0', 'S2', arrival_stop='Stand B3', end_location=location('S2', 30))) == (0, 0, 2)
+
+
+def test_match_leg_prefers_stop_refs(index):
+    # The names and locations point at S1, but the leg names its stops
+    matched = match_leg(index, leg('S1', 'S3', departure_stop_ref='S0', arrival_stop_ref='S4'))
+    assert matched == (0, 0, 4)
+
+
+def test_match_leg_uses_num_stops_on_a_loop():
+    loop = pattern('outbound', ['S0', 'S1', 'S2', 'S3', 'S1', 'S4'])
+    index = build_stop_index([loop], STOPS)
+    assert match_leg(index, leg('S0', 'S1', num_stops=1)) == (0, 0, 1)
+    assert match_leg(index, leg('S0', 'S1', num_stops=4)) == (0, 0, 4)
+
+
+def test_match_leg_without_a_fit(index):
+    far = location('S4', 5000)
+    assert match_leg(index, leg('S0', 'S4', arrival_stop='Airport', end_location=far)) is None
+    assert match_leg(build_stop_index([], STOPS), leg('S0', 'S4')) is None
+    assert match_leg(None, leg('S0', 'S4')) is None
+
+
+def test_slice_pattern(index):
+    leg_pattern, stops = slice_pattern(OUTBOUND, 1, 3, STOPS)
+    assert leg_pattern['stop_refs'] == ['S1', 'S2', 'S3']
+    assert leg_pattern['sequences'] == [2, 3, 4]
+    assert [(stop['StopPointRef'], stop['sequence']) for stop in stops] == [('S1', 2), ('S2', 3), ('S3', 4)]
+    assert 'sequence' not in STOPS['S1']
+
+
+def test_slice_pattern_cuts_the_shape_to_the_leg():
+    # The path runs from S0 to S4 by way of a point 300 m north of S1
+    points = [(point['lat'], point['lng']) for point in
+              (location('S0'), location('S1'), location('S1', 300), location('S2'), location('S3'), location('S4'))]
+    shape = build_shape(points, stop_indexes=[0, 1, 3, 4, 5])
+    shaped = dict(OUTBOUND, shape=shape)
+
+    leg_pattern, _ = slice_pattern(shaped, 1, 3, STOPS)
+    leg_shape = leg_pattern['shape']
+    path = decode_polyline(leg_shape['polyline'])
+    # It starts at the boarding stop, keeps the detour, and ends at the alighting stop
+    assert haversine(*path[0], *points[1]) < 2
+    assert any(haversine(*point, *points[2]) < 2 for point in path)
+    assert haversine(*path[-1], *points[4]) < 2
+    assert not any(haversine(*point, *points[0]) < 2 or haversine(*point, *points[5]) < 2 for point in path)
+    # Distances are measured from the boarding stop
+    board, middle, alight = shape['stop_distances'][1:4]
+    assert leg_shape['stop_distances'] == [0, middle - board, alight - board]
+    assert leg_shape['distances'][0] == 0 and leg_shape['distances'][-1] == alight - board
+    assert shaped['shape'] is shape and shape['stop_distances'][0] == 0
+
+
+def test_slice_pattern_drops_a_shape_it_cannot_cut():
+    points = [(point['lat'], point['lng']) for point in (location('S0'), location('S4'))]
+    shaped = dict(OUTBOUND, shape=build_shape(points))
+    leg_pattern, _ = slice_pattern(shaped, 1, 3, STOPS)
+    assert 'shape' not in leg_pattern
+
+
+def entry(operator_ref, patterns, stops):
+    return {'operator_ref': operator_ref, 'stop_index': build_stop_index(patterns, stops)}
+
+
+def test_pick_line_chooses_the_candidate_the_leg_rides():
+    # Two operators' line 8, sharing only the stops at the ends of the leg
+    other_stops = dict(STOPS, X1={'StopPointRef': 'X1', 'CommonName': 'Ring Road', 'Latitude': '52.9300',
+                                  'Longitude': '-1.4900'})
+    shared = entry('ADER', [pattern('outbound', ['S0', 'X1', 'S4'])], other_stops)
+    riding = entry('AMID', [OUTBOUND], STOPS)
+
+    picked, matched = pick_line([shared, riding], leg('S0', 'S4', num_stops=4))
+    assert picked is riding and matched == (0, 0, 4)
+
+    picked, matched = pick_line([shared, riding], leg('S0', 'S4', num_stops=2))
+    assert picked is shared and matched == (0, 0, 2)
+
+
+def test_pick_line_falls_back_to_the_first_candidate():
+    first = entry('ADER', [OUTBOUND], STOPS)
+    second = entry('AMID', [INBOUND], STOPS)
+    far = location('S4', 5000)
+    assert pick_line([first, second], leg('S0', 'S4', arrival_stop='Airport', end_location=far)) == (first, None)
@@ -0,0 +1,42 @@
+from SiriVmParser import activity_to_dict, parse_vehicle_activities
+
+PAYLOAD = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Siri xmlns="http://www.siri.org.uk/siri" version="2.0">
+<ServiceDelivery><VehicleMonitoringDelivery>
+<VehicleActivity>
+<RecordedAtTime>2024-05-01T12:00:05Z</RecordedAtTime>
+<ItemIdentifier>item-1</ItemIdentifier>
+<ValidUntilTime>2024-05-01T12:05:05.5+01:00</ValidUntilTime>
+<MonitoredVehicleJourney>
+<LineRef>1</LineRef>
+<OperatorRef>TBTN</OperatorRef>
+<OriginAimedDepartureTime>2024-05-01T11:50:00+00:00</OriginAimedDepartureTime>
+<DestinationAimedArrivalTime>2024-05-01T12:45:00</DestinationAimedArrivalTime>
+<VehicleLocation><Longitude>-1.1478</Longitude><Latitude>52.9536</Latitude></VehicleLocation>
+<Bearing>bad</Bearing>
+</MonitoredVehicleJourney>
+</VehicleActivity>
+</VehicleMonitoringDelivery></ServiceDelivery>
+</Siri>
+"""
+
+
+def test_parse_vehicle_activities():
+    [activity] = parse_vehicle_activities(PAYLOAD)
+    assert (activity.line_ref, activity.operator_ref) == ('1', 'TBTN')
+    assert (activity.latitude, activity.longitude) == (52.9536, -1.1478)
+    # A malformed field is None, not an error
+    assert activity.bearing is None
+    assert parse_vehicle_activities(b'<Siri') is None
+
+
+def test_activity_to_dict_keeps_the_feeds_time_format():
+    [activity] = parse_vehicle_activities(PAYLOAD)
+    result = activity_to_dict(activity)
+    journey = result['MonitoredVehicleJourney']
+    # UTC times keep the Z suffix the payload has always had
+    assert result['RecordedAtTime'] == '2024-05-01T12:00:05Z'
+    assert journey['OriginAimedDepartureTime'] == '2024-05-01T11:50:00Z'
+    assert result['ValidUntilTime'] == '2024-05-01T12:05:05.500000+01:00'
+    assert journey['DestinationAimedArrivalTime'] == '2024-05-01T12:45:00'
+    assert journey['VehicleLocation'] == {'Longitude': -1.1478, 'Latitude': 52.9536}
@@ -0,0 +1,59 @@
+import io
+
+from stops import build_stop_info
+from TransXChangeReader import read_transxchange
+
+
+def transxchange(stop_points, route_links):
+    return io.BytesIO(f"""<?xml version="1.0" encoding="UTF-8"?>
+<TransXChange xmlns="http://www.transxchange.org.uk/">
+<StopPoints>{stop_points}</StopPoints>
+<RouteSections><RouteSection id="RS1">{route_links}</RouteSection></RouteSections>
+</TransXChange>""".encode())
+
+
+def stop_point(stop_ref, name, location=''):
+    return f'<AnnotatedStopPointRef><StopPointRef>{stop_ref}</StopPointRef><CommonName>{name}</CommonName>' \
+           f'{location}</AnnotatedStopPointRef>'
+
+
+def route_link(link_id, from_ref, to_ref, *locations):
+    track = ''.join(locations)
+    return f'<RouteLink id="{link_id}"><From><StopPointRef>{from_ref}</StopPointRef></From>' \
+           f'<To><StopPointRef>{to_ref}</StopPointRef></To><Track><Mapping>{track}</Mapping></Track></RouteLink>'
+
+
+def direct(lng, lat):
+    return f'<Location><Longitude>{lng}</Longitude><Latitude>{lat}</Latitude></Location>'
+
+
+def translation(lng, lat):
+    return f'<Location><Translation><Longitude>{lng}</Longitude><Latitude>{lat}</Latitude></Translation></Location>'
+
+
+def coordinates(source):
+    return {stop['StopPointRef']: (stop['Longitude'], stop['Latitude'])
+            for stop in build_stop_info(read_transxchange(source))}
+
+
+def test_stops_take_route_link_track_ends():
+    source = transxchange(
+        stop_point('A', 'Market Place') + stop_point('B', 'Corn Market') + stop_point('C', 'Bus Station'),
+        # The From stop takes the track's first point and the To stop its last; both location forms are read
+        route_link('RL1', 'A', 'B', translation('-1.50', '52.90'), direct('-1.49', '52.90'), direct('-1.48', '52.91')) +
+        # B was placed by RL1, and keeps that location
+        route_link('RL2', 'B', 'C', direct('-1.47', '52.92'), translation('-1.46', '52.93'))
+    )
+    assert coordinates(source) == {
+        'A': ('-1.50', '52.90'),
+        'B': ('-1.48', '52.91'),
+        'C': ('-1.46', '52.93'),
+    }
+
+
+def test_stop_point_location_wins_over_route_links():
+    source = transxchange(
+        stop_point('A', 'Market Place', direct('-1.40', '52.80')) + stop_point('B', 'Corn Market'),
+        route_link('RL1', 'A', 'B', direct('-1.50', '52.90'), direct('-1.48', '52.91'))
+    )
+    assert coordinates(source) == {'A': ('-1.40', '52.80'), 'B': ('-1.48', '52.91')}
@@ -0,0 +1,170 @@
+from datetime import date, datetime, timezone
+
+import pytest
+
+from Timetable import (Timetable, bank_holidays, build_journeys, build_timetable, calendar, runs_on, save_timetable,
+                       _easter, DAY_SECONDS)
+
+STOPS = [
+    {'StopPointRef': 'S1', 'CommonName': 'Market Place', 'Latitude': '52.9200', 'Longitude': '-1.4780'},
+    {'StopPointRef': 'S2', 'CommonName': 'Bus Station', 'Latitude': '52.9340', 'Longitude': '-1.4960'},
+]
+
+
+def clock(hours, minutes=0):
+    return hours * 3600 + minutes * 60
+
+
+def journey(departure, profile=None, line_ref='1'):
+    """A two-stop journey leaving S1 at departure seconds, 20 minutes to S2"""
+    return {
+        'operator_ref': 'TBTN',
+        'line_ref': line_ref,
+        'direction': 'outbound',
+        'calendar': calendar(profile, '2025-01-01', '2025-12-31'),
+        'stop_refs': ['S1', 'S2'],
+        'arrivals': [departure, departure + 1200],
+        'departures': [departure, departure + 1200]
+    }
+
+
+@pytest.fixture
+def make_timetable(tmp_path):
+    def make(journeys):
+        path = tmp_path / 'timetable.pkl'
+        save_timetable(build_timetable(journeys, STOPS), str(path))
+        return Timetable().load(str(path))
+    return make
+
+
+@pytest.mark.parametrize('year, easter', [
+    (2019, date(2019, 4, 21)),
+    (2024, date(2024, 3, 31)),
+    (2025, date(2025, 4, 20)),
+    (2038, date(2038, 4, 25)),
+])
+def test_easter(year, easter):
+    assert _easter(year) == easter
+
+
+def test_bank_holidays_2025():
+    holidays = bank_holidays(2025)
+    assert holidays[date(2025, 4, 18)] == {'GoodFriday'}
+    assert holidays[date(2025, 4, 21)] == {'EasterMonday'}
+    assert holidays[date(2025, 5, 5)] == {'MayDay'}
+    assert holidays[date(2025, 5, 26)] == {'SpringBank'}
+    assert holidays[date(2025, 8, 25)] == {'LateSummerBankHolidayNotScotland'}
+    # Christmas and New Year fall on weekdays, so there are no substitute days
+    assert not any(name.endswith('Holiday') for names in holidays.values() for name in names)
+
+
+def test_substitute_holidays_when_christmas_is_at_a_weekend():
+    # Christmas Day on a Saturday and Boxing Day on a Sunday move to Monday and Tuesday
+    holidays = bank_holidays(2021)
+    assert holidays[date(2021, 12, 27)] == {'ChristmasDayHoliday'}
+    assert holidays[date(2021, 12, 28)] == {'BoxingDayHoliday'}
+
+
+def test_substitute_holiday_skips_boxing_day():
+    # Christmas Day on a Sunday moves past Boxing Day on the Monday
+    holidays = bank_holidays(2022)
+    assert holidays[date(2022, 12, 27)] == {'ChristmasDayHoliday'}
+    assert 'BoxingDayHoliday' not in {name for names in holidays.values() for name in names}
+    assert holidays[date(2022, 1, 3)] == {'NewYearsDayHoliday'}
+
+
+def test_runs_on_days_of_week_and_operating_period():
+    weekdays = calendar({'days_of_week': ['MondayToFriday']}, '2025-03-01', '2025-06-30')
+    assert runs_on(weekdays, date(2025, 5, 19))  # Monday
+    assert not runs_on(weekdays, date(2025, 5, 17))  # Saturday
+    assert not runs_on(weekdays, date(2025, 2, 28))  # Friday before the service starts
+    assert not runs_on(weekdays, date(2025, 7, 1))  # Tuesday after it ends
+
+
+def test_runs_on_bank_holidays():
+    weekdays = calendar({'days_of_week': ['MondayToFriday'], 'holidays_off': ['AllBankHolidays']},
+                        '2025-01-01', '2025-12-31')
+    assert not runs_on(weekdays, date(2025, 5, 26))  # SpringBank Monday
+    assert runs_on(weekdays, date(2025, 5, 27))
+
+    sundays = calendar({'days_of_week': ['Sunday'], 'holidays_on': ['HolidayMondays']}, '2025-01-01', '2025-12-31')
+    assert runs_on(sundays, date(2025, 5, 26))
+    assert runs_on(sundays, date(2025, 4, 21))  # EasterMonday
+    assert not runs_on(sundays, date(2025, 4, 18))  # GoodFriday is not a holiday Monday
+
+    holidays_only = calendar({'holidays_only': True, 'holidays_on': ['Christmas']}, '2025-01-01', '2025-12-31')
+    assert runs_on(holidays_only, date(2025, 12, 26))
+    assert not runs_on(holidays_only, date(2025, 12, 24))
+
+
+def test_days_of_non_operation_take_precedence():
+    # A bank holiday named both ways does not run
+    both = calendar({'days_of_week': ['Sunday'], 'holidays_on': ['EasterMonday'], 'holidays_off': ['HolidayMondays']},
+                    '2025-01-01', '2025-12-31')
+    assert not runs_on(both, date(2025, 4, 21))
+
+    # Dates of non-operation win over dates and bank holidays of operation, and over the weekday
+    profile = {
+        'days_of_week': ['MondayToFriday'],
+        'holidays_on': ['SpringBank'],
+        'dates_on': [('2025-05-24', '2025-05-26')],
+        'dates_off': [('2025-05-20', '2025-05-20'), ('2025-05-25', '2025-05-26')]
+    }
+    entry = calendar(profile, '2025-01-01', '2025-12-31')
+    assert runs_on(entry, date(2025, 5, 19))
+    assert not runs_on(entry, date(2025, 5, 20))
+    assert runs_on(entry, date(2025, 5, 24))  # Saturday, only by its date of operation
+    assert not runs_on(entry, date(2025, 5, 25))
+    assert not runs_on(entry, date(2025, 5, 26))
+
+
+def test_departures_include_previous_days_journeys_after_midnight(make_timetable):
+    weekdays = {'days_of_week': ['MondayToFriday']}
+    timetable = make_timetable([
+        journey(DAY_SECONDS + clock(0, 20), weekdays, line_ref='N1'),
+        journey(clock(6), weekdays),
+    ])
+
+    # Tuesday 00:05: Monday's 24:20 journey is still to come
+    board = timetable.departures('S1', datetime(2025, 5, 20, 0, 5), limit=2)
+    assert [(d['line_ref'], d['departure_time'], d['scheduled']) for d in board] == [
+        ('N1', '2025-05-20T00:20:00', '00:20'),
+        ('1', '2025-05-20T06:00:00', '06:00'),
+    ]
+
+    # Sunday 00:05: Saturday runs no N1, and Monday's only leaves after Monday's 06:00
+    board = timetable.departures('S1', datetime(2025, 5, 18, 0, 5), limit=2)
+    assert [d['departure_time'] for d in board] == ['2025-05-19T06:00:00', '2025-05-20T00:20:00']
+
+
+def test_departures_fill_the_board_from_the_next_day(make_timetable):
+    timetable = make_timetable([journey(clock(6)), journey(clock(7)), journey(clock(23, 30))])
+
+    board = timetable.departures('S1', datetime(2025, 5, 19, 23, 0), limit=3)
+    assert [d['departure_time'] for d in board] == [
+        '2025-05-19T23:30:00',
+        '2025-05-20T06:00:00',
+        '2025-05-20T07:00:00',
+    ]
+
+
+def test_departures_answer_aware_times_in_the_timetable_zone(make_timetable):
+    timetable = make_timetable([journey(clock(23, 30))])
+
+    # 22:15 UTC is 23:15 in London in May
+    board = timetable.departures('S1', datetime(2025, 5, 19, 22, 15, tzinfo=timezone.utc), limit=1)
+    assert board[0]['departure_time'] == '2025-05-19T23:30:00'
+
+
+def test_departures_skip_the_last_stop_and_unknown_stops(make_timetable):
+    timetable = make_timetable([journey(clock(6))])
+
+    assert timetable.departures('S2', datetime(2025, 5, 19, 5, 0)) is None
+    assert timetable.departures('S3', datetime(2025, 5, 19, 5, 0)) is None
+
+
+def test_build_journeys_skips_a_file_without_services(caplog):
+    document = {'services': [], 'vehicle_journeys': [{'journey_pattern_ref': 'JP1', 'departure_time': '06:00:00'}]}
+    route_result = {'file_name': 'no_service.xml', 'operator_ref': 'TBTN', 'line_ref': '1'}
+    assert build_journeys(document, route_result) == []
+    assert 'no_service.xml' in caplog.text
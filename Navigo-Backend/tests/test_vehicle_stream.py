@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+from ApiCore import build_route_response
+from RouteCatalog import RouteCatalog, build_catalog, save_catalog
+from SiriVmParser import VehicleActivity
+from VehiclePoller import VehiclePoller
+from VehicleStream import VehicleHub, parse_line_keys
+
+STOPS = [
+    {'StopPointRef': f'S{i}', 'CommonName': name, 'LocalityName': 'Derby', 'Latitude': '52.9200',
+     'Longitude': f'{-1.5 + i * 0.005:.4f}'}
+    for i, name in enumerate(['Market Place', 'Corn Market', 'Bus Station', 'Hospital'])
+]
+ROUTE = {
+    'file_name': 'TBTN_IND.xml',
+    'operator_ref': 'TBTN',
+    'operator_name': 'trentbarton',
+    'operator_aliases': ['TBTN', 'trentbarton'],
+    'line_ref': 'Indigo',
+    'route_name': 'Nottingham - Derby',
+    'journey_patterns': [{'journey_pattern_ref': 'JP1', 'direction': 'outbound', 'stop_refs': ['S0', 'S1', 'S2', 'S3'],
+                          'sequences': [1, 2, 3, 4]}]
+}
+
+
+def planned_leg(tmp_path):
+    """A Google transit leg on the Indigo, as getRouteInfo returns it"""
+    path = tmp_path / 'catalog.pkl'
+    save_catalog(build_catalog([ROUTE], STOPS), str(path))
+    catalog = RouteCatalog()
+    catalog.load(str(path))
+
+    leg = {
+        'step_number': 2,
+        'operator': 'trentbarton',
+        'line_short_name': 'Indigo',
+        'departure_stop': 'Corn Market',
+        'arrival_stop': 'Hospital',
+        'start_location': {'lat': 52.92, 'lng': -1.495},
+        'end_location': {'lat': 52.92, 'lng': -1.485},
+        'num_stops': 2
+    }
+    response = build_route_response([], [leg], [('trentbarton', 'Indigo')], [catalog.get('trentbarton', 'Indigo')])
+    return response['data']['transit_details'][0], response['data']['leg_stops'][0]
+
+
+def test_a_planned_leg_names_the_operator_code(tmp_path):
+    leg, leg_stops = planned_leg(tmp_path)
+    assert leg['operator_ref'] == 'TBTN' and leg_stops['operator_ref'] == 'TBTN'
+    assert leg_stops['stop_refs'] == ['S1', 'S2', 'S3']
+
+
+def test_subscribing_with_a_planned_legs_line_receives_its_vehicles(tmp_path):
+    leg, _ = planned_leg(tmp_path)
+    keys = parse_line_keys(f"{leg['operator_ref']}:{leg['line_short_name']}")
+    # Google's agency name is not what BODS files vehicles under
+    assert keys != parse_line_keys(f"{leg['operator']}:{leg['line_short_name']}")
+
+    poller = VehiclePoller(operators='')
+    hub = VehicleHub(poller)
+    bus = VehicleActivity(operator_ref='TBTN', line_ref='IND', published_line_name='Indigo', vehicle_ref='1234',
+                          latitude=52.92, longitude=-1.49)
+
+    async def follow():
+        hub.start(asyncio.get_running_loop())
+        messages = hub.messages(keys)
+        try:
+            snapshot = json.loads(await messages.__anext__())
+            poller.update([bus])
+            delta = json.loads(await asyncio.wait_for(messages.__anext__(), 1))
+            return snapshot, delta
+        finally:
+            await messages.aclose()
+
+    snapshot, delta = asyncio.run(follow())
+    assert snapshot == {'type': 'snapshot', 'lines': [{'operator': 'tbtn', 'line': 'indigo', 'vehicles': []}]}
+    assert delta['type'] == 'delta' and (delta['operator'], delta['line']) == ('tbtn', 'indigo')
+    assert [(vehicle['id'], vehicle['latitude'], vehicle['longitude']) for vehicle in delta['updated']] == [
+        ('TBTN:1234', 52.92, -1.49)]
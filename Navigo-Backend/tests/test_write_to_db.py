@@ -0,0 +1,22 @@
+from write_to_db import partition_route_records
+
+
+def record(operator_ref, line_ref, file_name):
+    return {'operator_ref': operator_ref, 'line_ref': line_ref, 'file_name': file_name}
+
+
+def test_partitions_keep_each_lines_records_together_in_order():
+    records = [record(operator_ref, str(line), f'{operator_ref}_{line}_{i}.xml')
+               for i in range(3) for operator_ref in ('TBTN', 'NDTR') for line in range(20)]
+    groups = list(partition_route_records(iter(records), partitions=4))
+    assert len(groups) == 4
+    assert sorted(r['file_name'] for group in groups for r in group) == sorted(r['file_name'] for r in records)
+
+    lines = {}
+    for index, group in enumerate(groups):
+        for r in group:
+            assert lines.setdefault((r['operator_ref'], r['line_ref']), index) == index
+    assert len(set(lines.values())) > 1
+    # A line's records come back in the order they were read
+    tbtn_1 = [r['file_name'] for group in groups for r in group if r['operator_ref'] == 'TBTN' and r['line_ref'] == '1']
+    assert tbtn_1 == ['TBTN_1_0.xml', 'TBTN_1_1.xml', 'TBTN_1_2.xml']
@@ -1,83 +1,244 @@
+import argparse
 import json
 import os
-from pymongo import MongoClient
-from dotenv import load_dotenv
+import tempfile
+import time
+import zlib
+from pymongo import UpdateOne, InsertOne, DeleteOne, ASCENDING
+from pymongo.errors import BulkWriteError, OperationFailure
+from MongoHandler import get_database, close_client
+from RouteStore import get_routes_collection, ensure_route_indexes, line_route_upserts
 
-load_dotenv()
+BATCH_SIZE = int(os.getenv('MONGO_BATCH_SIZE', '1000'))
+# A full routes load groups lines in this many temporary files, and holds one of them in memory at a time
+ROUTE_PARTITIONS = int(os.getenv('ROUTE_PARTITIONS', '16'))
 
-MONGO_URI = os.getenv('MONGO_URI')
+STOPS_DB = 'Stops'
+STOPS_COLLECTION = 'AllStops'
+# A full stops load goes here first and only replaces AllStops once every write succeeded
+STOPS_STAGING_COLLECTION = 'AllStops_staging'
 
-def process_route_patterns(file_path):
+# MongoDB's error code for a duplicate key
+DUPLICATE_KEY = 11000
+
+def iter_json_array(file_path, chunk_size=1 << 16):
+    """Yield the objects of a top-level JSON array one at a time without loading the whole file"""
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"{file_path} does not contain a JSON array")
+        pos = 1
+        eof = False
+        while True:
+            # Skip whitespace and separators between items
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The next item runs past the end of the buffer, read more of the file.
+                # Reading at least as much as is already buffered keeps large items linear.
+                if eof:
+                    raise
+                chunk = f.read(max(chunk_size, len(buffer) - pos))
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+
+class BulkWriter:
+    """
+    Buffers write operations per collection and sends them as unordered bulk_write batches.
+
+    Operations are keyed on the document they target, so when the same document is written
+    twice before a flush only the last write is kept. That keeps "last write wins" even though
+    the server is free to apply an unordered batch in any order.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = {}
+        self.operations = 0
+        self.batches = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    def add(self, collection, key, operation):
+        ops = self.pending.setdefault(collection.full_name, (collection, {}))[1]
+        ops.pop(key, None)
+        ops[key] = operation
+        if len(ops) >= self.batch_size:
+            self._flush_collection(collection.full_name)
+
+    def _flush_collection(self, full_name):
+        collection, ops = self.pending.pop(full_name)
+        if not ops:
+            return
+        try:
+            collection.bulk_write(list(ops.values()), ordered=False)
+        except BulkWriteError as e:
+            self.errors += len(e.details.get('writeErrors', []))
+            print(f"Bulk write to {full_name} had {len(e.details.get('writeErrors', []))} errors")
+        self.operations += len(ops)
+        self.batches += 1
+
+    def flush(self):
+        for full_name in list(self.pending):
+            self._flush_collection(full_name)
+
+    def report(self, label):
+        elapsed = time.perf_counter() - self.started
+        rate = self.operations / elapsed if elapsed else 0
+        print(f"{label}: {self.operations} writes in {self.batches} batches, {self.errors} errors, "
+              f"{elapsed:.2f}s ({rate:.0f} docs/s)")
+
+def ensure_stop_indexes(collection):
+    collection.create_index([('StopPointRef', ASCENDING)], unique=True)
+
+def create_indexes(ensure_indexes, collection):
+    """Run ensure_indexes(collection) before any write, explaining why a unique index could not be built"""
+    try:
+        ensure_indexes(collection)
+    except OperationFailure as e:
+        if e.code != DUPLICATE_KEY:
+            raise
+        raise RuntimeError(
+            f"{collection.full_name} already holds documents with the same key, so its unique index cannot be "
+            f"built and nothing was written. Remove the duplicate documents and run again. MongoDB reported: {e}") from e
+
+def partition_route_records(route_records, partitions=ROUTE_PARTITIONS):
+    """
+    Yield the route records as lists that each hold every record of their lines, in input order.
+
+    Records are spread over temporary files by a hash of (operator_ref, line_ref) and read back
+    one file at a time, so memory is bounded by about 1/partitions of the input, not all of it.
+    """
+    with tempfile.TemporaryDirectory(prefix='route_partitions_') as directory:
+        files = [open(os.path.join(directory, f'{i}.jsonl'), 'w+', encoding='utf-8') for i in range(partitions)]
+        try:
+            for route_data in route_records:
+                key = f"{route_data['operator_ref']}\0{route_data['line_ref']}".encode('utf-8')
+                f = files[zlib.crc32(key) % partitions]
+                f.write(json.dumps(route_data, ensure_ascii=False))
+                f.write('\n')
+            for f in files:
+                f.seek(0)
+                yield [json.loads(line) for line in f]
+        finally:
+            for f in files:
+                f.close()
+
+def process_route_patterns(file_path, batch_size=BATCH_SIZE, partitions=ROUTE_PARTITIONS):
+
+    collection = get_routes_collection()
+    create_indexes(ensure_route_indexes, collection)
+    writer = BulkWriter(batch_size)
+
+    # A line's files are merged into one document, so each line's records are gathered before it is written
+    for route_records in partition_route_records(iter_json_array(file_path), partitions):
+        for key, operation in line_route_upserts(route_records):
+            writer.add(collection, key, operation)
+
+    writer.flush()
+    writer.report("Route patterns processing complete")
+    return writer
+
+def process_all_stops(file_path, batch_size=BATCH_SIZE):
+    """
+    Replace the Stops database's AllStops collection with the stops in file_path.
+
+    The stops are loaded into a staging collection that is renamed over AllStops only when every
+    write succeeded, so a failed or interrupted load leaves the current stops in place.
+    """
+
+    db = get_database(STOPS_DB)
+    staging = db[STOPS_STAGING_COLLECTION]
+    writer = BulkWriter(batch_size)
+
+    staging.drop()
+    create_indexes(ensure_stop_indexes, staging)
+
+    for stop in iter_json_array(file_path):
+        writer.add(staging, stop['StopPointRef'], InsertOne(stop))
+
+    writer.flush()
+    if writer.errors:
+        raise RuntimeError(f"{writer.errors} stops could not be written, so {STOPS_COLLECTION} was left unchanged; "
+                           f"the partial load is in {staging.full_name}")
+    staging.rename(STOPS_COLLECTION, dropTarget=True)
+    writer.report(f"Inserted stop records into {STOPS_COLLECTION} collection")
+    return writer
+
+def apply_changes(file_path, batch_size=BATCH_SIZE):
+    """Apply an ingest.py --incremental changes file: upsert and delete only what changed"""
+
+    routes_collection = get_routes_collection()
+    stops_collection = get_database(STOPS_DB)[STOPS_COLLECTION]
+    writer = BulkWriter(batch_size)
 
-   
-    client = MongoClient(MONGO_URI)
-    db = client['RouteInfo']
-   
-    with open(file_path, 'r') as f:
-        data = json.load(f)
-    
-    for route_data in data:
-        operator_ref = route_data['operator_ref']
-        operator_name = route_data['operator_name']
-        line_ref = route_data['line_ref']
-        
-        # Prepare the document structure
-        doc = {
-            'line_ref': line_ref,
-            'route_name': route_data['route_name'],
-            'file_name': route_data['file_name'],
-            'journey_patterns': route_data['journey_patterns']
-        }
-        
- 
-        collection = db[f'{operator_name} {operator_ref}']
-     
-        existing_doc = collection.find_one({'line_ref': line_ref})
-        
-        if existing_doc:
-          
-            collection.update_one(
-                {'_id': existing_doc['_id']},
-                {'$set': {
-                    'route_name': doc['route_name'],
-                    'file_name': doc['file_name'],
-                    'journey_patterns': doc['journey_patterns']
-                }}
-            )
-            print(f"Updated document for line_ref: {line_ref} in collection: {operator_ref}")
-        else:
-          
-            collection.insert_one(doc)
-            print(f"Inserted new document for line_ref: {line_ref} in collection: {operator_ref}")
-    
-    client.close()
-    print("Route patterns processing complete.")
-
-def process_all_stops(file_path):
-    """Process all stops and store in Stops database"""
-  
-    client = MongoClient(MONGO_URI)
-    db = client['Stops']
-    collection = db['AllStops']
-    
-    
     with open(file_path, 'r') as f:
-        data = json.load(f)
-    
-  
-    collection.delete_many({})
+        changes = json.load(f)
+
+    create_indexes(ensure_route_indexes, routes_collection)
+    create_indexes(ensure_stop_indexes, stops_collection)
+    # diff_results() lists every record of a changed line, so the line is rewritten whole
+    for key, operation in line_route_upserts(changes['routes']['upsert']):
+        writer.add(routes_collection, key, operation)
+
+    for route_key in changes['routes']['delete']:
+        writer.add(routes_collection, (route_key['operator_ref'], route_key['line_ref']),
+                   DeleteOne({'operator_ref': route_key['operator_ref'], 'line_ref': route_key['line_ref']}))
 
-    collection.insert_many(data)
-    
-    client.close()
-    print(f"Inserted {len(data)} stop records into AllStops collection.")
+    for stop in changes['stops']['upsert']:
+        writer.add(stops_collection, stop['StopPointRef'],
+                   UpdateOne({'StopPointRef': stop['StopPointRef']}, {'$set': stop}, upsert=True))
+
+    for stop_ref in changes['stops']['delete']:
+        writer.add(stops_collection, stop_ref, DeleteOne({'StopPointRef': stop_ref}))
+
+    stale = 0
+    if changes.get('full'):
+        # A full rebuild lists everything that should exist, so remove whatever else is stored
+        line_keys = {(record['operator_ref'], record['line_ref']) for record in changes['routes']['upsert']}
+        for route in routes_collection.find({}, {'_id': 0, 'operator_ref': 1, 'line_ref': 1}):
+            key = (route.get('operator_ref'), route.get('line_ref'))
+            if key not in line_keys:
+                stale += 1
+                writer.add(routes_collection, key, DeleteOne({'operator_ref': key[0], 'line_ref': key[1]}))
+        stop_refs = {stop['StopPointRef'] for stop in changes['stops']['upsert']}
+        for stop in stops_collection.find({}, {'_id': 0, 'StopPointRef': 1}):
+            stop_ref = stop.get('StopPointRef')
+            if stop_ref not in stop_refs:
+                stale += 1
+                writer.add(stops_collection, stop_ref, DeleteOne({'StopPointRef': stop_ref}))
+
+    writer.flush()
+    writer.report(f"Applied {len(changes['routes']['upsert'])} route upserts, "
+                  f"{len(changes['routes']['delete'])} route deletes, {len(changes['stops']['upsert'])} stop upserts "
+                  f"and {len(changes['stops']['delete'])} stop deletes"
+                  + (f"; removed {stale} documents the full rebuild does not list" if changes.get('full') else ''))
 
 if __name__ == '__main__':
-    
-    json_file_path = 'route_patterns.json'
-    
-    # Process route patterns
-    process_route_patterns(json_file_path)
-    
-    # Process all stops
-    process_all_stops("all_stops.json")
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="Load ingested route patterns and stops into MongoDB.")
+    parser.add_argument('--changes', default=None,
+                        help="apply an ingest.py --incremental changes file instead of a full reload")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="operations per bulk_write batch")
+    args = parser.parse_args()
+
+    if args.changes:
+        apply_changes(args.changes, args.batch_size)
+    else:
+        json_file_path = 'route_patterns.json'
+
+        # Process route patterns
+        process_route_patterns(json_file_path, args.batch_size)
+
+        # Process all stops
+        process_all_stops("all_stops.json", args.batch_size)
+
+    close_client()